@@ -43,14 +43,46 @@ if [ "$src" = "$dst" ]; then
     exit 1
 fi
 
-targets="$(find "$src" -mindepth 1 -maxdepth 1 -ignore_readdir_race)"
+if [ ! -d "$src" ]; then
+    echo "SRC '$src' is not a directory"
+    exit 1
+fi
 
-for t in $targets; do
-    if [ -e "$dst/$(basename $t)" ]; then
-        echo "SRC and DST have a conflict '$(basename $t)'"
-        exit 1
-    fi
-done
+if [ ! -d "$dst" ]; then
+    echo "DST '$dst' is not a directory"
+    exit 1
+fi
+
+# list the names in a directory null delimited and sorted bytewise, so they can be compared by comm without any name
+# being word split or mangled
+list() {
+    find "$1" -mindepth 1 -maxdepth 1 -ignore_readdir_race -printf '%f\0' | LC_ALL=C sort --zero-terminated
+}
+
+# report each name given null delimited on stdin as a conflict, failing if there were any
+report_conflicts() {
+    local name conflicts=false
+
+    while IFS= read -r -d '' name; do
+        echo "SRC and DST have a conflict '$name'"
+        conflicts=true
+    done
+
+    ! $conflicts
+}
+
+if ! LC_ALL=C comm -z -12 <(list "$src") <(list "$dst") | report_conflicts; then
+    exit 1
+fi
+
+# mv --no-clobber renames with RENAME_NOREPLACE, so anything created in DST since the check is never overwritten, and
+# xargs moves the entries in as many batches as the argument limit needs
+find "$src" -mindepth 1 -maxdepth 1 -ignore_readdir_race -print0 \
+    | xargs --null --no-run-if-empty mv --verbose --no-clobber --target-directory "$dst"
+
+# anything left behind conflicted with an entry created in DST after the check
+if ! list "$src" | report_conflicts; then
+    exit 1
+fi
 
-mv --verbose --target-directory "$dst" $targets
 rmdir --verbose "$src"
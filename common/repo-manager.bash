@@ -10,12 +10,20 @@ fi
 GITHUB_REGISTRY=${GITHUB_REGISTRY:-github.com}
 SSH_USER=${SSH_USER:-git}
 REPO_ROOT=${REPO_ROOT:="$HOME/workspaces"}
+REPO_CACHE=${REPO_CACHE:="$REPO_ROOT/.repo-manager"}
+# mirrors which batch clones borrow objects from, unlike REPO_CACHE this must never be deleted
+REPO_REFERENCES=${REPO_REFERENCES:="$REPO_ROOT/.references"}
 CLEAN_AFTER=${CLEAN_AFTER:-28}
+MAINTAIN_AFTER=${MAINTAIN_AFTER:-7}
 DEFAULT_CLONE_PROTO=${DEFAULT_CLONE_PROTO:=ssh}
+DO_NOT_SYNC=${DO_NOT_SYNC:-}
+CLONE_FILTER=${CLONE_FILTER:-}
+CLONE_DEPTH=${CLONE_DEPTH:-}
+CLONE_SPARSE=${CLONE_SPARSE:-}
 
 show_config() {
 	local column_length=20
-	local vars=(GITHUB_REGISTRY SSH_USER REPO_ROOT CLEAN_AFTER DEFAULT_CLONE_PROTO DO_NOT_CLEAN)
+	local vars=(GITHUB_REGISTRY SSH_USER REPO_ROOT CLEAN_AFTER MAINTAIN_AFTER DEFAULT_CLONE_PROTO DO_NOT_CLEAN DO_NOT_SYNC CLONE_FILTER CLONE_DEPTH CLONE_SPARSE)
 
 	for var in ${vars[@]}; do
 		printf "%${column_length}s: %s\n" $var ${!var}
@@ -41,10 +49,504 @@ for_each_repo() {
 	done
 }
 
+# pool_start prepares a worker pool which will run at most $1 jobs at once. Jobs are added with pool_submit and the pool
+# is drained with pool_wait. Only one pool may be in use at a time. If $2 is 'true' the output of each job is streamed
+# as it is written rather than being buffered and printed in submission order.
+pool_start() {
+	POOL_JOBS="$1"
+	POOL_STREAM="${2:-false}"
+	POOL_DIR="$(mktemp --directory)"
+	POOL_SUBMITTED=0
+	POOL_RUNNING=0
+	POOL_FLUSHED=0
+}
+
+# pool_flush prints the output of every finished job which has no unfinished job submitted before it, so output is
+# always printed in submission order.
+pool_flush() {
+	while [ -e "$POOL_DIR/$POOL_FLUSHED.done" ]; do
+		cat "$POOL_DIR/$POOL_FLUSHED"
+		POOL_FLUSHED=$((POOL_FLUSHED + 1))
+	done
+}
+
+# pool_cancel stops every submitted job and skips any jobs submitted afterwards. Since it only relies on the pool's
+# directory it may also be called from outside of the pool, like by a process reading the pool's output. Jobs are only
+# stopped entirely when job control is enabled (set -m), since each job then has its own process group.
+pool_cancel() {
+	local pid
+
+	# the pool may have already finished and removed its directory
+	: > "$POOL_DIR/cancel" 2> /dev/null
+
+	while read pid; do
+		kill -- "-$pid" 2> /dev/null || kill "$pid" 2> /dev/null
+	done < "$POOL_DIR/pids" 2> /dev/null
+}
+
+# pool_reap waits for a single job to finish, then prints any output which is ready.
+pool_reap() {
+	wait -n 2> /dev/null
+	POOL_RUNNING=$((POOL_RUNNING - 1))
+	pool_flush
+}
+
+# pool_submit runs the given command in the background as soon as a worker is free. Jobs never read from stdin.
+pool_submit() {
+	local out="$POOL_DIR/$POOL_SUBMITTED"
+
+	while [ $POOL_RUNNING -ge $POOL_JOBS ]; do
+		pool_reap
+	done
+
+	if [ -e "$POOL_DIR/cancel" ]; then
+		return
+	fi
+
+	if $POOL_STREAM; then
+		"$@" < /dev/null &
+	else
+		{
+			"$@" > "$out" 2>&1 < /dev/null
+			: > "$out.done"
+		} &
+	fi
+
+	echo $! >> "$POOL_DIR/pids"
+
+	# the pool may have been cancelled after the check above but before the job was recorded
+	if [ -e "$POOL_DIR/cancel" ]; then
+		pool_cancel
+	fi
+
+	POOL_SUBMITTED=$((POOL_SUBMITTED + 1))
+	POOL_RUNNING=$((POOL_RUNNING + 1))
+}
+
+# pool_wait waits for all submitted jobs to finish and prints any remaining output.
+pool_wait() {
+	wait
+	pool_flush
+	rm --recursive --force "$POOL_DIR"
+}
+
+# for_each_repo_parallel behaves like for_each_repo, but runs the command ($2) for up to $1 repos at once. The output of
+# each command is buffered and printed in the same order for_each_repo would have visited the repos.
+for_each_repo_parallel() {
+	pool_start "$1"
+	for_each_repo "pool_submit $2"
+	pool_wait
+}
+
+# index_update brings the repo index at '$REPO_CACHE/index' up to date and prints each entry as soon as it is written.
+# Each line of the index has the form:
+#
+#   <owner>/<repo>|<config mtime>|<HEAD mtime>|<origin>|<upstream>|<clone mode>|<last activity>
+#
+# Remotes and the clone mode are only re-read for repos whose '.git/config' or '.git/HEAD' changed since the index was
+# last written, and repos which no longer exist are dropped. The last activity is the newest mtime of '.git/config',
+# '.git/HEAD', '.git/index', and '.git/logs/HEAD' as seconds since the epoch. Git configs are parsed directly by a single
+# awk process rather than by running git for each repo. Values are stored escaped as in a json string, with '|' as
+# '\u007c', so they can never break the index's lines or fields.
+index_update() {
+	local index="$REPO_CACHE/index"
+	local git_dir
+
+	if ! [ -d "$REPO_ROOT" ]; then
+		return
+	fi
+
+	mkdir --parents "$REPO_CACHE"
+
+	for git_dir in "$REPO_ROOT"/*/*/.git; do
+		if [ -d "$git_dir" ]; then
+			printf '%s\0' "$git_dir/config" "$git_dir/HEAD" "$git_dir/index" "$git_dir/logs/HEAD"
+		fi
+	done | xargs --null --no-run-if-empty stat --format '%n|%.9Y' 2> /dev/null | awk -F '|' -v root="$REPO_ROOT/" -v old_index="$index" '
+		# encode escapes the value as in a json string, along with the index field separator
+		function encode(value,    result, c, i) {
+			result = ""
+
+			for (i = 1; i <= length(value); i++) {
+				c = substr(value, i, 1)
+
+				if (c == "\\" || c == "\"") {
+					c = "\\" c
+				} else if (c == "\n") {
+					c = "\\n"
+				} else if (c == "\t") {
+					c = "\\t"
+				} else if (c == "\r") {
+					c = "\\r"
+				} else if (c == "|") {
+					c = "\\u007c"
+				} else if (c in control) {
+					c = sprintf("\\u%04x", control[c])
+				}
+
+				result = result c
+			}
+
+			return result
+		}
+
+		# value reads the value of a git config variable, dropping quotes and comments and resolving escapes, then
+		# encodes it for the index
+		function value(line,    result, quoted, c, i) {
+			sub(/^[^=]*=[ \t]*/, "", line)
+			sub(/[ \t\r]+$/, "", line)
+
+			result = ""
+			quoted = 0
+
+			for (i = 1; i <= length(line); i++) {
+				c = substr(line, i, 1)
+
+				if (c == "\\") {
+					c = substr(line, ++i, 1)
+
+					if (c == "n") {
+						c = "\n"
+					} else if (c == "t") {
+						c = "\t"
+					}
+				} else if (c == "\"") {
+					quoted = !quoted
+					continue
+				} else if ((c == "#" || c == ";") && !quoted) {
+					break
+				}
+
+				result = result c
+			}
+
+			sub(/[ \t]+$/, "", result)
+
+			return encode(result)
+		}
+
+		# parse reads the origin url, upstream url, and clone mode from a git config
+		function parse(path,    line, section, key, i) {
+			origin = upstream = mode = section = ""
+
+			while ((getline line < path) > 0) {
+				if (line ~ /^[ \t]*\[/) {
+					section = line
+					sub(/^[ \t]*\[[ \t]*/, "", section)
+					sub(/[ \t]*\].*$/, "", section)
+
+					# section names are case insensitive but subsection names are not
+					if ((i = index(section, " ")) > 0) {
+						section = tolower(substr(section, 1, i - 1)) substr(section, i)
+					} else {
+						section = tolower(section)
+					}
+
+					continue
+				}
+
+				key = line
+				sub(/^[ \t]*/, "", key)
+				sub(/[ \t]*(=.*)?$/, "", key)
+				key = tolower(key)
+
+				if (section == "remote \"origin\"" && key == "url" && origin == "") {
+					origin = value(line)
+				} else if (section == "remote \"upstream\"" && key == "url" && upstream == "") {
+					upstream = value(line)
+				} else if (section == "repomanager" && key == "clonemode") {
+					mode = value(line)
+				}
+			}
+
+			close(path)
+		}
+
+		# flush prints the entry for the current repo
+		function flush(    fields, entry) {
+			if (name == "" || config_mtime == "" || head_mtime == "") {
+				return
+			}
+
+			entry = ""
+
+			if (name in cached) {
+				split(cached[name], fields, "|")
+
+				# mtimes are compared as strings since they are more precise than awk numbers
+				if (fields[2] "" == config_mtime "" && fields[3] "" == head_mtime "") {
+					entry = fields[4] "|" fields[5] "|" fields[6]
+				}
+			}
+
+			if (entry == "") {
+				parse(root name "/.git/config")
+				entry = origin "|" upstream "|" mode
+			}
+
+			print name "|" config_mtime "|" head_mtime "|" entry "|" activity
+			fflush()
+		}
+
+		BEGIN {
+			for (i = 1; i < 32; i++) {
+				control[sprintf("%c", i)] = i
+			}
+
+			while ((getline line < old_index) > 0) {
+				cached[substr(line, 1, index(line, "|") - 1)] = line
+			}
+
+			close(old_index)
+		}
+
+		{
+			path = substr($1, length(root) + 1)
+			split(path, parts, "/")
+
+			if (parts[1] "/" parts[2] != name) {
+				flush()
+
+				name = parts[1] "/" parts[2]
+				config_mtime = head_mtime = ""
+				activity = 0
+			}
+
+			file = substr(path, length(name) + 7)
+
+			if (file == "config") {
+				config_mtime = $2
+			} else if (file == "HEAD") {
+				head_mtime = $2
+			}
+
+			if (int($2) > activity) {
+				activity = int($2)
+			}
+		}
+
+		END {
+			flush()
+		}
+	' | tee --output-error=warn-nopipe "$index.$$"
+
+	mv "$index.$$" "$index"
+}
+
+# index_remove drops the given <owner>/<repo> ($1) from the repo index.
+index_remove() {
+	local index="$REPO_CACHE/index"
+
+	if ! [ -f "$index" ]; then
+		return
+	fi
+
+	awk -F '|' -v name="$1" '$1 != name' "$index" > "$index.$$"
+	mv "$index.$$" "$index"
+}
+
+# repo_is_active returns 0 if the repo at $1 (<owner>/<repo> $2/$3) has been active since the mtime of the reference file
+# $4. Cheap signals under '.git' (the HEAD reflog and the index) are checked before walking the tracked files, and the
+# walk stops at the first file newer than the reference. FETCH_HEAD is not a signal since 'sync' fetches every repo.
+# When activity is found its time is cached as the mtime of '$REPO_CACHE/activity/<owner>/<repo>' so later runs can
+# skip the checks while that activity is recent enough.
+repo_is_active() {
+	local repo_dir="$1"
+	local cache="$REPO_CACHE/activity/$2/$3"
+	local ref="$4"
+	local recent=""
+	local path
+
+	if [ "$cache" -nt "$ref" ]; then
+		return 0
+	fi
+
+	for path in "$repo_dir/.git/logs/HEAD" "$repo_dir/.git/index"; do
+		if [ "$path" -nt "$ref" ]; then
+			recent="$path"
+			break
+		fi
+	done
+
+	if [ -z "$recent" ]; then
+		while IFS= read -r -d '' path; do
+			if [ "$repo_dir/$path" -nt "$ref" ]; then
+				recent="$repo_dir/$path"
+				break
+			fi
+		done < <(git -C "$repo_dir" ls-files -z)
+	fi
+
+	if [ -z "$recent" ]; then
+		return 1
+	fi
+
+	mkdir --parents "$(dirname "$cache")"
+	touch --reference "$recent" "$cache"
+}
+
+# in_list returns 0 if the comma separated list ($1) contains the given <owner>/<repo> ($2).
+in_list() {
+	[[ ",$1," == *",$2,"* ]]
+}
+
+# elapsed_since prints the seconds since $1, which is expected to be a value of ${EPOCHREALTIME/./}.
+elapsed_since() {
+	local elapsed=$((${EPOCHREALTIME/./} - $1))
+
+	printf '%d.%02d' $((elapsed / 1000000)) $((elapsed % 1000000 / 10000))
+}
+
+# expect_number exits if the flag ($1) was not given a value ($2) or if that value is not a number.
+expect_number() {
+	if [ $# -lt 2 ]; then
+		echo "Expected value for '$1' but found none"
+		exit 1
+	fi
+
+	if ! printf '%d' $2 &> /dev/null; then
+		echo "'$1' expected a number but found '$2'"
+		exit 1
+	fi
+}
+
+# clone_reference creates or refreshes a bare mirror of the url ($1) at $2 for other clones to borrow objects from.
+# Unreachable objects are never pruned from the mirror since clones borrowing from it may still need them.
+clone_reference() {
+	if [ -d "$2" ]; then
+		git -C "$2" fetch --quiet
+	else
+		git clone --mirror --quiet "$1" "$2" && git -C "$2" config gc.pruneExpire never
+	fi
+}
+
+# clone_batch clones each repo listed in a file ($1), running up to $2 clones at once. Each line holds the args for a
+# single clone (ex. '<owner> <repo>' or '--upstream <url> <url>'), blank lines and lines starting with '#' are ignored.
+# Any remaining args are passed to every clone. Repos which share an upstream borrow objects from a mirror of that
+# upstream under '$REPO_REFERENCES' so the shared objects are only downloaded and stored once. Since the clones have no
+# copy of those objects the mirrors are kept apart from the disposable REPO_CACHE.
+clone_batch() {
+	local file="$1"
+	local jobs="$2"
+	shift 2
+
+	local -A upstream_counts
+	local -a line_upstreams
+	local -a words
+	local line
+	local upstream
+	local reference
+	local stats_dir
+	local name
+	local status
+	local seconds
+	local bytes
+	local failed=false
+	local i
+
+	if ! [ -f "$file" ]; then
+		echo "no such file '$file'"
+		exit 1
+	fi
+
+	while read -r line || [ -n "$line" ]; do
+		if [ -z "$line" ] || [[ "$line" == \#* ]]; then
+			continue
+		fi
+
+		read -r -a words <<< "$line"
+		upstream=""
+
+		for ((i = 0; i < ${#words[@]}; i++)); do
+			if [ "${words[$i]}" = --upstream ] || [ "${words[$i]}" = -u ]; then
+				upstream="${words[$((i + 1))]}"
+			fi
+		done
+
+		if [ -n "$upstream" ]; then
+			upstream_counts[$upstream]=$((${upstream_counts[$upstream]:-0} + 1))
+		fi
+
+		line_upstreams+=("$upstream")
+	done < "$file"
+
+	pool_start "$jobs"
+	for upstream in "${!upstream_counts[@]}"; do
+		if [ "${upstream_counts[$upstream]}" -gt 1 ]; then
+			pool_submit clone_reference "$upstream" "$REPO_REFERENCES/${upstream//[^[:alnum:].-]/_}"
+		fi
+	done
+	pool_wait
+
+	# clone_batch_each runs a single clone from the batch. The clone is run in a subshell since it exits on errors.
+	clone_batch_each() {
+		local clone_stats="$1"
+		shift
+
+		( clone "$@" )
+	}
+
+	stats_dir="$(mktemp --directory)"
+	i=0
+
+	pool_start "$jobs"
+	while read -r line || [ -n "$line" ]; do
+		if [ -z "$line" ] || [[ "$line" == \#* ]]; then
+			continue
+		fi
+
+		read -r -a words <<< "$line"
+		upstream="${line_upstreams[$i]}"
+		reference=""
+
+		if [ -n "$upstream" ] && [ "${upstream_counts[$upstream]}" -gt 1 ]; then
+			reference="$REPO_REFERENCES/${upstream//[^[:alnum:].-]/_}"
+		fi
+
+		pool_submit clone_batch_each "$stats_dir/$i" ${reference:+--reference "$reference"} "$@" "${words[@]}"
+		i=$((i + 1))
+	done < "$file"
+	pool_wait
+
+	index_update > /dev/null
+
+	echo
+	printf "%-35s%-10s%-10s%s\n" owner/repo status seconds bytes
+
+	for ((i = 0; i < ${#line_upstreams[@]}; i++)); do
+		if [ -f "$stats_dir/$i" ]; then
+			IFS='|' read -r name status seconds bytes < "$stats_dir/$i"
+		else
+			name="line $((i + 1))"
+			status=failed
+			seconds=""
+			bytes=""
+		fi
+
+		if [ "$status" != ok ]; then
+			failed=true
+		fi
+
+		printf "%-35s%-10s%-10s%s\n" "$name" "$status" "$seconds" "$bytes"
+	done
+
+	rm --recursive --force "$stats_dir"
+
+	if $failed; then
+		exit 1
+	fi
+}
+
 clone() {
 	local https
 	local ssh
 	local upstream
+	local reference
+	local from_file
+	local jobs=1
+	local filter="$CLONE_FILTER"
+	local depth="$CLONE_DEPTH"
+	local sparse="$CLONE_SPARSE"
 
 	case "$DEFAULT_CLONE_PROTO" in
 		https )
@@ -86,16 +588,81 @@ clone() {
 				shift
 				;;
 
+			--reference | -r )
+				reference="$2"
+
+				shift
+				shift
+				;;
+
+			--filter )
+				filter="$2"
+
+				shift
+				shift
+				;;
+
+			--depth )
+				expect_number "$@"
+				depth="$2"
+
+				shift
+				shift
+				;;
+
+			--sparse )
+				sparse="$2"
+
+				shift
+				shift
+				;;
+
+			--full )
+				filter=""
+				depth=""
+				sparse=""
+
+				shift
+				;;
+
+			--from-file | -f )
+				from_file="$2"
+
+				shift
+				shift
+				;;
+
+			--jobs | -j )
+				expect_number "$@"
+				jobs="$2"
+
+				shift
+				shift
+				;;
+
 			--help | -h )
-				echo "$(basename $0) [-h] clone <url> | <owner> <repo>
+				echo "$(basename $0) [-h] clone <url> | <owner> <repo> | --from-file <file>
 
 Clone a github repo. The repo will be cloned into the REPO_ROOT directory at the path <owner>/<repo>.
 
 Args:
-	--help, -h            Show this help text.
-	--upstream, -u <url>  Create an additional remote named "upstream" pointing to the given url.
-	--ssh                 Clone using ssh (only useful when cloning with owner / repo pair)
-	--https               Clone using https (only useful when cloning with owner / repo pair)
+	--help, -h              Show this help text.
+	--upstream, -u <url>    Create an additional remote named "upstream" pointing to the given url.
+	--ssh                   Clone using ssh (only useful when cloning with owner / repo pair)
+	--https                 Clone using https (only useful when cloning with owner / repo pair)
+	--reference, -r <repo>  Borrow objects from a local repo rather than downloading them again. Deleting or pruning that
+	                        repo will break the clone.
+	--from-file, -f <file>  Clone every repo in the file, one '<url>' or '<owner> <repo>' per line. Each line may also
+	                        give '--upstream <url>'. Repos sharing an upstream borrow objects from a single mirror of
+	                        it under REPO_REFERENCES, which must not be deleted while those repos exist. A summary of
+	                        time and object bytes per repo is shown once all clones are done.
+	--jobs, -j N            Run up to N clones at once when using '--from-file'.
+	--filter <spec>         Make a partial clone using the given filter (ex. 'blob:none'). [CLONE_FILTER]
+	--depth N               Make a shallow clone with N commits of history. [CLONE_DEPTH]
+	--sparse <paths>        Only check out the given comma separated directories. [CLONE_SPARSE]
+	--full                  Make a full clone, ignoring any filter, depth, or sparse paths from the config.
+
+The mode a repo was cloned with is stored as 'repomanager.clonemode' in its git config and is shown by 'list'.
 				"
 				exit
 				;;
@@ -106,6 +673,17 @@ Args:
 		esac
 	done
 
+	if [ -n "$from_file" ]; then
+		if [ $# -gt 0 ]; then
+			echo "found more args than expected"
+			exit 1
+		fi
+
+		clone_batch "$from_file" "$jobs" $($https && echo --https) $($ssh && echo --ssh) --full \
+			${filter:+--filter "$filter"} ${depth:+--depth "$depth"} ${sparse:+--sparse "$sparse"}
+		return
+	fi
+
 	local clone_url
 	local owner
 	local repo
@@ -150,12 +728,50 @@ Args:
 	esac
 
 	local clone_dir="$REPO_ROOT/$owner/$repo"
+	local start=${EPOCHREALTIME/./}
+	local bytes
+	local mode=""
+
+	if [ -n "$filter" ]; then
+		mode+=" filter=$filter"
+	fi
+
+	if [ -n "$depth" ]; then
+		mode+=" depth=$depth"
+	fi
 
-	git clone "$clone_url" "$clone_dir"
+	if [ -n "$sparse" ]; then
+		mode+=" sparse=$sparse"
+	fi
+
+	if ! git clone ${reference:+--reference-if-able "$reference"} ${filter:+--filter="$filter"} ${depth:+--depth "$depth"} \
+			${sparse:+--sparse} "$clone_url" "$clone_dir"; then
+		if [ -n "$clone_stats" ]; then
+			printf '%s|failed||\n' "$owner/$repo" > "$clone_stats"
+		fi
+
+		exit 1
+	fi
+
+	if [ -n "$sparse" ]; then
+		git -C "$clone_dir" sparse-checkout set ${sparse//,/ }
+	fi
+
+	mode="${mode# }"
+	git -C "$clone_dir" config repomanager.clonemode "${mode:-full}"
 
 	if [ -n "$upstream" ]; then
 		git -C "$clone_dir" remote add upstream "$upstream"
 	fi
+
+	# clone_stats is only set when run by clone_batch, which updates the index itself once all clones are done
+	if [ -n "$clone_stats" ]; then
+		read -r bytes _ < <(du --summarize --bytes "$clone_dir/.git/objects")
+		printf '%s|ok|%s|%s\n' "$owner/$repo" "$(elapsed_since $start)" "$bytes" > "$clone_stats"
+		return
+	fi
+
+	index_update > /dev/null
 }
 
 clean() {
@@ -163,6 +779,9 @@ clean() {
 	local repo_dir
 	local force=false
 	local after=$CLEAN_AFTER
+	local jobs=1
+	local stale_dir
+	local activity_ref
 
 	while [ $# -gt 0 ]; do
 		case $1 in
@@ -171,20 +790,19 @@ clean() {
 				;;
 			
 			--after | -a )
-				if [ $# -lt 2 ]; then
-					echo "Expected value for '$1' but found none"
-					exit 1
-				fi
-
-				if ! printf '%d' $2 &> /dev/null; then
-					echo "'$1' expected a number but found '$2'"
-					exit 1
-				fi
+				expect_number "$@"
 
 				after="$2"
 				shift
 				;;
 
+			--jobs | -j )
+				expect_number "$@"
+
+				jobs="$2"
+				shift
+				;;
+
 			--help | -h )
 				echo "$0 clean [-h] -f]
 
@@ -192,6 +810,7 @@ Clean up your repositories
 
 Args:
   --after, -a N  Clean repos after N many days without any modification 
+  --jobs, -j N   Check up to N repos at once. Confirmation prompts are only shown after every repo has been checked.
   --yes, -y      Do not ask for confirmation before deleting repositories unless there are unstaged changes.
   --help, -h     Show this help text."
 				exit 1
@@ -201,48 +820,55 @@ Args:
 		shift
 	done
 
-	clean_each() {
+	# clean_check prints why a repo should be kept, or returns 0 if the repo is stale and can be deleted.
+	clean_check() {
 		local repo_dir="$1"
 		local owner="$2"
 		local repo="$3"
 
-		local answer=""
-
 		# todo: add validation to DO_NOT_CLEAN?
-		if [[ "$DO_NOT_CLEAN" =~ .*[,]?$owner/$repo[,]?.* ]]; then
+		if in_list "$DO_NOT_CLEAN" "$owner/$repo"; then
 			echo skipping $owner/$repo
-			return
-		elif [ -n "$(git -C "$repo_dir" status --porcelain)" ]; then
+			return 1
+		elif [ -n "$(git --no-optional-locks -C "$repo_dir" status --porcelain)" ]; then
 			echo "repo '$owner/$repo' has an unclean worktree, skipping"
-			return
+			return 1
 		elif [ -z "$(git -C "$repo_dir" remote)" ]; then
 			echo "repo '$owner/$repo' has no remotes, skipping"
-			return
+			return 1
 		fi
 
-		if [ -z "$(find $repo_dir -not -path '*.git*' -mtime "-$after")" ]; then
-			if $force; then
-				answer=Y
-			fi
+		! repo_is_active "$repo_dir" "$owner" "$repo" "$activity_ref"
+	}
 
-			until [[ $answer =~ ^[ynYN]$ ]]; do
-				# we do not use 'read -p' here to make testing this path easier
-				echo -n "delete '$owner/$repo'? [N|y]"
-				read answer
+	# clean_delete deletes a stale repo, asking for confirmation first unless '--yes' was given.
+	clean_delete() {
+		local repo_dir="$1"
+		local owner="$2"
+		local repo="$3"
+
+		local answer=""
+
+		if $force; then
+			answer=Y
+		fi
 
-				if [ -z $answer ]; then
-					answer=N
-				else
-					echo
-				fi
-			done
+		until [[ $answer =~ ^[ynYN]$ ]]; do
+			# we do not use 'read -p' here to make testing this path easier
+			echo -n "delete '$owner/$repo'? [N|y]"
+			read answer
 
-			if [[ $answer =~ [yY] ]]; then
-				rm --recursive --force "$repo_dir"
+			if [ -z $answer ]; then
+				answer=N
+			else
+				echo
 			fi
+		done
 
-			# todo: can probably be deleted
-			answer=""
+		if [[ $answer =~ [yY] ]]; then
+			rm --recursive --force "$repo_dir" "$REPO_CACHE/activity/$owner/$repo" "$REPO_CACHE/du/$owner/$repo" \
+				"$REPO_CACHE/maintained/$owner/$repo"
+			index_remove "$owner/$repo"
 		fi
 
 		if [ -z "$(ls -A $(dirname $1))" ]; then
@@ -250,38 +876,603 @@ Args:
 		fi
 	}
 
-	for_each_repo clean_each
+	clean_each() {
+		if clean_check "$@"; then
+			clean_delete "$@"
+		fi
+	}
+
+	# clean_check_each marks stale repos so they can be deleted once all parallel checks are done.
+	clean_check_each() {
+		if clean_check "$@"; then
+			mkdir --parents "$stale_dir/$2"
+			: > "$stale_dir/$2/$3"
+		fi
+	}
+
+	clean_stale_each() {
+		if [ -e "$stale_dir/$2/$3" ]; then
+			clean_delete "$@"
+		fi
+	}
+
+	activity_ref="$(mktemp)"
+	touch --date "$after days ago" "$activity_ref"
+
+	if [ "$jobs" -gt 1 ]; then
+		stale_dir="$(mktemp --directory)"
+
+		for_each_repo_parallel "$jobs" clean_check_each
+		for_each_repo clean_stale_each
+
+		rm --recursive --force "$stale_dir"
+	else
+		for_each_repo clean_each
+	fi
+
+	rm --force "$activity_ref"
 }
 
-list() {
-	local column_length=35
-	local url_column_length=50
-	local format_str="%-${column_length}s%-${url_column_length}s%-${url_column_length}s\n"
+sync() {
+	local jobs=1
 
-	local origin
-	local upstream
+	while [ $# -gt 0 ]; do
+		case $1 in
+			--jobs | -j )
+				expect_number "$@"
 
-	printf "%-${column_length}s%-${url_column_length}s%-${url_column_length}s\n" owner/repo origin upstream
+				jobs="$2"
+				shift
+				;;
+
+			--help | -h )
+				echo "$0 sync [-h] [-j N]
 
-	list_each() {
-		pushd $repo_dir &> /dev/null
+Fetch the origin and upstream remotes of every repository. Repos listed in DO_NOT_SYNC or DO_NOT_CLEAN are skipped.
+
+Args:
+  --jobs, -j N  Fetch up to N repos at once.
+  --help, -h    Show this help text."
+				exit 1
+				;;
+
+			* )
+				echo "Unrecognized argument '$1'"
+				exit 1
+				;;
+		esac
+
+		shift
+	done
+
+	sync_each() {
+		local repo_dir="$1"
+		local owner="$2"
+		local repo="$3"
 
-		origin="$(git remote get-url origin 2> /dev/null)"
-		if [ $? -ne 0 ]; then
-			origin=""
+		local start=${EPOCHREALTIME/./}
+		local status=ok
+		local remote
+		local fetched=false
+
+		if in_list "$DO_NOT_SYNC" "$owner/$repo" || in_list "$DO_NOT_CLEAN" "$owner/$repo"; then
+			printf "%-35s%-10s\n" "$owner/$repo" skipped
+			return
+		fi
+
+		for remote in $(git -C "$repo_dir" remote); do
+			if [ "$remote" != origin ] && [ "$remote" != upstream ]; then
+				continue
+			fi
+
+			fetched=true
+
+			if ! git -C "$repo_dir" fetch --quiet "$remote"; then
+				status=failed
+			fi
+		done
+
+		if ! $fetched; then
+			status="no-remote"
+		fi
+
+		printf "%-35s%-10s%s\n" "$owner/$repo" "$status" "$(elapsed_since $start)"
+	}
+
+	printf "%-35s%-10s%s\n" owner/repo status seconds
+	for_each_repo_parallel "$jobs" sync_each
+}
+
+disk_usage() {
+	local jobs=1
+	local top=""
+	local refresh=false
+
+	while [ $# -gt 0 ]; do
+		case $1 in
+			--jobs | -j )
+				expect_number "$@"
+
+				jobs="$2"
+				shift
+				;;
+
+			--top | -t )
+				expect_number "$@"
+
+				top="$2"
+				shift
+				;;
+
+			--refresh | -r )
+				refresh=true
+				;;
+
+			--help | -h )
+				echo "$0 du [-h] [-j N] [-t N] [-r]
+
+Show how much disk space each repository uses, largest first. Sizes are in bytes:
+  total        everything under the repo directory
+  worktree     everything except '.git'
+  objects      '.git/objects'
+  reclaimable  untracked and ignored files
+
+Results are cached under REPO_CACHE and reused until the mtime of the repo directory, '.git/HEAD', '.git/index',
+'.git/objects', or '.git/objects/pack' changes. Changes deeper in the worktree do not invalidate the cache, use
+'--refresh' to pick them up.
+
+Args:
+  --jobs, -j N   Scan up to N repos at once.
+  --top, -t N    Only show the N largest repos.
+  --refresh, -r  Ignore cached results.
+  --help, -h     Show this help text."
+				exit 1
+				;;
+
+			* )
+				echo "Unrecognized argument '$1'"
+				exit 1
+				;;
+		esac
+
+		shift
+	done
+
+	disk_usage_each() {
+		local repo_dir="$1"
+		local cache="$REPO_CACHE/du/$2/$3"
+		local path
+		local worktree
+		local objects
+		local reclaimable
+		local stale=$refresh
+
+		if ! [ -f "$cache" ]; then
+			stale=true
+		fi
+
+		for path in "$repo_dir" "$repo_dir/.git/HEAD" "$repo_dir/.git/index" "$repo_dir/.git/objects" "$repo_dir/.git/objects/pack"; do
+			if [ "$path" -nt "$cache" ]; then
+				stale=true
+			fi
+		done
+
+		if ! $stale; then
+			echo "$2/$3|$(< "$cache")"
+			return
+		fi
+
+		read -r worktree _ < <(command du --summarize --bytes --exclude=.git "$repo_dir")
+		read -r objects _ < <(command du --summarize --bytes "$repo_dir/.git/objects")
+		read -r reclaimable _ < <(git -C "$repo_dir" ls-files -z --others --directory |
+			(cd "$repo_dir" && command du --summarize --total --bytes --files0-from=- | tail -n 1))
+
+		mkdir --parents "$(dirname "$cache")"
+		echo "$((worktree + objects))|$worktree|$objects|$reclaimable" | tee "$cache" | sed "s|^|$2/$3\||"
+	}
+
+	for_each_repo_parallel "$jobs" disk_usage_each | sort --field-separator '|' --key 2,2nr | head --lines "${top:--0}" |
+		awk -F '|' '
+			BEGIN {
+				printf "%-35s%-15s%-15s%-15s%s\n", "owner/repo", "total", "worktree", "objects", "reclaimable"
+			}
+
+			{
+				printf "%-35s%-15s%-15s%-15s%s\n", $1, $2, $3, $4, $5
+			}
+		'
+}
+
+maintain() {
+	local jobs=1
+	local after=$MAINTAIN_AFTER
+	local force=false
+	local niceness=10
+	local io_class=""
+	local -a prefix
+	local maintained_ref
+
+	while [ $# -gt 0 ]; do
+		case $1 in
+			--jobs | -j )
+				expect_number "$@"
+
+				jobs="$2"
+				shift
+				;;
+
+			--after | -a )
+				expect_number "$@"
+
+				after="$2"
+				shift
+				;;
+
+			--force | -f )
+				force=true
+				;;
+
+			--nice | -n )
+				expect_number "$@"
+
+				niceness="$2"
+				shift
+				;;
+
+			--ionice | -i )
+				case "$2" in
+					idle | best-effort )
+						io_class="$2"
+						;;
+					* )
+						echo "'$1' expected 'idle' or 'best-effort' but found '$2'"
+						exit 1
+						;;
+				esac
+
+				shift
+				;;
+
+			--help | -h )
+				echo "$0 maintain [-h] [-j N] [-a N] [-f] [-n N] [-i idle|best-effort]
+
+Run git maintenance (pack-refs, gc, commit-graph, and multi-pack-index) for every repository. Loose objects, packs, and
+'git status' time are shown before -> after each repo is maintained. Repos maintained within the last MAINTAIN_AFTER
+days are skipped.
+
+Args:
+  --jobs, -j N        Maintain up to N repos at once.
+  --after, -a N       Only maintain repos which have not been maintained in the last N days.
+  --force, -f         Maintain every repo regardless of when it was last maintained.
+  --nice, -n N        Run maintenance with the given niceness [10].
+  --ionice, -i CLASS  Run maintenance with the 'idle' or 'best-effort' io scheduling class.
+  --help, -h          Show this help text."
+				exit 1
+				;;
+
+			* )
+				echo "Unrecognized argument '$1'"
+				exit 1
+				;;
+		esac
+
+		shift
+	done
+
+	# maintain_stats prints the loose object count, pack count, and 'git status' time for a repo ($1)
+	maintain_stats() {
+		local start
+		local key
+		local value
+		local loose
+		local packs
+
+		while read -r key value; do
+			case "$key" in
+				count: )
+					loose="$value"
+					;;
+				packs: )
+					packs="$value"
+					;;
+			esac
+		done < <(git -C "$1" count-objects -v)
+
+		# without optional locks status does not refresh the index, which 'clean' would take as activity
+		start=${EPOCHREALTIME/./}
+		git --no-optional-locks -C "$1" status --porcelain > /dev/null
+
+		echo "$loose $packs $(elapsed_since $start)"
+	}
+
+	# maintain_repo runs each maintenance task for a repo ($1), stopping at the first failure. Since gc expires the HEAD
+	# reflog, the mtimes of the files 'clean' takes as activity are restored afterwards.
+	maintain_repo() {
+		local -A mtimes
+		local status=0
+		local path
+
+		for path in "$1/.git/logs/HEAD" "$1/.git/index"; do
+			if [ -f "$path" ]; then
+				mtimes[$path]="$(stat --format '%.9Y' "$path")"
+			fi
+		done
+
+		if ! "${prefix[@]}" git -C "$1" pack-refs --all ||
+				! "${prefix[@]}" git -C "$1" gc --quiet ||
+				! "${prefix[@]}" git -C "$1" commit-graph write --reachable; then
+			status=1
+		# repos borrowing every object from an alternate have no packs of their own to index
+		elif compgen -G "$1/.git/objects/pack/*.pack" > /dev/null; then
+			"${prefix[@]}" git -C "$1" multi-pack-index write
+			status=$?
+		fi
+
+		for path in "${!mtimes[@]}"; do
+			touch --no-create --date "@${mtimes[$path]}" "$path"
+		done
+
+		return $status
+	}
+
+	maintain_each() {
+		local repo_dir="$1"
+		local timestamp="$REPO_CACHE/maintained/$2/$3"
+		local status=ok
+		local -a before
+		local -a after
+
+		if ! $force && [ "$timestamp" -nt "$maintained_ref" ]; then
+			printf "%-35s%-10s\n" "$2/$3" skipped
+			return
 		fi
 
-		upstream="$(git remote get-url upstream 2> /dev/null)"
-		if [ $? -ne 0 ]; then
-			upstream=""
+		read -r -a before < <(maintain_stats "$repo_dir")
+
+		if maintain_repo "$repo_dir"; then
+			mkdir --parents "$(dirname "$timestamp")"
+			touch "$timestamp"
+		else
+			status=failed
+		fi
+
+		read -r -a after < <(maintain_stats "$repo_dir")
+
+		printf "%-35s%-10s%-15s%-15s%s\n" "$2/$3" "$status" "${before[0]} -> ${after[0]}" "${before[1]} -> ${after[1]}" \
+			"${before[2]} -> ${after[2]}"
+	}
+
+	prefix=(nice --adjustment "$niceness")
+
+	if [ -n "$io_class" ]; then
+		prefix+=(ionice --class "$io_class")
+	fi
+
+	maintained_ref="$(mktemp)"
+	touch --date "$after days ago" "$maintained_ref"
+
+	printf "%-35s%-10s%-15s%-15s%s\n" owner/repo status loose packs "status seconds"
+	for_each_repo_parallel "$jobs" maintain_each
+
+	rm --force "$maintained_ref"
+}
+
+repo_grep() {
+	local jobs=1
+	local owner_glob="*"
+	local limit=""
+
+	while [ $# -gt 0 ]; do
+		case $1 in
+			--jobs | -j )
+				expect_number "$@"
+
+				jobs="$2"
+				shift
+				;;
+
+			--owner | -o )
+				owner_glob="$2"
+				shift
+				;;
+
+			--limit | -l )
+				expect_number "$@"
+
+				limit="$2"
+				shift
+				;;
+
+			--help | -h )
+				echo "$0 grep [-h] [-j N] [-o GLOB] [-l N] [--] <git grep args>...
+
+Run 'git grep' in every repository. Matches are printed as soon as they are found, prefixed with <owner>/<repo>.
+
+Args:
+  --jobs, -j N     Search up to N repos at once.
+  --owner, -o GLOB Only search repos whose owner matches the glob.
+  --limit, -l N    Stop searching once N lines have been printed.
+  --help, -h       Show this help text."
+				exit 1
+				;;
+
+			-- )
+				shift
+				break
+				;;
+
+			* )
+				break
+				;;
+		esac
+
+		shift
+	done
+
+	if [ $# -eq 0 ]; then
+		echo "expected a pattern but found none"
+		exit 1
+	fi
+
+	local -a grep_args=("$@")
+
+	repo_grep_each() {
+		# keep the pipeline in the worker's process group so cancelling the worker also stops it
+		set +m
+
+		git -C "$1" grep --no-color -I "${grep_args[@]}" | sed --unbuffered "s|^|$2/$3:|"
+	}
+
+	repo_grep_submit() {
+		if [[ "$2" == $owner_glob ]]; then
+			pool_submit repo_grep_each "$@"
 		fi
+	}
 
-		printf "$format_str" "$(basename $owner_dir)/$(basename $repo_dir)" $origin $upstream
+	# job control gives each worker its own process group so cancelling a worker also stops its 'git grep'
+	repo_grep_search() {
+		set -m
 
-		popd &> /dev/null
+		for_each_repo repo_grep_submit
+		pool_wait
 	}
 
-	for_each_repo list_each
+	pool_start "$jobs" true
+
+	if [ -n "$limit" ]; then
+		local search_fd search_pid
+
+		exec {search_fd}< <(repo_grep_search)
+		search_pid=$!
+
+		head --lines "$limit" <&$search_fd
+
+		# the search is cancelled as soon as enough lines were read, even if no worker has written since
+		pool_cancel
+		exec {search_fd}<&-
+		wait "$search_pid"
+	else
+		repo_grep_search
+	fi
+}
+
+list() {
+	local format=table
+
+	while [ $# -gt 0 ]; do
+		case $1 in
+			--format | -f )
+				format="$2"
+				shift
+				;;
+
+			--help | -h )
+				echo "$0 list [-h] [-f table|tsv|json]
+
+Display a list of cloned repositories. Records are printed as soon as each repo is found.
+
+Args:
+  --format, -f FORMAT  How to display each repo [table]:
+                         table  a table of each repo's origin, upstream, and clone mode
+                         tsv    tab separated <owner>/<repo>, origin, upstream, clone mode, and last activity without
+                                a header, with tabs, newlines, and backslashes in values escaped
+                         json   one json object per repo with the keys repo, origin, upstream, mode, and
+                                last_activity, missing values are null
+  --help, -h           Show this help text."
+				exit 1
+				;;
+
+			* )
+				echo "Unrecognized argument '$1'"
+				exit 1
+				;;
+		esac
+
+		shift
+	done
+
+	case "$format" in
+		table | tsv | json ) ;;
+		* )
+			echo "unsupported format '$format'"
+			exit 1
+			;;
+	esac
+
+	index_update | awk -F '|' -v format="$format" '
+		# decode undoes the json string escapes of an index value, except for tabs, newlines, and backslashes when
+		# keep_escaped is set, so tsv values can not break its rows or columns
+		function decode(value, keep_escaped,    result, c, i) {
+			result = ""
+
+			for (i = 1; i <= length(value); i++) {
+				c = substr(value, i, 1)
+
+				if (c == "\\") {
+					c = substr(value, ++i, 1)
+
+					if (keep_escaped && (c == "\\" || c == "n" || c == "t")) {
+						c = "\\" c
+					} else if (c == "n") {
+						c = "\n"
+					} else if (c == "t") {
+						c = "\t"
+					} else if (c == "r") {
+						c = "\r"
+					} else if (c == "u") {
+						c = sprintf("%c", hex(substr(value, i + 1, 4)))
+						i += 4
+					}
+				}
+
+				result = result c
+			}
+
+			return result
+		}
+
+		# hex reads the value of a hexadecimal number
+		function hex(digits,    n, i) {
+			n = 0
+
+			for (i = 1; i <= length(digits); i++) {
+				n = n * 16 + index("0123456789abcdef", tolower(substr(digits, i, 1))) - 1
+			}
+
+			return n
+		}
+
+		# values in the index are already escaped as in a json string
+		function json_string(value) {
+			if (value == "") {
+				return "null"
+			}
+
+			return "\"" value "\""
+		}
+
+		BEGIN {
+			if (format == "table") {
+				printf "%-35s%-50s%-50s%s\n", "owner/repo", "origin", "upstream", "mode"
+			}
+		}
+
+		format == "table" {
+			printf "%-35s%-50s%-50s%s\n", $1, decode($4), decode($5), decode($6)
+		}
+
+		format == "tsv" {
+			print $1 "\t" decode($4, 1) "\t" decode($5, 1) "\t" decode($6, 1) "\t" $7
+		}
+
+		format == "json" {
+			printf "{\"repo\":%s,\"origin\":%s,\"upstream\":%s,\"mode\":%s,\"last_activity\":%d}\n", json_string($1), json_string($4), json_string($5), json_string($6), $7
+		}
+
+		{
+			fflush()
+		}
+	'
 }
 
 while [ $# -gt 0 ]; do
@@ -300,7 +1491,31 @@ while [ $# -gt 0 ]; do
 		
 		list )
 			shift
-			list
+			list $*
+			break
+			;;
+
+		sync )
+			shift
+			sync $*
+			break
+			;;
+
+		du )
+			shift
+			disk_usage $*
+			break
+			;;
+
+		maintain )
+			shift
+			maintain $*
+			break
+			;;
+
+		grep )
+			shift
+			repo_grep "$@"
 			break
 			;;
 
@@ -318,6 +1533,10 @@ Commands:
 	clone        Clone github repositories into REPO_ROOT.
 	clean        Clean up the repositories in REPO_ROOT.
 	list         Display a list of cloned repositories.
+	sync         Fetch the remotes of every repository in REPO_ROOT.
+	du           Show the disk usage of every repository in REPO_ROOT.
+	maintain     Run git maintenance for every repository in REPO_ROOT.
+	grep         Search every repository in REPO_ROOT with 'git grep'.
 
 Args:
     --show-config, -s  Show the script config values. If provided with a command, values will be printed before command runs. If not command, the values will be printed before exiting.
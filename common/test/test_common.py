@@ -2,7 +2,6 @@ import pathlib
 
 
 EXCLUDED_SCRIPTS=[
-	"wf.sh",
 	"foff.sh",
 	"ticker.sh",
 ]
@@ -148,4 +148,105 @@ class TestDraindir:
 		assert (tmp_path / "dir" / "file").exists()
 		assert (tmp_path / "dir" / "file").read_text() == "def"
 
-		_assert_files_in(_drain_src)
\ No newline at end of file
+		_assert_files_in(_drain_src)
+
+	def test_with_multiple_conflicts(self, tmp_path: pathlib.Path, _drain_src: pathlib.Path):
+		(tmp_path / "file").write_text("def")
+		(tmp_path / "dir").mkdir()
+
+		proc = subprocess.run(
+			args=[_DRAINDIR_PATH, _drain_src, tmp_path],
+			capture_output=True,
+			timeout=_DRAINDIR_TIMEOUT,
+		)
+
+		assert proc.returncode == 1
+		assert proc.stdout == b"SRC and DST have a conflict 'dir'\nSRC and DST have a conflict 'file'\n"
+
+		assert not (tmp_path / ".hidden").exists()
+		assert (tmp_path / "file").read_text() == "def"
+
+		_assert_files_in(_drain_src)
+
+	def test_with_special_names(self, tmp_path: pathlib.Path):
+		src = tmp_path / "src"
+		dst = tmp_path / "dst"
+		src.mkdir()
+		dst.mkdir()
+
+		names = ["with space", "with\nnewline", "-dash", "*", "with\ttab"]
+		for name in names:
+			(src / name).write_text(name)
+
+		# would conflict with 'with space' if names were word split
+		(dst / "with").write_text("def")
+
+		proc = subprocess.run(
+			args=[_DRAINDIR_PATH, src, dst],
+			capture_output=True,
+			timeout=_DRAINDIR_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert not src.exists()
+
+		for name in names:
+			assert (dst / name).read_text() == name
+
+		assert (dst / "with").read_text() == "def"
+
+	def test_with_special_name_conflict(self, tmp_path: pathlib.Path):
+		src = tmp_path / "src"
+		dst = tmp_path / "dst"
+		src.mkdir()
+		dst.mkdir()
+
+		(src / "with\nnewline").write_text("abc")
+		(dst / "with\nnewline").write_text("def")
+
+		proc = subprocess.run(
+			args=[_DRAINDIR_PATH, src, dst],
+			capture_output=True,
+			timeout=_DRAINDIR_TIMEOUT,
+		)
+
+		assert proc.returncode == 1
+		assert proc.stdout == b"SRC and DST have a conflict 'with\nnewline'\n"
+
+		assert (src / "with\nnewline").read_text() == "abc"
+		assert (dst / "with\nnewline").read_text() == "def"
+
+	def test_many_files(self, tmp_path: pathlib.Path):
+		src = tmp_path / "src"
+		dst = tmp_path / "dst"
+		src.mkdir()
+		dst.mkdir()
+
+		# long enough names that a single mv would pass the argument limit
+		names = [f"{i:06}-{"x" * 200}" for i in range(20000)]
+		for name in names:
+			(src / name).touch()
+
+		(dst / "existing").write_text("abc")
+
+		proc = subprocess.run(
+			args=[_DRAINDIR_PATH, src, dst],
+			capture_output=True,
+			timeout=_DRAINDIR_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert not src.exists()
+		assert sorted(os.listdir(dst)) == sorted(["existing", *names])
+
+	def test_dst_not_dir(self, tmp_path: pathlib.Path, _drain_src: pathlib.Path):
+		proc = subprocess.run(
+			args=[_DRAINDIR_PATH, _drain_src, tmp_path / "non-existant"],
+			capture_output=True,
+			timeout=_DRAINDIR_TIMEOUT,
+		)
+
+		assert proc.returncode != 0
+		assert proc.stdout == str.encode(f"DST '{tmp_path / "non-existant"}' is not a directory\n")
+
+		_assert_files_in(_drain_src)
@@ -1,5 +1,7 @@
 import pathlib
 import os
+import json
+import shutil
 import subprocess
 import git
 import pytest
@@ -15,6 +17,14 @@ _ENV_REPO_ROOT: str = "REPO_ROOT"
 _ENV_CLEAN_AFTER: str = "CLEAN_AFTER"
 _ENV_DEFAULT_CLONE_PROTO: str = "DEFAULT_CLONE_PROTO"
 _ENV_DO_NOT_CLEAN: str = "DO_NOT_CLEAN"
+_ENV_DO_NOT_SYNC: str = "DO_NOT_SYNC"
+_ENV_REPO_CACHE: str = "REPO_CACHE"
+
+
+def _read_index(repo_root: pathlib.Path) -> dict[str, list[str]]:
+	index = repo_root / ".repo-manager" / "index"
+
+	return { line.split("|")[0]: line.split("|")[1:] for line in index.read_text().splitlines() }
 
 
 def _assert_repo(path: pathlib.Path, expected_remotes: dict[str, str] = None):
@@ -41,13 +51,13 @@ class TestConfig:
 		)
 
 		assert proc.returncode == 0
-		assert proc.stdout == str.encode(f"     GITHUB_REGISTRY: github.com\n            SSH_USER: git\n           REPO_ROOT: {tmp_path}\n         CLEAN_AFTER: 28\n DEFAULT_CLONE_PROTO: ssh\n        DO_NOT_CLEAN: \n")
+		assert proc.stdout == str.encode(f"     GITHUB_REGISTRY: github.com\n            SSH_USER: git\n           REPO_ROOT: {tmp_path}\n         CLEAN_AFTER: 28\n      MAINTAIN_AFTER: 7\n DEFAULT_CLONE_PROTO: ssh\n        DO_NOT_CLEAN: \n         DO_NOT_SYNC: \n        CLONE_FILTER: \n         CLONE_DEPTH: \n        CLONE_SPARSE: \n")
 
 	def test_show_config_with_non_default_file(self, tmp_path: pathlib.Path):
 		config_file = tmp_path / "config"
 		repo_root = tmp_path  / "repos"
 
-		config_file.write_text(f"GITHUB_REGISTRY=some.custom.registry.com\nSSH_USER=bbaggins\nREPO_ROOT={repo_root}\nCLEAN_AFTER=7\nDEFAULT_CLONE_PROTO=https\nDO_NOT_CLEAN=joshmeranda/mytools,joshmeranda/fan")
+		config_file.write_text(f"GITHUB_REGISTRY=some.custom.registry.com\nSSH_USER=bbaggins\nREPO_ROOT={repo_root}\nCLEAN_AFTER=7\nMAINTAIN_AFTER=14\nDEFAULT_CLONE_PROTO=https\nDO_NOT_CLEAN=joshmeranda/mytools,joshmeranda/fan\nDO_NOT_SYNC=joshmeranda/wrash\nCLONE_FILTER=blob:none\nCLONE_DEPTH=1\nCLONE_SPARSE=src,docs")
 
 		proc = subprocess.run(
 			args=[_REPO_MANAGER_PATH, "--show-config"],
@@ -60,7 +70,7 @@ class TestConfig:
 		)
 
 		assert proc.returncode == 0
-		assert proc.stdout == str.encode(f"     GITHUB_REGISTRY: some.custom.registry.com\n            SSH_USER: bbaggins\n           REPO_ROOT: {repo_root}\n         CLEAN_AFTER: 7\n DEFAULT_CLONE_PROTO: https\n        DO_NOT_CLEAN: joshmeranda/mytools,joshmeranda/fan\n")
+		assert proc.stdout == str.encode(f"     GITHUB_REGISTRY: some.custom.registry.com\n            SSH_USER: bbaggins\n           REPO_ROOT: {repo_root}\n         CLEAN_AFTER: 7\n      MAINTAIN_AFTER: 14\n DEFAULT_CLONE_PROTO: https\n        DO_NOT_CLEAN: joshmeranda/mytools,joshmeranda/fan\n         DO_NOT_SYNC: joshmeranda/wrash\n        CLONE_FILTER: blob:none\n         CLONE_DEPTH: 1\n        CLONE_SPARSE: src,docs\n")
 
 
 class TestRepoManagerClone:
@@ -215,6 +225,218 @@ class TestRepoManagerClone:
 			})
 
 
+
+class TestRepoManagerListFormat:
+	def _list(self, repo_root: pathlib.Path, *args: str, env: dict[str, str] = {}) -> subprocess.CompletedProcess:
+		return subprocess.run(
+			args=[_REPO_MANAGER_PATH, "list", *args],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				**env,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+	def test_json(self, _repo_root_local: list[pathlib.Path]):
+		repo_root = _repo_root_local[0]
+
+		git.Repo(_repo_root_local[3]).create_remote("upstream", "https://example.com/\"quoted\"/first.git")
+
+		proc = self._list(repo_root, "--format", "json")
+
+		assert proc.returncode == 0
+
+		records = [json.loads(line) for line in proc.stdout.decode().splitlines()]
+		assert [record["repo"] for record in records] == ["alice/first", "alice/second", "bob/first"]
+		assert records[0]["origin"] == git.Repo(_repo_root_local[1]).remote("origin").url
+		assert records[0]["upstream"] is None
+		assert records[0]["mode"] is None
+		assert isinstance(records[0]["last_activity"], int)
+		assert records[2]["upstream"] == "https://example.com/\"quoted\"/first.git"
+
+	def test_json_with_special_characters(self, _repo_root_local: list[pathlib.Path]):
+		repo_root = _repo_root_local[0]
+
+		with git.Repo(_repo_root_local[3]).config_writer() as config:
+			config.set_value("remote \"upstream\"", "url", "\"https://example.com/a|b\tc\\nd\"")
+			config.set_value("repomanager", "clonemode", "\"depth=1\x01\"")
+
+		proc = self._list(repo_root, "--format", "json")
+
+		assert proc.returncode == 0
+
+		records = [json.loads(line) for line in proc.stdout.decode().splitlines()]
+		assert [record["repo"] for record in records] == ["alice/first", "alice/second", "bob/first"]
+		assert records[2]["upstream"] == "https://example.com/a|b\tc\nd"
+		assert records[2]["mode"] == "depth=1\x01"
+		assert list(_read_index(repo_root).keys()) == ["alice/first", "alice/second", "bob/first"]
+
+	def test_tsv(self, _repo_root_local: list[pathlib.Path]):
+		repo_root = _repo_root_local[0]
+
+		proc = self._list(repo_root, "--format", "tsv")
+
+		assert proc.returncode == 0
+
+		rows = [line.split("\t") for line in proc.stdout.decode().splitlines()]
+		assert [row[:4] for row in rows] == [
+			["alice/first", git.Repo(_repo_root_local[1]).remote("origin").url, "", ""],
+			["alice/second", git.Repo(_repo_root_local[2]).remote("origin").url, "", ""],
+			["bob/first", git.Repo(_repo_root_local[3]).remote("origin").url, "", ""],
+		]
+
+	def test_tsv_with_special_characters(self, _repo_root_local: list[pathlib.Path]):
+		with git.Repo(_repo_root_local[3]).config_writer() as config:
+			config.set_value("remote \"upstream\"", "url", "\"https://example.com/x|y\\\"z\tw\\\\.git\"")
+
+		proc = self._list(_repo_root_local[0], "--format", "tsv")
+
+		assert proc.returncode == 0
+
+		# only tabs, newlines, and backslashes are escaped
+		rows = [line.split("\t") for line in proc.stdout.decode().splitlines()]
+		assert rows[2][2] == "https://example.com/x|y\"z\\tw\\\\.git"
+
+	def test_table_with_special_characters(self, _repo_root_local: list[pathlib.Path]):
+		git.Repo(_repo_root_local[3]).create_remote("upstream", "https://example.com/x|y\"z.git")
+
+		proc = self._list(_repo_root_local[0])
+
+		assert proc.returncode == 0
+		assert proc.stdout.decode().splitlines()[3].rstrip().endswith("https://example.com/x|y\"z.git")
+
+	def test_bad_format(self, _repo_root_local: list[pathlib.Path]):
+		proc = self._list(_repo_root_local[0], "--format", "xml")
+
+		assert proc.returncode != 0
+		assert proc.stdout == b"unsupported format 'xml'\n"
+
+	def test_does_not_run_git(self, tmp_path: pathlib.Path, _repo_root_local: list[pathlib.Path]):
+		bin_dir = tmp_path / "bin"
+		bin_dir.mkdir()
+
+		fake_git = bin_dir / "git"
+		fake_git.write_text(f"#!/usr/bin/env bash\ntouch {tmp_path / "git-was-run"}\nexit 1\n")
+		os.chmod(fake_git, 0o700)
+
+		proc = self._list(_repo_root_local[0], "--format", "tsv", env={"PATH": f"{bin_dir}:{os.environ["PATH"]}"})
+
+		assert proc.returncode == 0
+		assert len(proc.stdout.decode().splitlines()) == 3
+		assert not (tmp_path / "git-was-run").exists()
+
+@pytest.fixture(scope="function")
+def _local_remotes(tmp_path_factory: pytest.TempPathFactory) -> list[pathlib.Path]:
+	'''_local_remotes creates bare repos to clone from. Urls under https://example.com/ are redirected to these repos by the returned git config. The returned list contains the git config followed by the upstream and its forks.'''
+	remotes = tmp_path_factory.mktemp("remotes")
+
+	work = git.Repo.init(remotes / "work")
+	(remotes / "work" / "file").write_text("\n".join(str(i) for i in range(10000)))
+	work.index.add(["file"])
+	work.index.commit("initial commit")
+
+	upstream = remotes / "upstream" / "project.git"
+	forks = [remotes / "alice" / "project.git", remotes / "bob" / "project.git"]
+
+	for path in [upstream, *forks]:
+		git.Repo.clone_from(url=remotes / "work", to_path=path, bare=True)
+
+	git_config = remotes / "gitconfig"
+	git_config.write_text(f"[url \"file://{remotes}/\"]\n\tinsteadOf = https://example.com/\n[uploadpack]\n\tallowFilter = true\n")
+
+	return [git_config, upstream, *forks]
+
+
+class TestRepoManagerCloneBatch:
+	def _clone(self, repo_root: pathlib.Path, git_config: pathlib.Path, *args: str) -> subprocess.CompletedProcess:
+		return subprocess.run(
+			args=[_REPO_MANAGER_PATH, "clone", "--https", *args],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				_ENV_GITHUB_REGISTRY: "example.com",
+				"GIT_CONFIG_GLOBAL": git_config,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+	def test_from_file(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		repos = tmp_path / "repos.txt"
+		repos.write_text("# some comment\nalice project\n\nbob project\nupstream project\n")
+
+		proc = self._clone(tmp_path / "repos", _local_remotes[0], "--from-file", repos, "--jobs", "2")
+
+		assert proc.returncode == 0
+
+		summary = proc.stdout.decode().splitlines()[-4:]
+		assert summary[0].split() == ["owner/repo", "status", "seconds", "bytes"]
+		assert [line.split()[:2] for line in summary[1:]] == [["alice/project", "ok"], ["bob/project", "ok"], ["upstream/project", "ok"]]
+
+		for owner in ["alice", "bob", "upstream"]:
+			_assert_repo(tmp_path / "repos" / owner / "project", expected_remotes={"origin": f"https://example.com/{owner}/project.git"})
+
+		assert list(_read_index(tmp_path / "repos").keys()) == ["alice/project", "bob/project", "upstream/project"]
+
+	def test_from_file_with_shared_upstream(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		repos = tmp_path / "repos.txt"
+		repos.write_text("\n".join([
+			"--upstream https://example.com/upstream/project.git alice project",
+			"--upstream https://example.com/upstream/project.git bob project",
+		]))
+
+		proc = self._clone(tmp_path / "repos", _local_remotes[0], "--from-file", repos, "--jobs", "2")
+
+		assert proc.returncode == 0
+
+		reference = tmp_path / "repos" / ".references" / "https___example.com_upstream_project.git"
+		assert reference.exists()
+
+		for owner in ["alice", "bob"]:
+			repo = tmp_path / "repos" / owner / "project"
+
+			_assert_repo(repo, expected_remotes={
+				"origin": f"https://example.com/{owner}/project.git",
+				"upstream": "https://example.com/upstream/project.git",
+			})
+			assert (repo / ".git" / "objects" / "info" / "alternates").read_text().strip() == str(reference / "objects")
+
+		# the cache is disposable, so removing it must not leave the clones with missing objects
+		shutil.rmtree(tmp_path / "repos" / ".repo-manager")
+
+		for owner in ["alice", "bob"]:
+			assert subprocess.run(["git", "-C", tmp_path / "repos" / owner / "project", "fsck", "--connectivity-only"], capture_output=True).returncode == 0
+
+	def test_from_file_with_failed_clone(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		repos = tmp_path / "repos.txt"
+		repos.write_text("alice project\nnobody missing\n")
+
+		proc = self._clone(tmp_path / "repos", _local_remotes[0], "--from-file", repos)
+
+		assert proc.returncode != 0
+		assert proc.stdout.decode().splitlines()[-1].split() == ["nobody/missing", "failed"]
+		assert (tmp_path / "repos" / "alice" / "project").exists()
+
+	def test_from_file_with_mode(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		repos = tmp_path / "repos.txt"
+		repos.write_text("alice project\n--full bob project\n")
+
+		proc = self._clone(tmp_path / "repos", _local_remotes[0], "--from-file", repos, "--depth", "1")
+
+		assert proc.returncode == 0
+		assert git.Repo(tmp_path / "repos" / "alice" / "project").config_reader().get_value("repomanager", "clonemode") == "depth=1"
+		assert git.Repo(tmp_path / "repos" / "bob" / "project").config_reader().get_value("repomanager", "clonemode") == "full"
+
+	def test_from_file_with_args(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		repos = tmp_path / "repos.txt"
+		repos.write_text("alice project\n")
+
+		proc = self._clone(tmp_path / "repos", _local_remotes[0], "--from-file", repos, "bob", "project")
+
+		assert proc.returncode != 0
+		assert proc.stdout == b"found more args than expected\n"
+
+
 def _clone_repos(tmp_path_factory: pytest.TempPathFactory) -> list[pathlib.Path]:
 	'''_repo_root creates a new temporary directory and populates it with repositories. The returns list contains the REPO_ROOT followe by the cloned repos.'''
 	repo_root = tmp_path_factory.mktemp("repos")
@@ -362,6 +584,34 @@ class TestRepoManagerClean:
 		assert _repo_root_old[1].exists()
 		assert not _repo_root_old[2].exists()
 		assert not _repo_root_old[3].exists()
+
+	def test_with_old_root_updates_index(self, _repo_root_old: list[pathlib.Path]):
+		repo_root = _repo_root_old[0]
+
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "list"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert list(_read_index(repo_root).keys()) == ["joshmeranda/fan", "joshmeranda/mytools", "joshmeranda/wrash"]
+
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "clean", "--yes"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				_ENV_CLEAN_AFTER: "7"
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert list(_read_index(repo_root).keys()) == ["joshmeranda/mytools"]
 	
 	def test_with_old_root_after_flag(self, _repo_root_old: list[pathlib.Path]):
 		repo_root = _repo_root_old[0]
@@ -492,6 +742,136 @@ class TestRepoManagerClean:
 		assert _repo_root_old[2].exists()
 		assert _repo_root_old[3].exists()
 
+	def test_with_ignored_recent_files(self, _repo_root_old: list[pathlib.Path]):
+		repo_root = _repo_root_old[0]
+
+		# recently modified files which are not tracked by git should not keep a repo from being cleaned
+		(_repo_root_old[3] / ".git" / "info").mkdir(exist_ok=True)
+		(_repo_root_old[3] / ".git" / "info" / "exclude").write_text("node_modules\n")
+		(_repo_root_old[3] / "node_modules").mkdir()
+		(_repo_root_old[3] / "node_modules" / "package.json").write_text("{}")
+
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "clean", "--yes"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				_ENV_CLEAN_AFTER: "7"
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert not _repo_root_old[3].exists()
+
+	def test_with_recent_tracked_file(self, _repo_root_old: list[pathlib.Path]):
+		repo_root = _repo_root_old[0]
+
+		tracked_file = git.Repo(_repo_root_old[3]).git.ls_files().splitlines()[0]
+		os.utime(_repo_root_old[3] / tracked_file)
+
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "clean", "--yes"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				_ENV_CLEAN_AFTER: "7"
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert not _repo_root_old[2].exists()
+		assert _repo_root_old[3].exists()
+
+	def test_with_cached_activity(self, _repo_root: list[pathlib.Path]):
+		repo_root = _repo_root[0]
+
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "clean", "--yes"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				_ENV_CLEAN_AFTER: "7"
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert (repo_root / ".repo-manager" / "activity" / "joshmeranda" / "fan").exists()
+
+		# activity found by an earlier run is trusted for as long as it is recent enough
+		_make_path_old(_repo_root[3], 30)
+
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "clean", "--yes"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				_ENV_CLEAN_AFTER: "7"
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert _repo_root[3].exists()
+
+	def test_with_old_root_jobs(self, _repo_root_old: list[pathlib.Path]):
+		repo_root = _repo_root_old[0]
+
+		proc = subprocess.run(
+			input=b'\n'.join([b"y", b"y"]),
+			args=[_REPO_MANAGER_PATH, "clean", "--jobs", "4"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				_ENV_CLEAN_AFTER: "7"
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert proc.stdout == b"delete 'joshmeranda/fan'? [N|y]\ndelete 'joshmeranda/wrash'? [N|y]\n"
+
+		assert _repo_root_old[1].exists()
+		assert not _repo_root_old[2].exists()
+		assert not _repo_root_old[3].exists()
+
+	def test_with_jobs_prompts_after_checks(self, _repo_root_old: list[pathlib.Path]):
+		repo_root = _repo_root_old[0]
+
+		proc = subprocess.run(
+			input=b'\n'.join([b"y"]),
+			args=[_REPO_MANAGER_PATH, "clean", "--jobs", "4"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				_ENV_CLEAN_AFTER: "7",
+				_ENV_DO_NOT_CLEAN: "joshmeranda/repo1,joshmeranda/wrash,joshmeranda/repo2"
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert proc.stdout == b"skipping joshmeranda/wrash\ndelete 'joshmeranda/fan'? [N|y]\n"
+
+		assert _repo_root_old[1].exists()
+		assert _repo_root_old[2].exists()
+		assert not _repo_root_old[3].exists()
+
+	def test_with_invalid_jobs(self, tmp_path: pathlib.Path):
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "clean", "--jobs", "many"],
+			env={
+				_ENV_REPO_ROOT: tmp_path,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode != 0
+		assert proc.stdout == b"'--jobs' expected a number but found 'many'\n"
+
 
 @pytest.fixture(scope="class")
 def _repo_root_list(tmp_path_factory: pytest.TempPathFactory) -> list[pathlib.Path]:
@@ -525,8 +905,519 @@ class TestRepoManagerList:
 
 		assert proc.returncode == 0
 		assert proc.stdout ==  b"\n".join([
-			b"owner/repo                         origin                                            upstream                                          ",
+			b"owner/repo                         origin                                            upstream                                          mode",
 			b"joshmeranda/fan                    https://github.com/joshmeranda/fan.git            https://github.com/joshmeranda/fan.git            ",
 			b"joshmeranda/mytools                                                                                                                    ",
 			b"joshmeranda/wrash                  https://github.com/joshmeranda/wrash.git                                                            \n",
-		])
\ No newline at end of file
+		])
+
+	def test_list_with_non_existent_root(self, tmp_path: pathlib.Path):
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "list"],
+			env={
+				_ENV_REPO_ROOT: tmp_path / "repos",
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert proc.stdout == b"owner/repo                         origin                                            upstream                                          mode\n"
+		assert not (tmp_path / "repos").exists()
+
+
+@pytest.fixture(scope="function")
+def _repo_root_local(tmp_path_factory: pytest.TempPathFactory) -> list[pathlib.Path]:
+	'''_repo_root_local creates a REPO_ROOT populated with repositories which only have local remotes. The returned list contains the REPO_ROOT followed by the created repos.'''
+	repo_root = tmp_path_factory.mktemp("repos")
+	remotes = tmp_path_factory.mktemp("remotes")
+
+	repos = [repo_root]
+
+	for owner, name in [("alice", "first"), ("alice", "second"), ("bob", "first")]:
+		remote = git.Repo.init(remotes / owner / f"{name}.git", bare=True)
+
+		repo = git.Repo.init(repo_root / owner / name)
+		repo.create_remote("origin", remote.working_dir)
+
+		repos.append(repo_root / owner / name)
+
+	return repos
+
+
+class TestRepoManagerIndex:
+	def _list(self, repo_root: pathlib.Path) -> subprocess.CompletedProcess:
+		return subprocess.run(
+			args=[_REPO_MANAGER_PATH, "list"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+	def test_index_created(self, _repo_root_local: list[pathlib.Path]):
+		repo_root = _repo_root_local[0]
+
+		proc = self._list(repo_root)
+
+		assert proc.returncode == 0
+
+		index = _read_index(repo_root)
+		assert list(index.keys()) == ["alice/first", "alice/second", "bob/first"]
+		assert index["alice/first"][2] == git.Repo(_repo_root_local[1]).remote("origin").url
+		assert index["alice/first"][3] == ""
+
+	def test_index_with_changed_config(self, _repo_root_local: list[pathlib.Path]):
+		repo_root = _repo_root_local[0]
+
+		assert self._list(repo_root).returncode == 0
+
+		git.Repo(_repo_root_local[2]).create_remote("upstream", "https://example.com/alice/second.git")
+
+		proc = self._list(repo_root)
+
+		assert proc.returncode == 0
+		assert b"https://example.com/alice/second.git" in proc.stdout
+		assert _read_index(repo_root)["alice/second"][3] == "https://example.com/alice/second.git"
+
+	def test_index_with_unchanged_config(self, _repo_root_local: list[pathlib.Path]):
+		repo_root = _repo_root_local[0]
+
+		assert self._list(repo_root).returncode == 0
+
+		# an index entry is trusted as long as the mtimes it was built from are unchanged
+		index = repo_root / ".repo-manager" / "index"
+		index.write_text(index.read_text().replace("|" + git.Repo(_repo_root_local[3]).remote("origin").url, "|cached-origin"))
+
+		proc = self._list(repo_root)
+
+		assert proc.returncode == 0
+		assert _read_index(repo_root)["bob/first"][2] == "cached-origin"
+
+	def test_index_with_removed_repo(self, _repo_root_local: list[pathlib.Path]):
+		repo_root = _repo_root_local[0]
+
+		assert self._list(repo_root).returncode == 0
+
+		shutil.rmtree(_repo_root_local[1])
+
+		proc = self._list(repo_root)
+
+		assert proc.returncode == 0
+		assert b"alice/first" not in proc.stdout
+		assert list(_read_index(repo_root).keys()) == ["alice/second", "bob/first"]
+
+
+@pytest.fixture(scope="function")
+def _repo_root_sync(tmp_path_factory: pytest.TempPathFactory, _local_remotes: list[pathlib.Path]) -> list[pathlib.Path]:
+	'''_repo_root_sync creates a REPO_ROOT with clones of the local remotes. The returned list contains the REPO_ROOT followed by the clones of each fork.'''
+	repo_root = tmp_path_factory.mktemp("repos")
+
+	repos = [repo_root]
+
+	for fork in _local_remotes[2:]:
+		repo = git.Repo.clone_from(url=fork, to_path=repo_root / fork.parent.name / "project")
+		repo.create_remote("upstream", _local_remotes[1])
+
+		repos.append(repo_root / fork.parent.name / "project")
+
+	return repos
+
+
+def _push_commit(remote: pathlib.Path, message: str) -> str:
+	'''_push_commit adds a new commit to the bare remote and returns its hexsha.'''
+	work = git.Repo.clone_from(url=remote, to_path=remote.parent / f"{remote.stem}-work")
+	(pathlib.Path(work.working_dir) / "file").write_text(message)
+	work.index.add(["file"])
+	commit = work.index.commit(message)
+	work.remote("origin").push()
+
+	return commit.hexsha
+
+
+class TestRepoManagerSync:
+	def _sync(self, repo_root: pathlib.Path, *args: str, env: dict[str, str] = {}) -> subprocess.CompletedProcess:
+		return subprocess.run(
+			args=[_REPO_MANAGER_PATH, "sync", *args],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				**env,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+	def test_sync(self, _local_remotes: list[pathlib.Path], _repo_root_sync: list[pathlib.Path]):
+		upstream_sha = _push_commit(_local_remotes[1], "upstream change")
+		alice_sha = _push_commit(_local_remotes[2], "alice change")
+
+		proc = self._sync(_repo_root_sync[0], "--jobs", "2")
+
+		assert proc.returncode == 0
+
+		lines = proc.stdout.decode().splitlines()
+		assert lines[0].split() == ["owner/repo", "status", "seconds"]
+		assert [line.split()[:2] for line in lines[1:]] == [["alice/project", "ok"], ["bob/project", "ok"]]
+
+		alice = git.Repo(_repo_root_sync[1])
+		branch = alice.active_branch.name
+		assert alice.commit(f"origin/{branch}").hexsha == alice_sha
+		assert alice.commit(f"upstream/{branch}").hexsha == upstream_sha
+
+		bob = git.Repo(_repo_root_sync[2])
+		assert bob.commit(f"upstream/{branch}").hexsha == upstream_sha
+
+	def test_sync_with_opt_out(self, _local_remotes: list[pathlib.Path], _repo_root_sync: list[pathlib.Path]):
+		bob = git.Repo(_repo_root_sync[2])
+		branch = bob.active_branch.name
+		before = bob.commit(f"origin/{branch}").hexsha
+
+		_push_commit(_local_remotes[3], "bob change")
+
+		proc = self._sync(_repo_root_sync[0], env={_ENV_DO_NOT_SYNC: "bob/project"})
+
+		assert proc.returncode == 0
+		assert proc.stdout.decode().splitlines()[2].split() == ["bob/project", "skipped"]
+		assert bob.commit(f"origin/{branch}").hexsha == before
+
+	def test_sync_with_failed_fetch(self, _local_remotes: list[pathlib.Path], _repo_root_sync: list[pathlib.Path]):
+		git.Repo(_repo_root_sync[1]).remote("origin").set_url(str(_local_remotes[1].parent / "missing.git"))
+
+		proc = self._sync(_repo_root_sync[0])
+
+		assert proc.returncode == 0
+		assert [line.split()[:2] for line in proc.stdout.decode().splitlines() if "/project" in line] == [["alice/project", "failed"], ["bob/project", "ok"]]
+
+
+	def test_sync_then_clean(self, _repo_root_sync: list[pathlib.Path]):
+		for repo in _repo_root_sync[1:]:
+			_make_path_old(repo, 10)
+
+		proc = self._sync(_repo_root_sync[0])
+
+		assert proc.returncode == 0
+
+		# fetching is not activity, so a routine sync must not keep stale repos around
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "clean", "--yes", "--after", "7"],
+			env={
+				_ENV_REPO_ROOT: _repo_root_sync[0],
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert not _repo_root_sync[1].exists()
+		assert not _repo_root_sync[2].exists()
+
+
+class TestRepoManagerCloneMode:
+	def _clone(self, repo_root: pathlib.Path, git_config: pathlib.Path, *args: str, env: dict[str, str] = {}) -> subprocess.CompletedProcess:
+		return subprocess.run(
+			args=[_REPO_MANAGER_PATH, "clone", "--https", *args, "alice", "project"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+				_ENV_GITHUB_REGISTRY: "example.com",
+				"GIT_CONFIG_GLOBAL": git_config,
+				**env,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+	def _clone_mode(self, repo: pathlib.Path) -> str:
+		return git.Repo(repo).config_reader().get_value("repomanager", "clonemode")
+
+	def test_full(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		proc = self._clone(tmp_path, _local_remotes[0])
+
+		assert proc.returncode == 0
+		assert self._clone_mode(tmp_path / "alice" / "project") == "full"
+
+	def test_filter(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		proc = self._clone(tmp_path, _local_remotes[0], "--filter", "blob:none")
+
+		assert proc.returncode == 0
+
+		repo = git.Repo(tmp_path / "alice" / "project")
+		assert repo.config_reader().get_value('remote "origin"', "partialclonefilter") == "blob:none"
+		assert self._clone_mode(tmp_path / "alice" / "project") == "filter=blob:none"
+
+	def test_depth(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		proc = self._clone(tmp_path, _local_remotes[0], "--depth", "1")
+
+		assert proc.returncode == 0
+		assert git.Repo(tmp_path / "alice" / "project").git.rev_parse("--is-shallow-repository") == "true"
+		assert self._clone_mode(tmp_path / "alice" / "project") == "depth=1"
+
+	def test_sparse(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		proc = self._clone(tmp_path, _local_remotes[0], "--sparse", "src,docs")
+
+		assert proc.returncode == 0
+		assert git.Repo(tmp_path / "alice" / "project").git.sparse_checkout("list").splitlines() == ["docs", "src"]
+		assert self._clone_mode(tmp_path / "alice" / "project") == "sparse=src,docs"
+
+	def test_config_default(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		proc = self._clone(tmp_path, _local_remotes[0], env={"CLONE_FILTER": "blob:none", "CLONE_DEPTH": "1"})
+
+		assert proc.returncode == 0
+		assert self._clone_mode(tmp_path / "alice" / "project") == "filter=blob:none depth=1"
+
+	def test_config_default_with_full(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		proc = self._clone(tmp_path, _local_remotes[0], "--full", env={"CLONE_FILTER": "blob:none"})
+
+		assert proc.returncode == 0
+		assert self._clone_mode(tmp_path / "alice" / "project") == "full"
+
+	def test_list_shows_mode(self, tmp_path: pathlib.Path, _local_remotes: list[pathlib.Path]):
+		assert self._clone(tmp_path, _local_remotes[0], "--filter", "blob:none", "--depth", "1").returncode == 0
+
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "list"],
+			env={
+				_ENV_REPO_ROOT: tmp_path,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+		assert proc.stdout.decode().splitlines()[1].endswith("filter=blob:none depth=1")
+
+
+class TestRepoManagerDiskUsage:
+	def _du(self, repo_root: pathlib.Path, *args: str) -> subprocess.CompletedProcess:
+		return subprocess.run(
+			args=[_REPO_MANAGER_PATH, "du", *args],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+	def _rows(self, proc: subprocess.CompletedProcess) -> dict[str, list[int]]:
+		lines = proc.stdout.decode().splitlines()
+		assert lines[0].split() == ["owner/repo", "total", "worktree", "objects", "reclaimable"]
+
+		return { line.split()[0]: [int(value) for value in line.split()[1:]] for line in lines[1:] }
+
+	def test_du(self, _repo_root_local: list[pathlib.Path]):
+		repo_root = _repo_root_local[0]
+
+		(_repo_root_local[2] / "build").mkdir()
+		(_repo_root_local[2] / "build" / "output").write_bytes(b"0" * 100000)
+		(_repo_root_local[3] / "untracked").write_bytes(b"0" * 1000)
+
+		proc = self._du(repo_root, "--jobs", "2")
+
+		assert proc.returncode == 0
+
+		rows = self._rows(proc)
+		assert list(rows.keys())[0] == "alice/second"
+		assert set(rows.keys()) == {"alice/first", "alice/second", "bob/first"}
+
+		for total, worktree, objects, reclaimable in rows.values():
+			assert total == worktree + objects
+
+		assert rows["alice/second"][3] >= 100000
+		assert rows["bob/first"][3] >= 1000
+		assert rows["alice/first"][3] == 0
+
+	def test_du_top(self, _repo_root_local: list[pathlib.Path]):
+		(_repo_root_local[2] / "output").write_bytes(b"0" * 100000)
+
+		proc = self._du(_repo_root_local[0], "--top", "1")
+
+		assert proc.returncode == 0
+		assert list(self._rows(proc).keys()) == ["alice/second"]
+
+	def test_du_cached(self, _repo_root_local: list[pathlib.Path]):
+		repo_root = _repo_root_local[0]
+
+		assert self._du(repo_root).returncode == 0
+
+		# results are reused until the repo changes, so a rewritten cache entry should be reported as is
+		cache = repo_root / ".repo-manager" / "du" / "bob" / "first"
+		stat = cache.stat()
+		cache.write_text("999999|999999|0|0\n")
+		os.utime(cache, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+		assert self._rows(self._du(repo_root))["bob/first"] == [999999, 999999, 0, 0]
+		assert self._rows(self._du(repo_root, "--refresh"))["bob/first"] != [999999, 999999, 0, 0]
+
+	def test_du_invalidated(self, _repo_root_local: list[pathlib.Path]):
+		repo_root = _repo_root_local[0]
+
+		assert self._du(repo_root).returncode == 0
+
+		(_repo_root_local[3] / "untracked").write_bytes(b"0" * 1000)
+
+		assert self._rows(self._du(repo_root))["bob/first"][3] >= 1000
+
+
+@pytest.fixture(scope="function")
+def _repo_root_loose(_repo_root_local: list[pathlib.Path]) -> list[pathlib.Path]:
+	'''_repo_root_loose adds a few commits to each local repo, leaving their objects loose.'''
+	for path in _repo_root_local[1:]:
+		repo = git.Repo(path)
+
+		for i in range(3):
+			(path / "file").write_text(str(i))
+			repo.index.add(["file"])
+			repo.index.commit(f"commit {i}")
+
+	return _repo_root_local
+
+
+class TestRepoManagerMaintain:
+	def _maintain(self, repo_root: pathlib.Path, *args: str) -> subprocess.CompletedProcess:
+		return subprocess.run(
+			args=[_REPO_MANAGER_PATH, "maintain", *args],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+	def _rows(self, proc: subprocess.CompletedProcess) -> dict[str, list[str]]:
+		lines = proc.stdout.decode().splitlines()
+		assert lines[0].split() == ["owner/repo", "status", "loose", "packs", "status", "seconds"]
+
+		return { line.split()[0]: line.split()[1:] for line in lines[1:] }
+
+	def test_maintain(self, _repo_root_loose: list[pathlib.Path]):
+		repo_root = _repo_root_loose[0]
+
+		proc = self._maintain(repo_root, "--jobs", "2", "--ionice", "idle")
+
+		assert proc.returncode == 0
+
+		rows = self._rows(proc)
+		assert list(rows.keys()) == ["alice/first", "alice/second", "bob/first"]
+
+		for path in _repo_root_loose[1:]:
+			row = rows[f"{path.parent.name}/{path.name}"]
+			assert row[0] == "ok"
+			assert row[1:4] == ["9", "->", "0"]
+			assert row[4:7] == ["0", "->", "1"]
+
+			assert (path / ".git" / "objects" / "info" / "commit-graph").exists()
+			assert (path / ".git" / "objects" / "pack" / "multi-pack-index").exists()
+			assert (repo_root / ".repo-manager" / "maintained" / path.parent.name / path.name).exists()
+
+	def test_maintain_skips_recent(self, _repo_root_loose: list[pathlib.Path]):
+		repo_root = _repo_root_loose[0]
+
+		assert self._maintain(repo_root).returncode == 0
+
+		proc = self._maintain(repo_root)
+
+		assert proc.returncode == 0
+		assert [row[0] for row in self._rows(proc).values()] == ["skipped", "skipped", "skipped"]
+
+		proc = self._maintain(repo_root, "--force")
+
+		assert proc.returncode == 0
+		assert [row[0] for row in self._rows(proc).values()] == ["ok", "ok", "ok"]
+
+	def test_maintain_then_clean(self, _repo_root_loose: list[pathlib.Path]):
+		repo_root = _repo_root_loose[0]
+
+		for path in _repo_root_loose[1:]:
+			_make_path_old(path, 10)
+
+		assert self._maintain(repo_root).returncode == 0
+
+		# maintenance is not activity, so it must not keep stale repos around
+		proc = subprocess.run(
+			args=[_REPO_MANAGER_PATH, "clean", "--yes", "--after", "7"],
+			env={
+				_ENV_REPO_ROOT: repo_root,
+			},
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+		assert proc.returncode == 0
+
+		for path in _repo_root_loose[1:]:
+			assert not path.exists()
+
+	def test_maintain_with_bad_ionice(self, _repo_root_loose: list[pathlib.Path]):
+		proc = self._maintain(_repo_root_loose[0], "--ionice", "realtime")
+
+		assert proc.returncode != 0
+		assert proc.stdout == b"'--ionice' expected 'idle' or 'best-effort' but found 'realtime'\n"
+
+
+@pytest.fixture
+def _repo_root_grep(_repo_root_local: list[pathlib.Path]) -> list[pathlib.Path]:
+	'''_repo_root_grep commits a file with a few matching lines to each local repo.'''
+	for path in _repo_root_local[1:]:
+		repo = git.Repo(path)
+
+		(path / "notes").write_text("".join(f"needle {i}\n" for i in range(3)) + "haystack\n")
+		repo.index.add(["notes"])
+		repo.index.commit("add notes")
+
+	return _repo_root_local
+
+
+class TestRepoManagerGrep:
+	def _grep(self, repo_root: pathlib.Path, *args: str, path: str | None = None) -> subprocess.CompletedProcess:
+		env = {
+			_ENV_REPO_ROOT: repo_root,
+		}
+
+		if path is not None:
+			env["PATH"] = f"{path}:{os.environ['PATH']}"
+
+		return subprocess.run(
+			args=[_REPO_MANAGER_PATH, "grep", *args],
+			env=env,
+			capture_output=True,
+			timeout=_REPO_MANAGER_TIMEOUT,
+		)
+
+	def test_grep(self, _repo_root_grep: list[pathlib.Path]):
+		proc = self._grep(_repo_root_grep[0], "--jobs", "2", "needle 1")
+
+		assert proc.returncode == 0
+		assert sorted(proc.stdout.decode().splitlines()) == [
+			"alice/first:notes:needle 1",
+			"alice/second:notes:needle 1",
+			"bob/first:notes:needle 1",
+		]
+
+	def test_grep_with_owner(self, _repo_root_grep: list[pathlib.Path]):
+		proc = self._grep(_repo_root_grep[0], "--owner", "b*", "--", "-n", "haystack")
+
+		assert proc.returncode == 0
+		assert proc.stdout == b"bob/first:notes:4:haystack\n"
+
+	def test_grep_with_limit(self, _repo_root_grep: list[pathlib.Path]):
+		proc = self._grep(_repo_root_grep[0], "--limit", "4", "needle")
+
+		assert proc.returncode == 0
+		assert len(proc.stdout.decode().splitlines()) == 4
+
+	def test_grep_limit_cancels_search(self, _repo_root_grep: list[pathlib.Path], tmp_path: pathlib.Path):
+		# a git which finds a single match and then keeps searching, any leftover process would hold stdout open
+		fake_git = tmp_path / "git"
+		fake_git.write_text("#!/bin/sh\necho 'notes:needle'\nexec sleep 60\n")
+		fake_git.chmod(0o755)
+
+		proc = self._grep(_repo_root_grep[0], "--jobs", "3", "--limit", "1", "needle", path=str(tmp_path))
+
+		assert proc.returncode == 0
+		assert len(proc.stdout.decode().splitlines()) == 1
+
+	def test_grep_no_pattern(self, _repo_root_grep: list[pathlib.Path]):
+		proc = self._grep(_repo_root_grep[0])
+
+		assert proc.returncode != 0
+		assert proc.stdout == b"expected a pattern but found none\n"
@@ -0,0 +1,400 @@
+import pathlib
+import pytest
+import os
+import shutil
+import json
+import socket
+import threading
+import http.server
+import subprocess
+import time
+
+
+_WF_TIMEOUT: int = 30
+_WF_PATH: str = os.path.abspath("common/wf.sh")
+
+
+def _wf(tmp_path: pathlib.Path, *args: str) -> subprocess.CompletedProcess:
+	'''_wf runs wf.sh with its temporary files kept under $tmp_path/tmp, so any it leaves behind can be found.'''
+	(tmp_path / "tmp").mkdir(exist_ok=True)
+
+	return subprocess.run(
+		args=[_WF_PATH, *args],
+		env={
+			**os.environ,
+			"TMPDIR": str(tmp_path / "tmp"),
+		},
+		capture_output=True,
+		timeout=_WF_TIMEOUT,
+	)
+
+
+def _summary(proc: subprocess.CompletedProcess) -> dict:
+	return json.loads(proc.stdout.decode().splitlines()[-1])
+
+
+def _script(tmp_path: pathlib.Path, name: str, body: str) -> pathlib.Path:
+	script = tmp_path / name
+	script.write_text(f"#!/bin/bash\n{body}")
+	script.chmod(0o700)
+
+	return script
+
+
+@pytest.fixture
+def _ready_after_3(tmp_path: pathlib.Path) -> pathlib.Path:
+	'''_ready_after_3 is a command which prints the attempt and fails until its third attempt.'''
+	return _script(tmp_path, "ready_after_3", f'''
+echo . >> {tmp_path / "attempts"}
+echo "attempt $(wc -l < {tmp_path / "attempts"})"
+[ "$(wc -l < {tmp_path / "attempts"})" -ge 3 ]
+''')
+
+
+@pytest.fixture
+def _http_server() -> str:
+	class Handler(http.server.BaseHTTPRequestHandler):
+		def log_message(self, *args):
+			pass
+
+		def do_GET(self):
+			self.send_response(200 if self.path == "/ready" else 404)
+			self.end_headers()
+
+	server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+
+	yield f"http://127.0.0.1:{server.server_port}"
+
+	server.shutdown()
+	server.server_close()
+
+
+class TestWf:
+	def test_ready(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "true")
+
+		assert proc.returncode == 0
+		assert proc.stdout == b""
+
+	def test_no_command(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-m", "1")
+
+		assert proc.returncode != 0
+		assert proc.stdout == b"expected a command but found none\n"
+
+	def test_retries_until_ready(self, tmp_path: pathlib.Path, _ready_after_3: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-i", "0.01", str(_ready_after_3))
+
+		assert proc.returncode == 0
+		assert proc.stdout.decode().splitlines()[0] == "attempt 3"
+		assert _summary(proc)["conditions"][0]["attempts"] == 3
+
+	def test_max_attempts(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-m", "3", "-i", "0.01", "false")
+
+		assert proc.returncode == 1
+		assert _summary(proc)["conditions"][0]["attempts"] == 3
+
+	def test_zero_max_attempts(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-m", "0", "-i", "0.01", "false")
+
+		assert proc.returncode == 1
+		assert _summary(proc)["conditions"][0]["attempts"] == 1
+
+	def test_progress(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-p", "-m", "3", "-i", "0.01", "false")
+
+		assert proc.returncode == 1
+		assert proc.stdout == b"...err\n"
+
+	@pytest.mark.parametrize("backoff,expected_ms", [("fixed", 300), ("linear", 600), ("exponential", 700)])
+	def test_backoff(self, tmp_path: pathlib.Path, backoff: str, expected_ms: int):
+		proc = _wf(tmp_path, "-S", "-m", "4", "-i", "0.1", "-b", backoff, "false")
+
+		assert proc.returncode == 1
+
+		waited = _summary(proc)["conditions"][0]["waited_ms"]
+		assert expected_ms <= waited < expected_ms + 1000
+
+	def test_max_interval(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-m", "4", "-i", "0.2", "-b", "exponential", "-x", "0.2", "false")
+
+		assert proc.returncode == 1
+
+		# without the max interval this would be .2 + .4 + .8 seconds
+		waited = _summary(proc)["conditions"][0]["waited_ms"]
+		assert 600 <= waited < 1400
+
+	def test_long_interval(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-m", "2", "-i", "90", "-t", "75", "false")
+
+		assert proc.returncode == 1
+
+		# capped at 60 seconds there would be time left to sleep and retry before the deadline
+		assert _summary(proc)["conditions"][0]["attempts"] == 1
+		assert _summary(proc)["elapsed_ms"] < 5000
+
+	def test_jitter(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-m", "6", "-i", "0.5", "-j", "false")
+
+		assert proc.returncode == 1
+
+		# each sleep is anywhere up to the interval, so sleeping for almost all of each of them is next to impossible
+		waited = _summary(proc)["conditions"][0]["waited_ms"]
+		assert waited < 5 * 500 - 50
+
+	def test_bad_backoff(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-b", "quadratic", "true")
+
+		assert proc.returncode != 0
+		assert proc.stdout.decode().splitlines()[0] == "'quadratic' is not a valid option to '-b'"
+
+	def test_bad_interval(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-i", "1.2345", "true")
+
+		assert proc.returncode != 0
+		assert proc.stdout == b"value '1.2345' is not a valid number of seconds\n"
+
+	def test_deadline(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-t", "0.5", "-i", "0.1", "sleep", "5")
+
+		assert proc.returncode == 1
+		assert _summary(proc)["elapsed_ms"] < 2000
+
+	def test_deadline_without_time_to_retry(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-t", "0.5", "-i", "1", "false")
+
+		assert proc.returncode == 1
+		assert _summary(proc)["conditions"][0]["attempts"] == 1
+		assert _summary(proc)["elapsed_ms"] < 500
+
+	def test_attempt_timeout(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-T", "0.2", "-m", "2", "-i", "0.01", "sleep", "5")
+
+		assert proc.returncode == 1
+
+		condition = _summary(proc)["conditions"][0]
+		assert condition["attempts"] == 2
+		assert condition["attempt_ms"]["max"] < 1500
+
+
+class TestWfProbes:
+	def test_tcp(self, tmp_path: pathlib.Path):
+		with socket.socket() as listener:
+			listener.bind(("127.0.0.1", 0))
+			listener.listen()
+
+			proc = _wf(tmp_path, "-m", "1", "-w", f"tcp://127.0.0.1:{listener.getsockname()[1]}")
+
+		assert proc.returncode == 0
+
+	def test_tcp_closed(self, tmp_path: pathlib.Path):
+		with socket.socket() as unused:
+			unused.bind(("127.0.0.1", 0))
+			port = unused.getsockname()[1]
+
+		proc = _wf(tmp_path, "-m", "2", "-i", "0.01", "-w", f"tcp://127.0.0.1:{port}")
+
+		assert proc.returncode == 1
+
+	def test_http(self, tmp_path: pathlib.Path, _http_server: str):
+		proc = _wf(tmp_path, "-m", "1", "-w", f"{_http_server}/ready")
+
+		assert proc.returncode == 0
+		assert proc.stdout == b"HTTP/1.0 200 OK\n"
+
+	def test_http_not_found(self, tmp_path: pathlib.Path, _http_server: str):
+		proc = _wf(tmp_path, "-m", "2", "-i", "0.01", "-w", f"{_http_server}/missing")
+
+		assert proc.returncode == 1
+		assert proc.stdout == b"HTTP/1.0 404 Not Found\n"
+
+	def test_file(self, tmp_path: pathlib.Path):
+		(tmp_path / "file").touch()
+
+		assert _wf(tmp_path, "-m", "1", "-w", f"file://{tmp_path / "file"}").returncode == 0
+		assert _wf(tmp_path, "-m", "2", "-i", "0.01", "-w", f"file://{tmp_path / "missing"}").returncode == 1
+
+	@pytest.mark.skipif(shutil.which("inotifywait") is None, reason="inotifywait is not installed")
+	def test_change(self, tmp_path: pathlib.Path):
+		(tmp_path / "tmp").mkdir()
+		(tmp_path / "file").touch()
+
+		proc = subprocess.Popen(
+			args=[_WF_PATH, "-S", "-m", "1", "-T", "20", "-w", f"change://{tmp_path / "file"}"],
+			env={
+				**os.environ,
+				"TMPDIR": str(tmp_path / "tmp"),
+			},
+			stdout=subprocess.PIPE,
+		)
+
+		# the file is modified until the wait sees it, since a change before inotifywait is watching is missed
+		while proc.poll() is None:
+			with open(tmp_path / "file", "a") as file:
+				file.write("changed\n")
+
+			time.sleep(.1)
+
+		stdout, _ = proc.communicate(timeout=_WF_TIMEOUT)
+
+		assert proc.returncode == 0
+
+		# the wait is woken by the change rather than running until -T
+		summary = json.loads(stdout.decode().splitlines()[-1])
+		assert summary["conditions"][0]["attempts"] == 1
+		assert summary["elapsed_ms"] < 10000
+
+	@pytest.mark.skipif(shutil.which("inotifywait") is None, reason="inotifywait is not installed")
+	def test_change_timeout(self, tmp_path: pathlib.Path):
+		(tmp_path / "file").touch()
+
+		proc = _wf(tmp_path, "-S", "-m", "1", "-T", "1", "-w", f"change://{tmp_path / "file"}")
+
+		assert proc.returncode == 1
+		assert 1000 <= _summary(proc)["elapsed_ms"] < 5000
+
+	def test_bad_probe(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-w", "ftp://example.com")
+
+		assert proc.returncode != 0
+		assert proc.stdout.decode().splitlines()[0] == "'ftp://example.com' is not a valid probe"
+
+
+class TestWfConditions:
+	def test_all(self, tmp_path: pathlib.Path):
+		(tmp_path / "file").touch()
+
+		proc = _wf(tmp_path, "-c", "true", "-w", f"file://{tmp_path / "file"}")
+
+		assert proc.returncode == 0
+
+		lines = proc.stdout.decode().splitlines()
+		assert lines[0].startswith("true: ready after ")
+		assert lines[1].startswith(f"file://{tmp_path / "file"}: ready after ")
+
+	def test_file_created(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-i", "0.05", "-c", f"touch {tmp_path / "file"}", "-w", f"file://{tmp_path / "file"}")
+
+		assert proc.returncode == 0
+		assert [condition["state"] for condition in _summary(proc)["conditions"]] == ["ready", "ready"]
+
+	def test_all_cancels_on_failure(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-m", "1", "-c", "false", "-c", "sleep 10")
+
+		assert proc.returncode == 1
+
+		lines = proc.stdout.decode().splitlines()
+		assert lines[0].startswith("false: failed after ")
+		assert lines[1].startswith("sleep 10: cancelled after ")
+		assert _summary(proc)["elapsed_ms"] < 5000
+
+	def test_any(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-R", "any", "-c", "true", "-c", "sleep 10")
+
+		assert proc.returncode == 0
+		assert [condition["state"] for condition in _summary(proc)["conditions"]] == ["ready", "cancelled"]
+		assert _summary(proc)["elapsed_ms"] < 5000
+
+	def test_any_all_failed(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-R", "any", "-m", "2", "-i", "0.01", "-c", "false", "-w", f"file://{tmp_path / "missing"}")
+
+		assert proc.returncode == 1
+
+	def test_bad_require(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-R", "most", "true")
+
+		assert proc.returncode != 0
+		assert proc.stdout.decode().splitlines()[0] == "'most' is not a valid option to '-R'"
+
+
+class TestWfOutput:
+	def test_last(self, tmp_path: pathlib.Path, _ready_after_3: pathlib.Path):
+		proc = _wf(tmp_path, "-i", "0.01", str(_ready_after_3))
+
+		assert proc.returncode == 0
+		assert proc.stdout == b"attempt 3\n"
+
+	def test_last_err(self, tmp_path: pathlib.Path, _ready_after_3: pathlib.Path):
+		assert _wf(tmp_path, "-o", "last-err", "-m", "1", str(_ready_after_3)).stdout == b"attempt 1\n"
+
+		(tmp_path / "attempts").unlink()
+
+		assert _wf(tmp_path, "-o", "last-err", "-i", "0.01", str(_ready_after_3)).stdout == b""
+
+	def test_never(self, tmp_path: pathlib.Path, _ready_after_3: pathlib.Path):
+		proc = _wf(tmp_path, "-o", "never", "-i", "0.01", str(_ready_after_3))
+
+		assert proc.returncode == 0
+		assert proc.stdout == b""
+
+	def test_all(self, tmp_path: pathlib.Path, _ready_after_3: pathlib.Path):
+		proc = _wf(tmp_path, "-o", "all", "-i", "0.01", str(_ready_after_3))
+
+		assert proc.returncode == 0
+		assert proc.stdout == b"attempt 1\nattempt 2\nattempt 3\n"
+
+	def test_bad_output(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-o", "always", "true")
+
+		assert proc.returncode != 0
+		assert proc.stdout.decode().splitlines()[0] == "'always' is not a valid option to '-o'"
+
+	def test_capture_size(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-s", "1", "-m", "1", "seq", "1", "100000")
+
+		assert proc.returncode == 0
+		assert len(proc.stdout) == 1024
+		assert proc.stdout.endswith(b"\n99999\n100000\n")
+
+	def test_no_temporary_files_left(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-m", "2", "-i", "0.01", "-c", "false", "-c", "echo abc")
+
+		assert proc.returncode == 1
+		assert list((tmp_path / "tmp").iterdir()) == []
+
+	def test_no_temporary_files_left_when_stopped(self, tmp_path: pathlib.Path):
+		(tmp_path / "tmp").mkdir()
+
+		proc = subprocess.Popen(
+			args=[_WF_PATH, "-i", "10", "-c", "false", "-c", "sleep 10"],
+			env={
+				**os.environ,
+				"TMPDIR": str(tmp_path / "tmp"),
+			},
+			stdout=subprocess.PIPE,
+		)
+
+		# wait for the first attempt to have started before stopping it
+		while not any((tmp_path / "tmp").glob("*/*.attempts")):
+			assert proc.poll() is None
+
+		proc.terminate()
+		proc.communicate(timeout=_WF_TIMEOUT)
+
+		assert proc.returncode != 0
+		assert list((tmp_path / "tmp").iterdir()) == []
+
+	def test_summary(self, tmp_path: pathlib.Path, _ready_after_3: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-i", "0.01", str(_ready_after_3))
+
+		assert proc.returncode == 0
+
+		summary = _summary(proc)
+		assert summary["ready"] is True
+
+		condition = summary["conditions"][0]
+		assert condition["condition"] == str(_ready_after_3)
+		assert condition["state"] == "ready"
+		assert condition["attempts"] == 3
+		assert condition["waited_ms"] >= 20
+
+		percentiles = condition["attempt_ms"]
+		assert percentiles["min"] <= percentiles["p50"] <= percentiles["p90"] <= percentiles["p99"] <= percentiles["max"]
+
+	def test_summary_escapes_conditions(self, tmp_path: pathlib.Path):
+		proc = _wf(tmp_path, "-S", "-c", 'echo "quoted"\t\\')
+
+		assert proc.returncode == 0
+		assert _summary(proc)["conditions"][0]["condition"] == 'echo "quoted"\t\\'
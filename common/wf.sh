@@ -1,18 +1,68 @@
-#!/usr/bin/env sh
+#!/usr/bin/env bash
 
 # todo: support inverting the condition or provide more condition options
 
 usage="Usage: $(basename "$0") [-hq] [-m <max-attempts>] [-i <interval>]
-																		 [-o <never|last|last-err|all>] <args>...
+																		 [-b <fixed|linear|exponential>] [-x <max-interval>] [-j]
+																		 [-t <timeout>] [-T <attempt-timeout>]
+																		 [-o <never|last|last-err|all>] [-s <size>] [-S]
+																		 [-R <all|any>]
+																		 [-c <command>]... [-w <probe>]... [<args>...]
 
 opts:
 	-m <max-attempts>     maximum count amount [inf]
-	-i <interval>         the interval between attempts [1]
-	-o <never|last|all>   control whether out output to the given command is
-												displayed never, only the last attempt, or all attempts
-												[last]
+	-i <interval>         the interval between attempts in seconds [1]
+	-b <backoff>          how the interval grows after each failed attempt,
+												either staying the same (fixed), growing by the interval
+												(linear) or doubling (exponential) [fixed]
+	-x <max-interval>     the longest interval between attempts, which is 60 or
+												the interval if it is longer when the interval grows
+												with -b and is otherwise not capped [inf]
+	-j                    sleep a random time between 0 and the interval rather
+												than the interval, so many waits do not retry in lockstep
+	-t <timeout>          give up after this many seconds, stopping an attempt
+												which is still running [inf]
+	-T <attempt-timeout>  stop any single attempt after this many seconds [inf]
+	-o <never|last|last-err|all>
+												control whether out output to the given command is
+												displayed never, only for the last attempt, only for
+												the last attempt if it failed, or as it is written by
+												every attempt [last]
+	-s <size>             keep at most the last <size> KiB of the output of the
+												last attempt [64]
+	-S                    print a JSON summary of the attempts once done
 	-p                    print a '.' each time the command is tried and whether
 												the command succeeded or failed on the last attempt
+	-c <command>          wait for a command, which may be given more than once
+												along with the command in <args>
+	-w <probe>            wait for a built-in probe rather than a command, which
+												is checked without starting a new process and may be
+												given more than once
+	-R <all|any>          whether to wait for all of the conditions to be ready
+												or only for any one of them [all]
+
+probes:
+	tcp://<host>:<port>           a connection can be opened to the port
+	http://<host>[:<port>][/path] a GET responds with a status below 400
+	file://<path>                 the path exists
+	change://<path>               the path is changed, which waits for the
+	                              change with inotifywait rather than polling
+
+Output is never kept for more than one attempt at a time, and only the last
+-s KiB of it is held as it is written, so long waits on chatty commands do not
+fill up the disk.
+
+The summary is a single line which is always printed last, with the attempt
+count, time spent waiting between attempts and percentiles of how long the
+attempts took for each condition, to help tune -i, -b and -T.
+
+Probes are only run in a subshell when they need to be stopped after -t or -T,
+and only change:// probes start a process.
+
+When given more than one command or probe they are all waited for at the same
+time, each with its own attempts. Once one of them fails, or with '-R any' once
+one of them is ready, the others are cancelled. How long each one took is
+printed once the wait is over.
 "
 
 if [ "$#" -eq 0 ]; then
@@ -31,10 +81,43 @@ assert_positive_int()
 	esac
 }
 
+# to_ms stores the seconds ($2), with at most millisecond precision, as milliseconds in the variable named $1.
+to_ms()
+{
+	local fraction=000
+
+	if ! [[ "$2" =~ ^[0-9]+(\.[0-9]{1,3})?$ ]]; then
+		echo "value '$2' is not a valid number of seconds"
+		exit 1
+	fi
+
+	if [[ "$2" == *.* ]]; then
+		fraction="${2#*.}000"
+	fi
+
+	printf -v "$1" '%d' $((10#${2%.*} * 1000 + 10#${fraction:0:3}))
+}
+
+# now_ms stores the current time in milliseconds in the variable named $1.
+now_ms()
+{
+	printf -v "$1" '%d' $((${EPOCHREALTIME/./} / 1000))
+}
+
 max_attempts=-1
-interval=1
+interval_ms=1000
+backoff=fixed
+max_interval_ms=-1
+jitter=false
+deadline_ms=-1
+attempt_timeout_ms=-1
 output_level=last
+capture_kb=64
+summary=false
 progress=false
+require=all
+conditions=()
+condition_kinds=()
 
 while [ "$#" -gt 0 ]; do
 	case "$1" in
@@ -48,8 +131,36 @@ while [ "$#" -gt 0 ]; do
 			shift
 			;;
 		-i)
-			assert_positive_int "$2"
-			interval=$2
+			to_ms interval_ms "$2"
+			shift
+			;;
+		-b)
+			backoff="$2"
+
+			case "$backoff" in
+				fixed|linear|exponential) ;;
+				*)
+					echo "'$backoff' is not a valid option to '-b'"
+					echo "$usage"
+					exit 1
+					;;
+			esac
+
+			shift
+			;;
+		-x)
+			to_ms max_interval_ms "$2"
+			shift
+			;;
+		-j)
+			jitter=true
+			;;
+		-t)
+			to_ms deadline_ms "$2"
+			shift
+			;;
+		-T)
+			to_ms attempt_timeout_ms "$2"
 			shift
 			;;
 		-o)
@@ -60,56 +171,498 @@ while [ "$#" -gt 0 ]; do
 				*)
 					echo "'$output_level' is not a valid option to '-o'"
 					echo "$usage"
+					exit 1
 					;;
 			esac
 
 			shift
 			;;
+		-s)
+			assert_positive_int "$2"
+			capture_kb=$2
+			shift
+			;;
+		-S)
+			summary=true
+			;;
 		-p)
 			progress=true
 			;;
+		-w)
+			case "$2" in
+				tcp://*:*|http://*|file://*) ;;
+				change://*)
+					if ! command -v inotifywait > /dev/null; then
+						echo "'change://' probes require inotifywait"
+						exit 1
+					fi
+					;;
+				*)
+					echo "'$2' is not a valid probe"
+					echo "$usage"
+					exit 1
+					;;
+			esac
+
+			conditions+=("$2")
+			condition_kinds+=(probe)
+			shift
+			;;
+		-c)
+			conditions+=("$2")
+			condition_kinds+=(command)
+			shift
+			;;
+		-R)
+			require="$2"
+
+			case "$require" in
+				all|any) ;;
+				*)
+					echo "'$require' is not a valid option to '-R'"
+					echo "$usage"
+					exit 1
+					;;
+			esac
+
+			shift
+			;;
 		*)
-			args="$*"
+			conditions+=("$*")
+			condition_kinds+=(command)
 			break
 			;;
 	esac
 	shift
 done
 
-if [ "$output_level" = never ]; then
-	cmd_out=/dev/null
-else
-	cmd_out="$(mktemp --suffix .wf)"
+if [ "${#conditions[@]}" -eq 0 ]; then
+	echo "expected a command but found none"
+	exit 1
 fi
 
-attempts=0
+# only a growing interval is capped by default, and never below the interval it starts from
+if [ "$max_interval_ms" -eq -1 ] && [ "$backoff" != fixed ]; then
+	max_interval_ms=$((interval_ms > 60000 ? interval_ms : 60000))
+fi
+
+# work_dir holds the output of the last attempt ($i.out), how long each attempt took ($i.attempts) and the result
+# ($i.result) of each condition
+work_dir="$(mktemp --directory --suffix .wf)"
+pids=()
+
+# cleanup cancels any conditions which are still being waited for and removes their output.
+cleanup()
+{
+	local pid
+
+	for pid in "${pids[@]}"; do
+		kill -- -"$pid" 2> /dev/null
+	done
 
-while ! $args > "$cmd_out" 2>&1 && { [ "$max_attempts" = -1 ] || [ "$attempts" -lt "$max_attempts" ]; }; do
-	attempts=$((attempts + 1))
+	rm --recursive --force "$work_dir"
+}
 
-	if [ "$output_level" = always ]; then
-		cat "$cmd_out"
-	elif $progress; then
-		printf .
+trap cleanup EXIT
+trap 'exit 1' INT TERM
+
+# next_interval stores how many milliseconds to sleep after the failed attempt ($2) in the variable named $1.
+next_interval()
+{
+	local interval
+
+	case "$backoff" in
+		fixed)
+			interval=$interval_ms
+			;;
+		linear)
+			interval=$((interval_ms * $2))
+			;;
+		exponential)
+			# past 2^20 times the interval the max interval has long been reached
+			interval=$((interval_ms << ($2 - 1 < 20 ? $2 - 1 : 20)))
+			;;
+	esac
+
+	if [ "$max_interval_ms" -ne -1 ] && [ "$interval" -gt "$max_interval_ms" ]; then
+		interval=$max_interval_ms
 	fi
 
-	sleep "$interval"
-done
+	# full jitter, spreading the sleep evenly between nothing and the whole interval
+	if $jitter; then
+		interval=$(((RANDOM << 15 | RANDOM) % (interval + 1)))
+	fi
 
-if $progress; then
-	if [ "$attempts" -eq "$max_attempts" ]; then
-		echo err
+	printf -v "$1" '%d' "$interval"
+}
+
+# to_seconds stores the milliseconds ($2) as seconds in the variable named $1.
+to_seconds()
+{
+	printf -v "$1" '%d.%03d' $(($2 / 1000)) $(($2 % 1000))
+}
+
+# probe_http sends a GET to the url ($1) and fails unless the response status is below 400, giving up on the response
+# after $2 milliseconds unless it is -1.
+probe_http()
+{
+	local url="${1#http://}" host_port path="/" host port=80 fd timeout="" version status reason
+
+	host_port="${url%%/*}"
+	host="${host_port%:*}"
+
+	if [[ "$url" == */* ]]; then
+		path="/${url#*/}"
+	fi
+
+	if [[ "$host_port" == *:* ]]; then
+		port="${host_port##*:}"
+	fi
+
+	if [ "$2" -ne -1 ]; then
+		to_seconds timeout "$2"
+	fi
+
+	exec {fd}<> "/dev/tcp/$host/$port" || return 1
+	printf 'GET %s HTTP/1.0\r\nHost: %s\r\nConnection: close\r\n\r\n' "$path" "$host_port" >&$fd
+	read -r ${timeout:+-t $timeout} -u $fd version status reason
+	exec {fd}>&-
+
+	echo "$version $status ${reason%$'\r'}"
+	[[ "$status" =~ ^[1-3][0-9][0-9]$ ]]
+}
+
+# probe checks the probe ($1) once, taking at most $2 milliseconds unless it is -1.
+probe()
+{
+	local target="${1#*://}" fd timeout
+
+	case "$1" in
+		tcp://*)
+			exec {fd}<> "/dev/tcp/${target%:*}/${target##*:}" || return 1
+			exec {fd}>&-
+			;;
+		http://*)
+			probe_http "$1" "$2"
+			;;
+		file://*)
+			[ -e "$target" ]
+			;;
+		change://*)
+			if [ "$2" -ne -1 ]; then
+				# inotifywait only takes whole seconds
+				timeout=$((($2 + 999) / 1000))
+			fi
+
+			inotifywait --quiet --quiet ${timeout:+--timeout $timeout} \
+				--event modify,attrib,close_write,move,create,delete "$target"
+			;;
+	esac
+}
+
+# run_probe checks the probe ($1) in the shell itself when there is no limit on how long it may take, and otherwise in
+# a subshell which is given up on after $2 milliseconds. A change:// probe is given the limit itself.
+run_probe()
+{
+	local fd pid timeout status
+
+	if [ "$2" -eq -1 ] || [[ "$1" == change://* ]]; then
+		probe "$1" "$2"
+		return
+	fi
+
+	exec {fd}< <(probe "$1" "$2" >&2; echo $?)
+	pid=$!
+
+	to_seconds timeout "$2"
+
+	if ! read -r -t "$timeout" -u $fd status; then
+		kill "$pid" 2> /dev/null
+		echo "probe timed out after $timeout seconds"
+		status=1
+	fi
+
+	exec {fd}<&-
+
+	return "$status"
+}
+
+# run_attempt runs the command or checks the probe of the condition ($1) once, stopping it once it has run for longer
+# than -T or past the -t deadline.
+run_attempt()
+{
+	local now limit_ms=$attempt_timeout_ms limit
+
+	if [ "$deadline_ms" -ne -1 ]; then
+		now_ms now
+
+		if [ "$limit_ms" -eq -1 ] || [ $((end_ms - now)) -lt "$limit_ms" ]; then
+			limit_ms=$((end_ms - now > 0 ? end_ms - now : 1))
+		fi
+	fi
+
+	if [ "${condition_kinds[$1]}" = probe ]; then
+		run_probe "${conditions[$1]}" "$limit_ms"
+	elif [ "$limit_ms" -eq -1 ]; then
+		${conditions[$1]}
 	else
+		to_seconds limit "$limit_ms"
+		timeout --kill-after 1 "$limit" ${conditions[$1]}
+	fi
+}
+
+# capture_attempt runs an attempt of the condition ($1), streaming its output with '-o all' and otherwise keeping only
+# the last -s KiB of it.
+capture_attempt()
+{
+	case "$output_level" in
+		all)
+			run_attempt "$1" 2>&1
+			;;
+		never)
+			run_attempt "$1" > /dev/null 2>&1
+			;;
+		*)
+			# a probe only ever writes a line, which is not worth starting a process to bound
+			if [ "${condition_kinds[$1]}" = probe ]; then
+				run_attempt "$1" > "$work_dir/$1.out" 2>&1
+			else
+				run_attempt "$1" 2>&1 | tail --bytes "${capture_kb}K" > "$work_dir/$1.out"
+				return "${PIPESTATUS[0]}"
+			fi
+			;;
+	esac
+}
+
+# wait_for attempts the condition ($1) until it is ready or it runs out of attempts or time, storing whether it became
+# ready in $ok, the number of attempts in $attempts and how long it took in $elapsed_ms.
+wait_for()
+{
+	local attempt_start now status sleep_ms sleep_seconds
+
+	attempts=0
+	ok=false
+
+	while true; do
+		attempts=$((attempts + 1))
+
+		now_ms attempt_start
+		capture_attempt "$1"
+		status=$?
+		now_ms now
+
+		printf '%d\n' $((now - attempt_start)) >> "$work_dir/$1.attempts"
+
+		if [ "$status" -eq 0 ]; then
+			ok=true
+			break
+		fi
+
+		if $progress; then
+			printf .
+		fi
+
+		# the first attempt is always made, even with '-m 0'
+		if [ "$max_attempts" -ne -1 ] && [ "$attempts" -ge "$max_attempts" ]; then
+			break
+		fi
+
+		next_interval sleep_ms "$attempts"
+
+		if [ "$deadline_ms" -ne -1 ]; then
+			now_ms now
+
+			# there is no time left for another attempt
+			if [ $((end_ms - now)) -le "$sleep_ms" ]; then
+				break
+			fi
+		fi
+
+		to_seconds sleep_seconds "$sleep_ms"
+		read -r -t "$sleep_seconds" -u $sleep_fd
+	done
+
+	now_ms now
+	elapsed_ms=$((now - start_ms))
+
+	printf '%s %d %d\n' $ok $attempts $elapsed_ms > "$work_dir/$1.result"
+}
+
+# wait_for_all waits for every condition at the same time, each in its own process group so it can be cancelled along
+# with whatever it is running, and adds how long each of them took to $report. The result of a condition is only
+# missing if it was cancelled.
+wait_for_all()
+{
+	local -A indexes
+	local i pid result now ready=0 failed=0 elapsed
+
+	set -m
+	for i in "${!conditions[@]}"; do
+		wait_for "$i" &
+
+		pids[$i]=$!
+		indexes[$!]=$i
+	done
+	set +m
+
+	while [ $((ready + failed)) -lt "${#conditions[@]}" ]; do
+		wait -n -p pid "${pids[@]}"
+		unset "pids[${indexes[$pid]}]"
+
+		read -r result _ < "$work_dir/${indexes[$pid]}.result"
+
+		if $result; then
+			ready=$((ready + 1))
+		else
+			failed=$((failed + 1))
+		fi
+
+		if { [ "$require" = all ] && ! $result; } || { [ "$require" = any ] && $result; }; then
+			break
+		fi
+	done
+
+	for pid in "${pids[@]}"; do
+		kill -- -"$pid" 2> /dev/null
+	done
+
+	pids=()
+	now_ms now
+
+	for i in "${!conditions[@]}"; do
+		if [ -e "$work_dir/$i.result" ]; then
+			read -r result attempts elapsed_ms < "$work_dir/$i.result"
+			to_seconds elapsed "$elapsed_ms"
+
+			if $result; then
+				report+=("${conditions[$i]}: ready after ${elapsed}s and $attempts attempts")
+			else
+				report+=("${conditions[$i]}: failed after ${elapsed}s and $attempts attempts")
+			fi
+		else
+			to_seconds elapsed $((now - start_ms))
+			report+=("${conditions[$i]}: cancelled after ${elapsed}s")
+		fi
+	done
+
+	if [ "$require" = all ]; then
+		[ "$ready" -eq "${#conditions[@]}" ] && ok=true || ok=false
+	else
+		[ "$ready" -gt 0 ] && ok=true || ok=false
+	fi
+}
+
+# json_string stores the string ($2) as a quoted JSON string in the variable named $1.
+json_string()
+{
+	local escaped="$2"
+
+	escaped="${escaped//\\/\\\\}"
+	escaped="${escaped//\"/\\\"}"
+	escaped="${escaped//$'\n'/\\n}"
+	escaped="${escaped//$'\r'/\\r}"
+	escaped="${escaped//$'\t'/\\t}"
+
+	printf -v "$1" '"%s"' "$escaped"
+}
+
+# print_summary prints the attempt count, time spent waiting between attempts and percentiles of how long the attempts
+# took for each condition as a single line of JSON.
+print_summary()
+{
+	local i now state elapsed total waited duration percentiles condition separator=""
+	local -a durations
+
+	now_ms now
+
+	printf '{"ready":%s,"elapsed_ms":%d,"conditions":[' $ok $((now - start_ms))
+
+	for i in "${!conditions[@]}"; do
+		durations=()
+
+		if [ -e "$work_dir/$i.attempts" ]; then
+			mapfile -t durations < <(sort --numeric-sort "$work_dir/$i.attempts")
+		fi
+
+		total=0
+		for duration in "${durations[@]}"; do
+			total=$((total + duration))
+		done
+
+		if [ -e "$work_dir/$i.result" ]; then
+			read -r state _ elapsed < "$work_dir/$i.result"
+			$state && state=ready || state=failed
+			waited=$((elapsed - total))
+		else
+			# how long the attempt which was cancelled had been running is unknown
+			state=cancelled
+			elapsed=$((now - start_ms))
+			waited=null
+		fi
+
+		if [ "${#durations[@]}" -eq 0 ]; then
+			percentiles=null
+		else
+			# the same nearest-rank percentiles as the controller benchmark
+			printf -v percentiles '{"min":%d,"p50":%d,"p90":%d,"p99":%d,"max":%d}' \
+				"${durations[0]}" \
+				"${durations[${#durations[@]} * 50 / 100]}" \
+				"${durations[${#durations[@]} * 90 / 100]}" \
+				"${durations[${#durations[@]} * 99 / 100]}" \
+				"${durations[-1]}"
+		fi
+
+		json_string condition "${conditions[$i]}"
+
+		printf '%s{"condition":%s,"state":"%s","attempts":%d,"elapsed_ms":%d,"waited_ms":%s,"attempt_ms":%s}' \
+			"$separator" "$condition" $state ${#durations[@]} "$elapsed" $waited "$percentiles"
+
+		separator=,
+	done
+
+	echo ']}'
+}
+
+# reading from a pipe which is never written to sleeps without starting a process for every attempt
+exec {sleep_fd}<> <(:)
+
+now_ms start_ms
+end_ms=$((start_ms + deadline_ms))
+
+report=()
+
+if [ "${#conditions[@]}" -eq 1 ]; then
+	wait_for 0
+else
+	wait_for_all
+fi
+
+if $progress; then
+	if $ok; then
 		echo ok
+	else
+		echo err
 	fi
 fi
 
-if [ "$output_level" = last ]; then
-	cat "$cmd_out"
-elif [ "$output_level" = last-err ] && [ "$attempts" -eq "$max_attempts" ]; then
-	cat "$cmd_out"
+for line in "${report[@]}"; do
+	echo "$line"
+done
+
+for i in "${!conditions[@]}"; do
+	if [ ! -e "$work_dir/$i.out" ]; then
+		continue
+	elif [ "$output_level" = last ]; then
+		cat "$work_dir/$i.out"
+	elif [ "$output_level" = last-err ] && ! $ok; then
+		cat "$work_dir/$i.out"
+	fi
+done
+
+if $summary; then
+	print_summary
 fi
 
-if [ "$attempts" -eq "$max_attempts" ]; then
+if ! $ok; then
 	exit 1
 fi
@@ -1,14 +1,73 @@
 #!/usr/bin/bash
 
+workers=1
+queue_size=1024
+queue_full=block
+key=name
+debounce=0
+all_namespaces=false
+event_types=ADDED,MODIFIED,DELETED
+persistent=false
+metrics_interval=5
+cache=false
+resync=0
+resync_rate=10
+retries=0
+retry_backoff=1
+
+# expect_number exits if the flag ($1) was not given a positive number ($2).
+expect_number() {
+	if [ $# -lt 2 ]; then
+		echo "expected arg to '$1' but found none..."
+		exit 1
+	fi
+
+	if ! [[ "$2" =~ ^[1-9][0-9]*$ ]]; then
+		echo "'$1' expected a positive number but found '$2'"
+		exit 1
+	fi
+}
+
+# expect_seconds exits if the flag ($1) was not given a number of seconds ($2) with at most microsecond precision.
+expect_seconds() {
+	if [ $# -lt 2 ]; then
+		echo "expected arg to '$1' but found none..."
+		exit 1
+	fi
+
+	if ! [[ "$2" =~ ^[0-9]+(\.[0-9]{1,6})?$ ]]; then
+		echo "'$1' expected a number of seconds but found '$2'"
+		exit 1
+	fi
+}
+
+# to_usec stores the seconds ($2) as whole microseconds in the variable named $1.
+to_usec() {
+	local fraction=000000
+
+	if [[ "$2" == *.* ]]; then
+		fraction="${2#*.}000000"
+	fi
+
+	printf -v "$1" '%d' $((10#${2%.*} * 1000000 + 10#${fraction:0:6}))
+}
+
+# to_seconds stores the microseconds ($2) as seconds in the variable named $1.
+to_seconds() {
+	printf -v "$1" '%d.%06d' $(($2 / 1000000)) $(($2 % 1000000))
+}
+
 while [ "$#" -gt 0 ]; do
 	case "$1" in
 		-n | --namespace )
 			flags+=" --namespace $2"
+			namespace="$2"
 			shift
 			;;
 
 		-A | --all-namespaces )
 			flags+=' --all-namespaces'
+			all_namespaces=true
 			;;
 
 		--field-selector )
@@ -18,6 +77,7 @@ while [ "$#" -gt 0 ]; do
 			fi
 
 			flags+=" --field-selector $2"
+			field_selector="$2"
 			shift
 			;;
 
@@ -28,6 +88,7 @@ while [ "$#" -gt 0 ]; do
 			fi
 
 			flags+=" --filename $2"
+			filename="$2"
 			shift
 			;;
 
@@ -47,7 +108,7 @@ while [ "$#" -gt 0 ]; do
 				exit 1
 			fi
 
-			flags+=" --raw $2"
+			raw_path="$2"
 			shift
 			;;
 
@@ -58,12 +119,206 @@ while [ "$#" -gt 0 ]; do
 			fi
 
 			flags+=" --selector $2"
+			selector="$2"
+			shift
+			;;
+
+		-w | --workers )
+			expect_number "$@"
+
+			workers="$2"
+			shift
+			;;
+
+		--queue-size )
+			expect_number "$@"
+
+			queue_size="$2"
+			shift
+			;;
+
+		--queue-full )
+			if [ $# -lt 2 ]; then
+				echo "expected arg to '$1' but found none..."
+				exit 1
+			fi
+
+			case "$2" in
+				block | drop-oldest )
+					queue_full="$2"
+					;;
+
+				* )
+					echo "'$1' expected 'block' or 'drop-oldest' but found '$2'"
+					exit 1
+					;;
+			esac
+
+			shift
+			;;
+
+		--key )
+			if [ $# -lt 2 ]; then
+				echo "expected arg to '$1' but found none..."
+				exit 1
+			fi
+
+			case "$2" in
+				name | uid )
+					key="$2"
+					;;
+
+				* )
+					echo "'$1' expected 'name' or 'uid' but found '$2'"
+					exit 1
+					;;
+			esac
+
+			shift
+			;;
+
+		--debounce )
+			expect_seconds "$@"
+
+			debounce="$2"
+			shift
+			;;
+
+		--filter | --changed )
+			if [ $# -lt 2 ]; then
+				echo "expected arg to '$1' but found none..."
+				exit 1
+			fi
+
+			# only --filter is given the event type
+			if [ "$1" == --filter ]; then
+				select_filter="$2"
+				check="def check(\$type): $2; empty"
+			else
+				changed_filter="$2"
+				check="def check: $2; empty"
+			fi
+
+			if ! jq --null-input "$check" 2> /dev/null; then
+				echo "'$1' expected a jq expression but found '$2'"
+				exit 1
+			fi
+
+			shift
+			;;
+
+		--event-types )
+			if [ $# -lt 2 ]; then
+				echo "expected arg to '$1' but found none..."
+				exit 1
+			fi
+
+			if ! [[ "$2" =~ ^(ADDED|MODIFIED|DELETED)(,(ADDED|MODIFIED|DELETED))*$ ]]; then
+				echo "'$1' expected a list of ADDED, MODIFIED or DELETED but found '$2'"
+				exit 1
+			fi
+
+			event_types="$2"
+			shift
+			;;
+
+		--persistent )
+			persistent=true
+			;;
+
+		--cache )
+			cache=true
+			;;
+
+		--metrics-file | --trace-log )
+			if [ $# -lt 2 ]; then
+				echo "expected arg to '$1' but found none..."
+				exit 1
+			fi
+
+			if [ "$1" == --metrics-file ]; then
+				metrics_file="$2"
+			else
+				trace_log="$2"
+			fi
+
+			shift
+			;;
+
+		--metrics-port )
+			expect_number "$@"
+
+			if ! command -v python3 > /dev/null; then
+				echo "'$1' requires python3 to serve the metrics"
+				exit 1
+			fi
+
+			metrics_port="$2"
+			shift
+			;;
+
+		--metrics-interval )
+			expect_seconds "$@"
+
+			metrics_interval="$2"
+			shift
+			;;
+
+		--resync | --retry-backoff )
+			expect_seconds "$@"
+
+			if [ "$1" == --resync ]; then
+				resync="$2"
+			else
+				retry_backoff="$2"
+			fi
+
+			shift
+			;;
+
+		--resync-rate )
+			expect_number "$@"
+
+			resync_rate="$2"
+			shift
+			;;
+
+		--retries )
+			if [ $# -lt 2 ]; then
+				echo "expected arg to '$1' but found none..."
+				exit 1
+			fi
+
+			if ! [[ "$2" =~ ^[0-9]+$ ]]; then
+				echo "'$1' expected a number but found '$2'"
+				exit 1
+			fi
+
+			retries="$2"
+			shift
+			;;
+
+		--resource-version-file )
+			if [ $# -lt 2 ]; then
+				echo "expected arg to '$1' but found none..."
+				exit 1
+			fi
+
+			rv_file="$2"
 			shift
 			;;
 
 		-h | --help)
 			echo "$(basename $0): [-n <namespace>] [-A] [--field-selector <field selector>]
                  [-f <path>] [-R <true|false>] [--raw <uri>] [-l <selector>]
+                 [-w <workers>] [--queue-size <size>] [--queue-full <block|drop-oldest>]
+                 [--key <name|uid>] [--debounce <seconds>]
+                 [--resource-version-file <path>] [--filter <expression>]
+                 [--changed <expression>] [--event-types <types>] [--persistent]
+                 [--metrics-file <path>] [--metrics-port <port>]
+                 [--metrics-interval <seconds>] [--trace-log <path>] [--cache]
+                 [--resync <seconds>] [--resync-rate <events>] [--retries <count>]
+                 [--retry-backoff <seconds>]
                  <SCRIPT> <KIND> [NAME]
 			
 $(basename $0) allows you to run k8s controllers straight from the terminal or
@@ -71,10 +326,90 @@ in your scripts. For example, to run the SCRIPT at './update-tracker.bash' each
 time a pod is updated run:
 	$(basename $0) ./update-tracker.bash pod
 
-For each update a new instance of SCRIPT is started, but will wait until the
-previous instance is complete. Be warned that this may eat up computing
-resources if there are many triggering events. To help prevent this run your
-own checks and validations early.
+Each update is added to a queue and handled by the next free worker, which runs
+SCRIPT with the updated object. Updates to the same object are always handled
+one at a time and in order, while updates to different objects may be handled
+at the same time by up to --workers workers. Objects are identified by their
+namespace and name, or by their uid when '--key uid' is given. By default there
+is a single worker so SCRIPT is never run more than once at a time.
+
+While an update is waiting in the queue, newer updates to the same object
+replace it rather than being queued on their own, so SCRIPT only sees the most
+recent state of each object. With --debounce, updates are held back until the
+object has not changed for the given number of seconds, and may be replaced
+during that time as well. SCRIPT can find the number of updates which were
+combined into the one it received in \$CONTROLLER_EVENT_COUNT.
+
+With --persistent each worker starts SCRIPT once and keeps it running, rather
+than running it for every update with the object as its argument. SCRIPT reads
+one update per line from stdin as '{"type":<type>,"count":<count>,"object":<object>}'
+and prints a line to stdout once it has handled it, after which it is sent the
+next one. If SCRIPT exits without acknowledging an update it is started again
+for the next one. This avoids starting SCRIPT for every update, and supports
+objects too large to be passed as an argument.
+
+To keep memory and processes bounded during event storms the queue holds at
+most --queue-size events. When it is full the controller either stops reading
+new events until a worker frees up a slot (block), or drops the oldest queued
+event (drop-oldest).
+
+The objects are listed once when the controller starts, after which they are
+watched from the resourceVersion of the list. If the watch is closed it is
+resumed from the last resourceVersion seen, including those sent as watch
+bookmarks, so objects are only listed again when the API server reports that
+resourceVersion as expired (410 Gone) or newer than its own (Too large resource
+version). Any other error ends the watch and is retried with the same backoff
+as a failed request. With --resource-version-file the last
+resourceVersion is also kept in the given file, which allows a restarted
+controller to resume where it left off rather than listing every object again.
+Events which were still queued when the controller stopped are not replayed.
+When --filename is given the controller falls back to 'kubectl get --watch',
+which can not be resumed. The --raw flag sets the API path which is watched
+rather than resolving it from KIND.
+
+Events can be dropped before they reach the queue, so SCRIPT is not run for
+updates it would ignore anyway. --event-types takes a comma separated list of
+the event types to handle (ADDED, MODIFIED and DELETED). --filter takes a jq
+expression which is given each object, and the event type in \$type, and only
+the events for which it is true are handled. With --changed, a jq expression
+whose value is compared against the last handled event for the same object,
+events which did not change it are dropped. For example, to ignore updates to
+the status of deployments:
+	$(basename $0) --changed .metadata.generation ./rollout.bash deployment
+
+With --resync every object is handled again on a schedule even if it did not
+change, as an update of type RESYNC. Each object is resynced at a random time
+between half and one and a half times the --resync interval after it was last
+handled, so objects seen at the same time are not all resynced at once. At
+most --resync-rate objects are resynced per second, and objects which still
+have an update waiting in the queue are not resynced at all.
+
+When SCRIPT fails to handle an update it is retried up to --retries times,
+waiting --retry-backoff seconds before the first retry and twice as long
+before each following one, up to 5 minutes. Newer updates to the object wait
+in its place, and are tried right away. Updates still waiting to be retried
+when the controller stops are dropped.
+
+With --cache the controller keeps a copy of every object it has seen in the
+directory in \$CONTROLLER_CACHE_DIR, as '<namespace>/<name>.json' or as
+'<name>.json' for objects without a namespace, so SCRIPT can look up objects
+without asking the API server. Objects are stored before SCRIPT is run for
+them, including those dropped by --filter, --changed or --event-types, and are
+removed when they are deleted. For example, to read every cached object in the
+'default' namespace:
+	jq --slurp . \$CONTROLLER_CACHE_DIR/default/*.json
+
+With --metrics-file the controller writes metrics in the Prometheus text format
+to the given file every --metrics-interval seconds, and --metrics-port serves
+them at 'http://127.0.0.1:<port>/metrics'. The metrics include the events
+received by type, the events which were filtered or dropped, the queue depth,
+histograms of how long SCRIPT took and of how long after being queued each
+event was handled, the number of times SCRIPT failed and the seconds since the
+last event. With --trace-log a line is appended to the given file for every
+update SCRIPT handled, with the times the update was queued, started and ended.
+
+Sending SIGTERM to the controller stops the watch, waits for the queued events
+to be handled and exits.
 
 For more information on the flags specifiec above see 'kubectl get --help'.
 
@@ -109,11 +444,977 @@ elif [ -z "$kind" ]; then
 	exit 1
 fi
 
-lock_file=.lock-$BASHPID
+case "$key" in
+	name )
+		key_filter='"\(.metadata.namespace // "")/\(.metadata.name)"'
+		;;
+
+	uid )
+		key_filter='.metadata.uid'
+		;;
+esac
+
+# event_filter turns list responses and watch events into lines of
+# '<type>\t<selected>\t<resourceVersion>\t<key>\t<path>\t<changed>\t<object>', where <selected> is whether the object
+# matches --filter, <path> is '<namespace>/<name>' or '<name>' and <changed> is the JSON of the --changed values. The
+# object is left out of events which were not selected unless it is cached. The end of a list becomes
+# 'LISTED\t<resourceVersion>', bookmarks 'BOOKMARK\t<resourceVersion>' and errors 'ERROR\t<code>\t<message>'. Since
+# list items have no kind or apiVersion of their own they are taken from the list.
+event_filter='def key: '"$key_filter"';
+def selected($type): '"${select_filter:-true}"';
+def changed: ['"$changed_filter"'] | if length > 0 then tojson else "" end;
+def path: if .metadata.namespace then "\(.metadata.namespace)/\(.metadata.name)" else .metadata.name end;
+def line($type):
+	any(try selected($type) catch false; .) as $selected
+	| "\($type)\t\($selected)\t\(.metadata.resourceVersion)\t\(key)\t\(path)\t\(changed)\t\(if $selected or '"$cache"' then tojson else "" end)";
+
+if has("items") then
+	(.kind | rtrimstr("List")) as $kind | .apiVersion as $version
+	| (.items[] | .kind = $kind | .apiVersion = $version | line("ADDED")), "LISTED\t\(.metadata.resourceVersion)"
+elif .type == "BOOKMARK" then
+	"BOOKMARK\t\(.object.metadata.resourceVersion)"
+elif .type == "ERROR" then
+	"ERROR\t\(.object.code)\t\(.object.message)"
+else
+	.type as $type | .object | line($type)
+end'
+
+# Each queued event is stored in 'events/' and only becomes visible to workers once its marker is created in 'queue/',
+# so a worker never reads a partially written event. An event file holds the number of events combined into it, the time
+# the first of them was queued, the type of the last of them, their key, the number of times the callback failed to
+# handle them and the time before which they should not be retried, followed by the object. Event names are
+# '<seq>_<key>' so listing the queue gives the events in the order they were received. An event is owned by whoever
+# manages to create its file in 'claimed/', and an object key by whoever creates its file in 'active/', both of which
+# noclobber makes atomic without having to fork.
+state_dir="$(mktemp --directory)"
+mkdir "$state_dir/events" "$state_dir/queue" "$state_dir/claimed" "$state_dir/active" "$state_dir/callbacks"
+mkfifo "$state_dir/wakeups"
+
+trap "rm --recursive --force $state_dir" EXIT
+
+set -o noclobber
+shopt -s nullglob
+
+# claim_event attempts to take ownership of the queued event ($1), failing if someone else already owns it.
+claim_event() {
+	local claimed="$state_dir/claimed/${1##*/}"
+
+	if [ ! -e "$1" ] || [ -e "$claimed" ] || ! : 2> /dev/null > "$claimed"; then
+		return 1
+	fi
+
+	# the event may have been handled and released since the queue was listed
+	if [ ! -e "$1" ]; then
+		rm --force "$claimed"
+		return 1
+	fi
+}
+
+# release_event removes the claimed event ($1) from the queue, and releases its key when $2 is 'true'. The claim is
+# removed after the event so it can not be claimed again while it is being removed, and the key is released last so
+# another worker can not start on the object before the event is gone.
+release_event() {
+	local event_name="${1##*/}"
+	local -a files=("$state_dir/queue/$event_name" "$state_dir/events/$event_name" "$state_dir/claimed/$event_name")
+
+	if [ "$2" == true ]; then
+		files+=("$state_dir/active/${event_name#*_}")
+	fi
+
+	rm --force "${files[@]}"
+}
+
+# queue_depth prints the number of queued events which have not been claimed yet into the variable named $1.
+queue_depth() {
+	local -a queued=("$state_dir/queue/"*) claimed=("$state_dir/claimed/"*)
+
+	printf -v "$1" '%d' $((${#queued[@]} - ${#claimed[@]}))
+}
+
+# record sends a sample ($@) to the metrics exporter, if there is one. Samples are short enough to be written to the
+# 'metrics' fifo at once, so samples from different processes are never interleaved.
+record() {
+	if [ -n "$metrics_fd" ]; then
+		printf '%s\n' "$*" >&$metrics_fd
+	fi
+}
+
+# The upper bounds of the histogram buckets, in seconds.
+histogram_buckets=(0.005 0.01 0.025 0.05 0.1 0.25 0.5 1 2.5 5 10)
+
+# observe adds the microseconds ($2) to the histogram named $1.
+observe() {
+	local i
+
+	for i in "${!histogram_buckets[@]}"; do
+		if [ $2 -le ${bucket_usec[$i]} ]; then
+			buckets[$1,$i]=$((${buckets[$1,$i]:-0} + 1))
+		fi
+	done
+
+	sums[$1]=$((${sums[$1]:-0} + $2))
+	counts[$1]=$((${counts[$1]:-0} + 1))
+}
+
+# print_histogram prints the histogram named $1 as the metric $2, described by $3.
+print_histogram() {
+	local i sum
+
+	printf '# HELP %s %s\n# TYPE %s histogram\n' $2 "$3" $2
+
+	for i in "${!histogram_buckets[@]}"; do
+		printf '%s_bucket{le="%s"} %d\n' $2 ${histogram_buckets[$i]} ${buckets[$1,$i]:-0}
+	done
+
+	to_seconds sum ${sums[$1]:-0}
+	printf '%s_bucket{le="+Inf"} %d\n%s_sum %s\n%s_count %d\n' $2 ${counts[$1]:-0} $2 $sum $2 ${counts[$1]:-0}
+}
+
+# print_metrics prints the metrics aggregated by metrics_exporter in the Prometheus text format.
+print_metrics() {
+	local event_type depth since
+
+	printf '# HELP controller_events_received_total Watch events received, by type.\n'
+	printf '# TYPE controller_events_received_total counter\n'
+	for event_type in ADDED MODIFIED DELETED; do
+		printf 'controller_events_received_total{type="%s"} %d\n' $event_type ${received[$event_type]:-0}
+	done
+
+	printf '# HELP controller_events_filtered_total Watch events dropped by --filter, --changed or --event-types.\n'
+	printf '# TYPE controller_events_filtered_total counter\ncontroller_events_filtered_total %d\n' $filtered
+
+	printf '# HELP controller_events_dropped_total Queued events dropped because the queue was full.\n'
+	printf '# TYPE controller_events_dropped_total counter\ncontroller_events_dropped_total %d\n' $dropped
+
+	printf '# HELP controller_resyncs_total Objects queued to be resynced.\n'
+	printf '# TYPE controller_resyncs_total counter\ncontroller_resyncs_total %d\n' $resyncs
+
+	queue_depth depth
+	printf '# HELP controller_queue_depth Queued events waiting for a worker.\n'
+	printf '# TYPE controller_queue_depth gauge\ncontroller_queue_depth %d\n' $depth
+
+	print_histogram duration controller_callback_duration_seconds 'Time taken by the callback to handle an event.'
+	print_histogram latency controller_event_latency_seconds 'Time from an event being queued until the callback handled it.'
+
+	printf '# HELP controller_callback_failures_total Events the callback failed to handle.\n'
+	printf '# TYPE controller_callback_failures_total counter\ncontroller_callback_failures_total %d\n' $failures
+
+	printf '# HELP controller_callback_retries_total Failed events queued to be retried.\n'
+	printf '# TYPE controller_callback_retries_total counter\ncontroller_callback_retries_total %d\n' $retried
+
+	to_seconds since $((${EPOCHREALTIME/./} - last_event))
+	printf '# HELP controller_seconds_since_last_event Seconds since the last watch event, or since the controller started.\n'
+	printf '# TYPE controller_seconds_since_last_event gauge\ncontroller_seconds_since_last_event %s\n' $since
+}
+
+# write_metrics replaces --metrics-file, and the file served on --metrics-port, with the current metrics.
+write_metrics() {
+	local target
+
+	for target in ${metrics_file:+"$metrics_file"} ${metrics_port:+"$state_dir/http/metrics"}; do
+		print_metrics >| "$target.tmp"
+		mv --force "$target.tmp" "$target"
+	done
+}
+
+# metrics_exporter aggregates the samples sent with record and writes them out every --metrics-interval seconds, and
+# once more when every sender has closed the 'metrics' fifo.
+metrics_exporter() {
+	local -A received buckets sums counts
+	local -a bucket_usec sample
+	local metrics_in line="" part status now next_write interval_usec timeout i
+	local filtered=0 dropped=0 resyncs=0 failures=0 retried=0 last_event=${EPOCHREALTIME/./}
+
+	for i in "${!histogram_buckets[@]}"; do
+		to_usec "bucket_usec[$i]" ${histogram_buckets[$i]}
+	done
+
+	to_usec interval_usec "$metrics_interval"
+	next_write=$last_event
+
+	exec {metrics_in}< "$state_dir/metrics"
+
+	while true; do
+		now=${EPOCHREALTIME/./}
+
+		if [ $now -ge $next_write ]; then
+			write_metrics
+			next_write=$((now + interval_usec))
+		fi
+
+		to_seconds timeout $((next_write - now))
+		IFS= read -r -t $timeout -u $metrics_in part
+		status=$?
+
+		# on timeout any partially read line is kept so the rest of it can be read later
+		line+="$part"
+
+		if [ $status -gt 128 ]; then
+			continue
+		elif [ $status -ne 0 ] && [ -z "$line" ]; then
+			break
+		fi
+
+		sample=($line)
+		line=""
+
+		case "${sample[0]}" in
+			received )
+				received[${sample[1]}]=$((${received[${sample[1]}]:-0} + 1))
+				last_event=$now
+				;;
+
+			filtered )
+				filtered=$((filtered + 1))
+				;;
+
+			dropped )
+				dropped=$((dropped + 1))
+				;;
+
+			resync )
+				resyncs=$((resyncs + 1))
+				;;
+
+			retry )
+				retried=$((retried + 1))
+				;;
+
+			callback )
+				if [ ${sample[1]} -ne 0 ]; then
+					failures=$((failures + 1))
+				fi
+
+				observe duration ${sample[2]}
+				observe latency ${sample[3]}
+				;;
+		esac
+	done
+
+	write_metrics
+}
+
+# start_callback starts the persistent callback for the worker ($1), which reads events from $callback_in and
+# acknowledges them on $callback_out. The worker ignores SIGPIPE to notice a callback which exited, which the callback
+# should not inherit.
+start_callback() {
+	local fifo="$state_dir/callbacks/$1"
+
+	if [ ! -p "$fifo.in" ]; then
+		mkfifo "$fifo.in" "$fifo.out"
+	fi
+
+	(trap - PIPE; exec $callback) < "$fifo.in" > "$fifo.out" {wakeup_fd}<&- &
+	callback_pid=$!
+
+	# the fifos are opened in the same order as the callback opens them
+	exec {callback_in}> "$fifo.in" {callback_out}< "$fifo.out"
+}
+
+# stop_callback closes the persistent callback's stdin and waits for it to exit.
+stop_callback() {
+	exec {callback_in}>&- {callback_out}<&-
+	wait $callback_pid
+	callback_pid=""
+}
+
+# run_callback runs the callback for the object ($3) of the combination of $1 events, the last of which had the type
+# $2, failing if the callback failed. A persistent callback which exits before acknowledging the event is stopped, to be
+# started again for the next.
+run_callback() {
+	local ack
+
+	if ! $persistent; then
+		CONTROLLER_EVENT_COUNT=$1 CONTROLLER_EVENT_TYPE=$2 $callback "$3" < /dev/null
+		return
+	fi
+
+	if [ -z "$callback_pid" ]; then
+		start_callback $worker_id
+	fi
+
+	if ! printf '{"type":"%s","count":%d,"object":%s}\n' $2 $1 "$3" 2> /dev/null >&$callback_in \
+		|| ! IFS= read -r -u $callback_out ack; then
+		echo "callback exited before acknowledging an event, restarting it" >&2
+		stop_callback
+		return 1
+	fi
+}
+
+# handle_next_event runs the callback for the oldest queued event whose object is not already being handled by another
+# worker and which is not waiting to be retried, failing if there is no such event. Once an object is skipped all of its
+# newer events are skipped as well, so the events for each object are always handled in order. An event which failed is
+# left in the queue to be retried after a backoff, unless it ran out of --retries. The earliest time an event is waiting
+# to be retried at is kept in $next_retry.
+handle_next_event() {
+	local -A busy
+	local event event_name count enqueued event_type obj_key attempts not_before obj start end status backoff
+
+	for event in "$state_dir/queue/"*; do
+		event_name="${event##*/}"
+
+		if [ -n "${busy[${event_name#*_}]}" ]; then
+			continue
+		fi
+
+		if ! : 2> /dev/null > "$state_dir/active/${event_name#*_}"; then
+			busy[${event_name#*_}]=true
+			continue
+		fi
+
+		# the event may have been dropped while the object was being claimed
+		if ! claim_event "$event"; then
+			rm --force "$state_dir/active/${event_name#*_}"
+			continue
+		fi
+
+		{
+			read -r count enqueued event_type obj_key attempts not_before
+			IFS= read -r obj
+		} < "$state_dir/events/$event_name"
+
+		if [ $not_before -gt ${EPOCHREALTIME/./} ]; then
+			rm --force "$state_dir/claimed/$event_name" "$state_dir/active/${event_name#*_}"
+			busy[${event_name#*_}]=true
+
+			if [ -z "$next_retry" ] || [ $not_before -lt $next_retry ]; then
+				next_retry=$not_before
+			fi
+
+			continue
+		fi
+
+		start=$EPOCHREALTIME
+		run_callback $count $event_type "$obj"
+		status=$?
+		end=$EPOCHREALTIME
+
+		if [ $status -ne 0 ] && [ $attempts -lt $retries ]; then
+			backoff=$((retry_backoff_usec << attempts))
+			backoff=$((backoff < 300000000 ? backoff : 300000000))
+
+			printf '%d %d %s %s %d %d\n%s\n' $count $enqueued $event_type "$obj_key" $((attempts + 1)) \
+				$((${end/./} + backoff)) "$obj" >| "$state_dir/events/$event_name"
+			rm --force "$state_dir/claimed/$event_name" "$state_dir/active/${event_name#*_}"
+			record retry
+
+			if [ -z "$next_retry" ] || [ $((${end/./} + backoff)) -lt $next_retry ]; then
+				next_retry=$((${end/./} + backoff))
+			fi
+		else
+			release_event "$event" true
+		fi
+
+		record callback $status $((${end/./} - ${start/./})) $((${end/./} - enqueued))
+
+		if [ -n "$trace_fd" ]; then
+			to_seconds enqueued $enqueued
+			printf 'key=%s type=%s count=%d enqueued=%s start=%s end=%s status=%d\n' \
+				"$obj_key" $event_type $count $enqueued $start $end $status >&$trace_fd
+		fi
+
+		return 0
+	done
+
+	return 1
+}
+
+# worker runs the callback for queued events. Every queued event writes a single byte to the 'wakeups' fifo, and since
+# only whole bytes are ever read from it each byte wakes exactly one worker. After handling an event the worker looks
+# for another, since events for the same object are skipped by other workers until it is done. Once all writers have
+# closed the fifo and the remaining queue is handled the worker exits. Events waiting to be retried are not announced on
+# the fifo, so the worker also wakes up once the earliest of those it has seen is due. With --persistent each worker
+# ($1) keeps its own callback running, which is started along with the worker.
+worker() {
+	local worker_id="$1" wakeup_fd wakeup callback_pid="" callback_in callback_out next_retry="" timeout status now
+	local retry_backoff_usec
+
+	to_usec retry_backoff_usec "$retry_backoff"
+
+	exec {wakeup_fd}< "$state_dir/wakeups"
+
+	if $persistent; then
+		trap '' PIPE
+		start_callback $worker_id
+	fi
+
+	while true; do
+		timeout=""
+
+		# nothing may wake the worker when an event is due to be retried
+		if [ -n "$next_retry" ]; then
+			now=${EPOCHREALTIME/./}
+			to_seconds timeout $((next_retry > now ? next_retry - now : 1))
+		fi
+
+		read -r -N 1 ${timeout:+-t $timeout} -u $wakeup_fd wakeup
+		status=$?
+
+		if [ $status -ne 0 ] && [ $status -le 128 ]; then
+			break
+		fi
+
+		next_retry=""
+
+		while handle_next_event; do
+			:
+		done
+	done
+
+	if [ -n "$callback_pid" ]; then
+		stop_callback
+	fi
+}
+
+# enqueue adds the object ($3) with the key ($1) to the queue as the combination of $4 events, the last of which had the
+# type $2. If an older event for the same object is still waiting in the queue it is replaced instead, keeping its place
+# in the queue. When the queue is full it either waits for a worker to free up a slot, which in turn stops kubectl from
+# being read, or drops the oldest event which has not been claimed yet.
+enqueue() {
+	local obj_key="$1" event_type="$2" obj="$3" count="$4" event_name depth event queued_count enqueued queued_type
+	local queued_key attempts not_before
+
+	event_name="${queued[$obj_key]}"
+
+	if [ -n "$event_name" ] && claim_event "$state_dir/queue/$event_name"; then
+		read -r queued_count enqueued queued_type queued_key attempts not_before < "$state_dir/events/$event_name"
+
+		# an event waiting to be retried keeps its failures, but the newer object is tried right away
+		printf '%d %d %s %s %d 0\n%s\n' $((queued_count + count)) $enqueued $event_type "$obj_key" $attempts "$obj" \
+			>| "$state_dir/events/$event_name"
+		rm --force "$state_dir/claimed/$event_name"
+
+		# a worker may have skipped the event while it was being replaced
+		printf . >&$wakeup_fd
+
+		return
+	fi
+
+	queue_depth depth
+
+	while [ $depth -ge $queue_size ]; do
+		if [ "$queue_full" == block ]; then
+			sleep 0.05
+		else
+			for event in "$state_dir/queue/"*; do
+				if claim_event "$event"; then
+					echo "queue is full, dropping event ${event##*/}" >&2
+					release_event "$event"
+					record dropped
+					break
+				fi
+			done
+		fi
+
+		queue_depth depth
+	done
+
+	printf -v event_name '%012d_%s' $seq "${obj_key//\//_}"
+	printf '%d %d %s %s 0 0\n%s\n' $count ${EPOCHREALTIME/./} $event_type "$obj_key" "$obj" > "$state_dir/events/$event_name"
+	: > "$state_dir/queue/$event_name"
+	printf . >&$wakeup_fd
+
+	queued[$obj_key]="$event_name"
+	seq=$((seq + 1))
+}
+
+# flush_pending enqueues every held back event which is due, and stores the microseconds until the next one is due in
+# the variable named $1, or nothing if no more events are held back.
+flush_pending() {
+	local now=${EPOCHREALTIME/./} next="" obj_key
+
+	for obj_key in "${!pending_due[@]}"; do
+		if [ ${pending_due[$obj_key]} -le $now ]; then
+			enqueue "$obj_key" ${pending_type[$obj_key]} "${pending_obj[$obj_key]}" ${pending_count[$obj_key]}
+			unset "pending_due[$obj_key]" "pending_type[$obj_key]" "pending_obj[$obj_key]" "pending_count[$obj_key]"
+		elif [ -z "$next" ] || [ ${pending_due[$obj_key]} -lt $next ]; then
+			next=${pending_due[$obj_key]}
+		fi
+	done
+
+	if [ -n "$next" ]; then
+		printf -v "$1" '%d' $((next - now))
+	else
+		printf -v "$1" ''
+	fi
+}
+
+# Objects due to be resynced are kept in slots of 100ms, so finding those which are due does not mean looking at every
+# object.
+resync_slot_usec=100000
+
+# schedule_resync schedules the next resync of the object with the key ($1) between half and one and a half --resync
+# intervals from now.
+schedule_resync() {
+	local slot=$(((${EPOCHREALTIME/./} + resync_usec / 2 + RANDOM * resync_usec / 32768) / resync_slot_usec))
+
+	resync_due[$1]=$slot
+	resync_slots[$slot]+=" $1"
+}
+
+# resync_objects enqueues a resync of every object which is due, for as long as the token bucket allows, and stores the
+# microseconds until it should be called again in the variable named $1. The bucket holds up to a second's worth of
+# --resync-rate tokens, in millionths of a token.
+resync_objects() {
+	local now=${EPOCHREALTIME/./} obj_key wait=""
+	local -a remaining
+
+	tokens=$((tokens + (now - tokens_updated) * resync_rate))
+	tokens=$((tokens < resync_rate * 1000000 ? tokens : resync_rate * 1000000))
+	tokens_updated=$now
+
+	while [ -z "$wait" ] && [ $resync_slot -le $((now / resync_slot_usec)) ]; do
+		remaining=()
+
+		for obj_key in ${resync_slots[$resync_slot]}; do
+			# the object was deleted or rescheduled since
+			if [ "${resync_due[$obj_key]}" != $resync_slot ]; then
+				continue
+			fi
+
+			if [ -n "$wait" ] || [ $tokens -lt 1000000 ]; then
+				wait=$(((1000000 - tokens) / resync_rate + 1))
+				remaining+=("$obj_key")
+				continue
+			fi
+
+			tokens=$((tokens - 1000000))
+			schedule_resync "$obj_key"
+
+			# an object which is already queued will be handled soon enough
+			if [ -z "${queued[$obj_key]}" ] || [ ! -e "$state_dir/queue/${queued[$obj_key]}" ]; then
+				enqueue "$obj_key" RESYNC "${objects[$obj_key]}" 1
+				record resync
+			fi
+		done
+
+		if [ -n "$wait" ]; then
+			resync_slots[$resync_slot]="${remaining[*]}"
+		else
+			unset "resync_slots[$resync_slot]"
+			resync_slot=$((resync_slot + 1))
+		fi
+	done
+
+	printf -v "$1" '%d' ${wait:-$((resync_slot * resync_slot_usec - now))}
+}
+
+# dispatch reads events from stdin, as printed by watch_events, and adds them to the queue. With a debounce the events
+# are held back in memory until their object has not changed for the debounce window, during which newer events replace
+# the held back one. Any events which are still held back when stdin is closed are enqueued right away. With --resync
+# the last object seen for each key is kept to be resynced.
+dispatch() {
+	local -A queued pending_type pending_obj pending_count pending_due objects resync_due
+	local -a resync_slots
+	local line="" part status event_type obj_key obj timeout timeout_usec resync_timeout_usec seq=0 debounce_usec
+	local resync_usec resync_slot=$((${EPOCHREALTIME/./} / resync_slot_usec)) tokens=0 tokens_updated=${EPOCHREALTIME/./}
+
+	to_usec debounce_usec "$debounce"
+	to_usec resync_usec "$resync"
+
+	while true; do
+		flush_pending timeout_usec
+
+		if [ $resync_usec -gt 0 ]; then
+			resync_objects resync_timeout_usec
+
+			if [ -z "$timeout_usec" ] || [ $resync_timeout_usec -lt $timeout_usec ]; then
+				timeout_usec=$resync_timeout_usec
+			fi
+		fi
+
+		timeout=""
+		if [ -n "$timeout_usec" ]; then
+			to_seconds timeout $timeout_usec
+		fi
+
+		IFS= read -r ${timeout:+-t $timeout} part
+		status=$?
+
+		# on timeout any partially read line is kept so the rest of it can be read later
+		line+="$part"
+
+		if [ $status -gt 128 ]; then
+			continue
+		elif [ $status -ne 0 ] && [ -z "$line" ]; then
+			break
+		fi
+
+		event_type="${line%%$'\t'*}"
+		line="${line#*$'\t'}"
+		obj_key="${line%%$'\t'*}"
+		obj="${line#*$'\t'}"
+		line=""
+
+		if [ $resync_usec -gt 0 ] && [ $event_type == DELETED ]; then
+			unset "objects[$obj_key]" "resync_due[$obj_key]"
+		elif [ $resync_usec -gt 0 ]; then
+			objects[$obj_key]="$obj"
+			schedule_resync "$obj_key"
+		fi
+
+		if [ $debounce_usec -eq 0 ]; then
+			enqueue "$obj_key" $event_type "$obj" 1
+			continue
+		fi
+
+		pending_type[$obj_key]=$event_type
+		pending_obj[$obj_key]="$obj"
+		pending_count[$obj_key]=$((${pending_count[$obj_key]:-0} + 1))
+		pending_due[$obj_key]=$((${EPOCHREALTIME/./} + debounce_usec))
+	done
+
+	for obj_key in "${!pending_due[@]}"; do
+		enqueue "$obj_key" ${pending_type[$obj_key]} "${pending_obj[$obj_key]}" ${pending_count[$obj_key]}
+	done
+}
+
+# resolve_path stores the API path of the objects to watch in $path, and the query parameters shared by every request
+# in $query, looking up the resource for $kind with 'kubectl api-resources'.
+resolve_path() {
+	local resource version namespaced field_selectors="$field_selector"
+
+	if [ -n "$raw_path" ]; then
+		path="${raw_path%%\?*}"
+
+		if [[ "$raw_path" == *\?* ]]; then
+			query="${raw_path#*\?}&"
+		fi
+
+		return
+	fi
+
+	# the columns are found from the header since SHORTNAMES may be empty
+	read -r resource version namespaced < <(kubectl api-resources | awk -v kind="${kind,,}" '
+		function trim(s) {
+			gsub(/^ +| +$/, "", s)
+			return s
+		}
+
+		NR == 1 {
+			shortnames = index($0, "SHORTNAMES")
+			apiversion = index($0, "APIVERSION")
+			namespaced = index($0, "NAMESPACED")
+			kindcol = index($0, "KIND")
+			next
+		}
+
+		{
+			name = trim(substr($0, 1, shortnames - 1))
+			version = trim(substr($0, apiversion, namespaced - apiversion))
+			group = version ~ /\// ? substr(version, 1, index(version, "/") - 1) : ""
+			names = name "," tolower(trim(substr($0, kindcol))) "," trim(substr($0, shortnames, apiversion - shortnames))
+
+			count = split(names, candidates, ",")
+			for (i = 1; i <= count; i++) {
+				if (candidates[i] != "" && (kind == candidates[i] || kind == candidates[i] "." group)) {
+					print name, version, trim(substr($0, namespaced, kindcol - namespaced))
+					exit
+				}
+			}
+		}')
+
+	if [ -z "$resource" ]; then
+		echo "could not find a resource for kind '$kind'" >&2
+		return 1
+	fi
+
+	if [[ "$version" == */* ]]; then
+		path="/apis/$version"
+	else
+		path="/api/$version"
+	fi
+
+	if [ "$namespaced" == true ] && ! $all_namespaces; then
+		if [ -z "$namespace" ]; then
+			namespace="$(kubectl config view --minify --output 'jsonpath={..namespace}')"
+		fi
+
+		path+="/namespaces/${namespace:-default}"
+	fi
+
+	path+="/$resource"
+
+	if [ -n "$name" ]; then
+		field_selectors+="${field_selectors:+,}metadata.name=$name"
+	fi
+
+	query="$(jq --null-input --raw-output --arg field "$field_selectors" --arg labels "$selector" '
+		[if $field != "" then "fieldSelector=\($field | @uri)&" else empty end,
+		 if $labels != "" then "labelSelector=\($labels | @uri)&" else empty end] | join("")')"
+}
+
+# update_cache stores the object ($3) of an event of type $1 in the cache at the path ($2), or removes it if it was
+# deleted. Objects are written to a temporary file first so callbacks never read a partially written object.
+update_cache() {
+	local file="$CONTROLLER_CACHE_DIR/$2.json"
+
+	if [ $1 == DELETED ]; then
+		rm --force "$file"
+		unset "cached[$2]"
+		return
+	fi
+
+	if [[ "$2" == */* ]] && [ -z "${cached_namespaces[${2%/*}]}" ]; then
+		mkdir --parents "$CONTROLLER_CACHE_DIR/${2%/*}"
+		cached_namespaces[${2%/*}]=true
+	fi
+
+	printf '%s\n' "$3" >| "$CONTROLLER_CACHE_DIR/.tmp"
+	mv --force "$CONTROLLER_CACHE_DIR/.tmp" "$file"
+	cached[$2]=true
+}
+
+# prune_cache removes the cached objects which are still in $stale once the objects were listed again, since they were
+# deleted while they were not being watched.
+prune_cache() {
+	local path
+	local -a files=()
+
+	for path in "${!stale[@]}"; do
+		files+=("$CONTROLLER_CACHE_DIR/$path.json")
+		unset "cached[$path]"
+	done
+
+	if [ ${#files[@]} -gt 0 ]; then
+		rm --force "${files[@]}"
+	fi
+
+	stale=()
+}
+
+# print_events reads the lines from event_filter on the fd ($1) and prints the object events as
+# '<type>\t<key>\t<object>' for dispatch, dropping those not selected by --filter, not in --event-types or which did
+# not change the --changed values since the last event for their object, which are kept in $last_changed. With --cache
+# every object is cached first, and those in $stale which were not listed again are removed once the list ends, before
+# any of the listed objects are printed. The last resourceVersion seen is kept in $rv, and in $rv_file if it was given.
+# If the API server reports the resourceVersion as expired $gone is set to true, and any other error it reports is kept
+# in $watch_error.
+print_events() {
+	local line event_type selected obj_key path changed obj
+	local -a listed=()
+
+	while IFS= read -r -u $1 line; do
+		event_type="${line%%$'\t'*}"
+		line="${line#*$'\t'}"
+
+		case "$event_type" in
+			ERROR )
+				if [ "${line%%$'\t'*}" == 410 ]; then
+					gone=true
+				else
+					watch_error="${line#*$'\t'}"
+				fi
+
+				continue
+				;;
+
+			BOOKMARK )
+				rv="$line"
+				;;
+
+			LISTED )
+				rv="$line"
+
+				if $cache; then
+					prune_cache
+
+					if [ ${#listed[@]} -gt 0 ]; then
+						printf '%s\n' "${listed[@]}"
+						listed=()
+					fi
+				fi
+				;;
+
+			* )
+				selected="${line%%$'\t'*}"
+				line="${line#*$'\t'}"
+				rv="${line%%$'\t'*}"
+				line="${line#*$'\t'}"
+				obj_key="${line%%$'\t'*}"
+				line="${line#*$'\t'}"
+				path="${line%%$'\t'*}"
+				line="${line#*$'\t'}"
+				changed="${line%%$'\t'*}"
+				obj="${line#*$'\t'}"
+
+				record received $event_type
+
+				if $cache; then
+					update_cache $event_type "$path" "$obj"
+					unset "stale[$path]"
+				fi
+
+				if [ $event_type == DELETED ] || ! $selected; then
+					# an object which matches the filter again is handled even if it did not change in the meantime
+					unset "last_changed[$obj_key]"
+				elif [ -n "$changed" ] && [ "${last_changed[$obj_key]}" == "$changed" ]; then
+					event_type=UNCHANGED
+				else
+					last_changed[$obj_key]="$changed"
+				fi
+
+				if ! $selected || [[ ",$event_types," != *",$event_type,"* ]]; then
+					record filtered
+				elif $cache && $relist; then
+					# the listed objects are handled once the cache holds the whole list
+					listed+=("$event_type"$'\t'"$obj_key"$'\t'"$obj")
+				else
+					printf '%s\t%s\t%s\n' $event_type "$obj_key" "$obj"
+				fi
+				;;
+		esac
+
+		if [ -n "$rv_file" ]; then
+			printf '%s\n' "$rv" >| "$rv_file"
+		fi
+	done
+}
+
+# watch_events lists and then watches the objects, printing their events for dispatch until it is killed. Closed
+# watches are resumed from the last resourceVersion seen, and the objects are only listed again when that
+# resourceVersion has expired. Failed requests, including watches ended by an error event, are retried with an
+# exponential backoff.
+watch_events() {
+	local -A last_changed cached cached_namespaces stale
+	local rv="" relist=true gone watch_error failures=0 url request_fd request status cached_path
+
+	if [ -n "$rv_file" ] && [ -s "$rv_file" ]; then
+		read -r rv < "$rv_file"
+		relist=false
+	fi
+
+	while true; do
+		if $relist; then
+			url="$path?$query"
+
+			# whatever is cached but not listed again was deleted since it was cached
+			stale=()
+			for cached_path in "${!cached[@]}"; do
+				stale[$cached_path]=true
+			done
+		else
+			# the API server closes the watch after timeoutSeconds, spread out so many controllers do not reconnect at once
+			url="$path?${query}watch=true&allowWatchBookmarks=true&resourceVersion=$rv&timeoutSeconds=$((300 + RANDOM % 300))"
+		fi
+
+		exec {request_fd}< <(
+			set -o pipefail
+			kubectl get --raw "$url" 2>| "$state_dir/request.err" | jq --unbuffered --raw-output "$event_filter"
+		)
+		request=$!
+		gone=false
+		watch_error=""
+
+		print_events $request_fd
+
+		exec {request_fd}<&-
+		wait $request
+		status=$?
+
+		if [ $status -ne 0 ] && grep --quiet --regexp '(Expired)' --regexp '(Gone)' "$state_dir/request.err"; then
+			gone=true
+		fi
+
+		if $gone; then
+			echo "resourceVersion $rv has expired, listing all objects" >&2
+			relist=true
+			failures=0
+		elif [ $status -ne 0 ] || [ -n "$watch_error" ]; then
+			cat "$state_dir/request.err" >&2
+
+			if [ -n "$watch_error" ]; then
+				echo "watch failed: $watch_error" >&2
+			fi
+
+			# like client-go, a resourceVersion newer than the API server has is not watched from again
+			if [[ "$watch_error" == "Too large resource version"* ]]; then
+				relist=true
+			fi
+
+			sleep $((failures < 5 ? 2 ** failures : 30))
+			failures=$((failures + 1))
+		else
+			relist=false
+			failures=0
+		fi
+	done
+}
+
+# watch_legacy watches the objects with 'kubectl get --watch', for when they can not be listed and watched by path.
+watch_legacy() {
+	local -A last_changed cached cached_namespaces stale
+	local rv relist=false gone watch_error request_fd
+
+	exec {request_fd}< <(kubectl get --watch --output-watch-events --output json $flags $kind $name | jq --unbuffered --raw-output "$event_filter")
+
+	print_events $request_fd
+}
+
+if [ -z "$filename" ] && ! resolve_path; then
+	exit 1
+fi
+
+if [ -n "$metrics_file" ] || [ -n "$metrics_port" ]; then
+	mkfifo "$state_dir/metrics"
+	metrics_exporter &
 
-trap "rm --force $lock_file" EXIT
+	if [ -n "$metrics_port" ]; then
+		mkdir "$state_dir/http"
+		python3 -m http.server --bind 127.0.0.1 --directory "$state_dir/http" "$metrics_port" > /dev/null 2>&1 &
+		metrics_server=$!
+	fi
 
-kubectl get --watch --output jsonpath='{@}{"\n"}' $flags $kind $name |
-while IFS= read -r obj; do
-	flock $lock_file $callback "$obj" &
+	# every process started from here on sends its samples through this fd, which is closed once they all exit
+	exec {metrics_fd}> "$state_dir/metrics"
+fi
+
+if [ -n "$trace_log" ]; then
+	exec {trace_fd}>> "$trace_log"
+fi
+
+if $cache; then
+	export CONTROLLER_CACHE_DIR="$state_dir/cache"
+	mkdir "$CONTROLLER_CACHE_DIR"
+fi
+
+for ((i = 0; i < workers; i++)); do
+	worker $i &
 done
+
+# opening the fifo blocks until the workers have opened it, and will not be inherited by them
+exec {wakeup_fd}> "$state_dir/wakeups"
+
+mkfifo "$state_dir/watch"
+
+# job control puts the watch in its own process group so it can be stopped along with its requests
+set -m
+
+if [ -n "$filename" ]; then
+	watch_legacy > "$state_dir/watch" &
+else
+	watch_events > "$state_dir/watch" &
+fi
+
+watcher=$!
+
+set +m
+
+# the watch is not in the foreground process group, so it has to be stopped here however the controller is stopped
+trap "kill -- -$watcher 2> /dev/null" TERM INT
+trap "kill -- -$watcher 2> /dev/null; rm --recursive --force $state_dir" EXIT
+
+dispatch < "$state_dir/watch"
+
+# once the last writer is closed the workers will finish the remaining queue and exit
+exec {wakeup_fd}>&-
+
+if [ -n "$metrics_fd" ]; then
+	exec {metrics_fd}>&-
+fi
+
+if [ -n "$metrics_server" ]; then
+	kill $metrics_server
+fi
+
+wait
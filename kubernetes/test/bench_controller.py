@@ -0,0 +1,146 @@
+'''bench_controller measures how quickly controller.bash dispatches events replayed by a local fake API server, without
+needing a cluster:
+
+	python kubernetes/test/bench_controller.py --events 10 1000 10000 --rate 0 -- --workers 4
+'''
+import os
+import sys
+import time
+import argparse
+import pathlib
+import tempfile
+import threading
+
+from fakes import CONTROLLER_TEST_NAMESPACE, FakeApiServer, config_map, start_fake_controller, stop_fake_controller, write_fake_kubectl
+
+
+def _count_processes(root: int) -> int:
+	'''_count_processes counts the process ($root) and all of its descendants.'''
+	children: dict[int, list[int]] = {}
+
+	for entry in os.listdir("/proc"):
+		if not entry.isdigit():
+			continue
+
+		try:
+			with open(f"/proc/{entry}/stat") as f:
+				# the command may contain spaces, but is always followed by the last ')'
+				fields = f.read().rsplit(")", 1)[1].split()
+		except OSError:
+			continue
+
+		children.setdefault(int(fields[1]), []).append(int(entry))
+
+	count = 0
+	pending = [root]
+
+	while pending:
+		pid = pending.pop()
+		count += 1
+		pending.extend(children.get(pid, []))
+
+	return count
+
+
+def _percentile(values: list[float], percent: float) -> float:
+	return sorted(values)[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def _read_traces(trace_log: pathlib.Path) -> list[dict[str, str]]:
+	if not trace_log.exists():
+		return []
+
+	return [dict(field.split("=", 1) for field in line.split(" ")) for line in trace_log.read_text().splitlines()]
+
+
+def bench(events: int, rate: float, persistent: bool, controller_args: list[str]) -> dict[str, float]:
+	with tempfile.TemporaryDirectory() as tmp:
+		tmp_path = pathlib.Path(tmp)
+		bin_dir = write_fake_kubectl(tmp_path)
+		trace_log = tmp_path / "trace.log"
+
+		callback = bin_dir / "bench_callback.bash"
+		if persistent:
+			callback.write_text("#!/bin/bash\nwhile read -r _; do echo; done\n")
+			controller_args = ["--persistent", *controller_args]
+		else:
+			callback.write_text("#!/bin/bash\n")
+		callback.chmod(0o700)
+
+		server = FakeApiServer()
+		proc = start_fake_controller(bin_dir, server, "--trace-log", str(trace_log), *controller_args, callback=callback.name)
+
+		peak_processes = 0
+		sampling = True
+
+		def sample():
+			nonlocal peak_processes
+
+			while sampling:
+				peak_processes = max(peak_processes, _count_processes(proc.pid))
+				time.sleep(.05)
+
+		sampler = threading.Thread(target=sample)
+		sampler.start()
+
+		try:
+			if not server.wait_for_watch(0):
+				raise Exception("controller never started watching")
+
+			sent: dict[str, float] = {}
+			start = time.time()
+
+			for i in range(events):
+				if rate > 0:
+					time.sleep(max(0, start + i / rate - time.time()))
+
+				name = f"cm-{i}"
+				sent[f"{CONTROLLER_TEST_NAMESPACE}/{name}"] = time.time()
+				server.apply(config_map(name), event_type="ADDED")
+
+			deadline = time.time() + max(60, events * .05)
+			while len(traces := _read_traces(trace_log)) < events:
+				if time.time() > deadline or proc.poll() is not None:
+					raise Exception(f"only {len(traces)} of {events} events were handled")
+
+				time.sleep(.05)
+
+			end = max(float(trace["end"]) for trace in traces)
+			latencies = [float(trace["start"]) - sent[trace["key"]] for trace in traces]
+		finally:
+			sampling = False
+			sampler.join()
+
+			stop_fake_controller(proc)
+			server.stop()
+
+	return {
+		"events/s": events / (end - start),
+		"p50 (ms)": _percentile(latencies, 50) * 1000,
+		"p90 (ms)": _percentile(latencies, 90) * 1000,
+		"p99 (ms)": _percentile(latencies, 99) * 1000,
+		"max (ms)": max(latencies) * 1000,
+		"peak processes": peak_processes,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark controller.bash against a local fake API server.")
+	parser.add_argument("--events", type=int, nargs="+", default=[10, 1000, 10000], help="the numbers of events to replay, benchmarked one after another")
+	parser.add_argument("--rate", type=float, default=0, help="the events sent per second, or 0 to send them as fast as possible")
+	parser.add_argument("--persistent", action="store_true", help="run the controller with a persistent callback")
+	parser.add_argument("controller_args", nargs=argparse.REMAINDER, help="extra arguments for the controller, after '--'")
+	args = parser.parse_args()
+
+	controller_args = args.controller_args[1:] if args.controller_args[:1] == ["--"] else args.controller_args
+
+	print(f"{'events':>8}", *[f"{column:>15}" for column in ["events/s", "p50 (ms)", "p90 (ms)", "p99 (ms)", "max (ms)", "peak processes"]])
+
+	for events in args.events:
+		result = bench(events, args.rate, args.persistent, controller_args)
+		print(f"{events:>8}", *[f"{value:>15.1f}" for value in result.values()])
+		sys.stdout.flush()
+
+
+if __name__ == "__main__":
+	main()
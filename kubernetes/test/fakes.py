@@ -0,0 +1,280 @@
+'''fakes holds a fake API server and kubectl for running controller.bash without a cluster, shared by the controller tests
+and benchmark.'''
+import os
+import sys
+import bisect
+import json
+import http.server
+import threading
+import time
+import urllib.parse
+import pathlib
+import subprocess
+import typing
+
+CONTROLLER_PATH: str = str(pathlib.Path(__file__).resolve().parent.parent / "controller.bash")
+
+CONTROLLER_TEST_NAMESPACE = "testing-namespace"
+
+
+class FakeApiServer:
+	'''FakeApiServer serves list and watch requests for config maps from an in memory log of events, so watches can be closed, resumed and expired at will.'''
+	def __init__(self):
+		self.events: list[tuple[int, str, dict]] = []
+		self.objects: dict[str, dict] = {}
+		self.resource_version = 0
+		self.oldest_resource_version = 0
+		self.watch_generation = 0
+		self.compaction = 0
+		self.requests: list[dict[str, list[str]]] = []
+		self.watch_times: list[float] = []
+		self.watch_errors: list[dict] = []
+		self.stopped = False
+		self.condition = threading.Condition()
+
+		server = self
+
+		class Handler(http.server.BaseHTTPRequestHandler):
+			def log_message(self, *args):
+				pass
+
+			def do_GET(self):
+				query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+
+				# the generation is taken along with the request so watches closed right after it was seen are still closed
+				with server.condition:
+					server.requests.append(query)
+					server.condition.notify_all()
+					generation = server.watch_generation
+					compaction = server.compaction
+
+					error = None
+					if "watch" in query:
+						server.watch_times.append(time.monotonic())
+						error = server.watch_errors.pop(0) if server.watch_errors else None
+
+				self.send_response(200)
+				self.send_header("Content-Type", "application/json")
+				self.end_headers()
+
+				if error is not None:
+					self.wfile.write(json.dumps({"type": "ERROR", "object": {"kind": "Status", **error}}).encode() + b"\n")
+				elif "watch" in query:
+					server._watch(self.wfile, int(query["resourceVersion"][0]), generation, compaction)
+				else:
+					server._list(self.wfile)
+
+		self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+		threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+	def _list(self, wfile: typing.BinaryIO):
+		with self.condition:
+			body = {
+				"apiVersion": "v1",
+				"kind": "ConfigMapList",
+				"metadata": {"resourceVersion": str(self.resource_version)},
+				"items": [{key: value for key, value in obj.items() if key not in ["apiVersion", "kind"]} for obj in self.objects.values()],
+			}
+
+		wfile.write(json.dumps(body).encode())
+
+	def _watch(self, wfile: typing.BinaryIO, resource_version: int, generation: int, compaction: int):
+		with self.condition:
+			if resource_version < self.oldest_resource_version:
+				wfile.write(json.dumps({"type": "ERROR", "object": {"kind": "Status", "code": 410, "message": "too old resource version"}}).encode() + b"\n")
+				return
+
+			# events are kept in order, so only those added since the last wakeup need to be sent
+			sent = bisect.bisect_right(self.events, resource_version, key=lambda event: event[0])
+
+			while True:
+				# a watch which was compacted is closed without sending anything more, so the compacted events are only seen by
+				# listing again
+				if compaction != self.compaction:
+					return
+
+				for _, event_type, obj in self.events[sent:]:
+					wfile.write(json.dumps({"type": event_type, "object": obj}).encode() + b"\n")
+
+				sent = len(self.events)
+				wfile.flush()
+
+				if self.stopped or generation != self.watch_generation:
+					return
+
+				self.condition.wait(timeout=.1)
+
+	def apply(self, obj: dict, event_type: str="MODIFIED"):
+		with self.condition:
+			self.resource_version += 1
+
+			obj = json.loads(json.dumps(obj))
+			obj["metadata"]["resourceVersion"] = str(self.resource_version)
+
+			if event_type == "DELETED":
+				self.objects.pop(obj["metadata"]["name"], None)
+			else:
+				self.objects[obj["metadata"]["name"]] = obj
+
+			self.events.append((self.resource_version, event_type, obj))
+			self.condition.notify_all()
+
+	def bookmark(self):
+		with self.condition:
+			self.resource_version += 1
+			self.events.append((self.resource_version, "BOOKMARK", {"kind": "ConfigMap", "apiVersion": "v1", "metadata": {"resourceVersion": str(self.resource_version)}}))
+			self.condition.notify_all()
+
+	def compact(self):
+		'''compact expires every event so far, so watches from an older resourceVersion are answered with 410 Gone, and closes every watch without sending it anything more.'''
+		with self.condition:
+			self.oldest_resource_version = self.resource_version
+			self.compaction += 1
+			self.condition.notify_all()
+
+	def close_watches(self):
+		with self.condition:
+			self.watch_generation += 1
+			self.condition.notify_all()
+
+	def apply_compacted(self, *changes: tuple[dict, str]):
+		'''apply_compacted applies each (object, event type) change, then compacts them away all at once, so the changes can only be seen by listing again.'''
+		with self.condition:
+			for obj, event_type in changes:
+				self.apply(obj, event_type=event_type)
+
+			self.compact()
+
+	def fail_watches(self, code: int, message: str, count: int=1):
+		'''fail_watches answers the next count watches with an ERROR event of the code and message and then closes them, the way the API server does for errors other than 410 Gone.'''
+		with self.condition:
+			self.watch_errors.extend({"code": code, "message": message} for _ in range(count))
+
+	def wait_for_watches(self, count: int, timeout: float=10) -> bool:
+		with self.condition:
+			return self.condition.wait_for(lambda: len(self.watch_times) >= count, timeout=timeout)
+
+	def lists(self) -> int:
+		with self.condition:
+			return len([query for query in self.requests if "watch" not in query])
+
+	def wait_for_watch(self, resource_version: int, timeout: float=10) -> bool:
+		'''wait_for_watch waits until a watch is started from the resourceVersion, meaning every earlier event was read.'''
+		def started() -> bool:
+			return any(query.get("resourceVersion") == [str(resource_version)] for query in self.requests if "watch" in query)
+
+		with self.condition:
+			return self.condition.wait_for(started, timeout=timeout)
+
+	def stop(self):
+		with self.condition:
+			self.stopped = True
+			self.condition.notify_all()
+
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+def write_fake_kubectl(tmp_path: pathlib.Path) -> pathlib.Path:
+	'''write_fake_kubectl creates a directory to be prepended to PATH, containing a kubectl which sends 'get --raw' requests to the FakeApiServer at $FAKE_API_SERVER and a callback which appends its argument to $CALLBACK_OUT after sleeping for $CALLBACK_SLEEP seconds, and when it started and stopped sleeping along with the object's name to $CALLBACK_OUT.times. The number of events combined into each callback is appended to $CALLBACK_OUT.count and their type to $CALLBACK_OUT.type, and the callback fails for objects with a 'fail' key. A persistent callback does the same for the events it reads from stdin, and appends its pid to $CALLBACK_OUT.pids when it starts.'''
+	bin_dir = tmp_path / "bin"
+	bin_dir.mkdir()
+
+	kubectl = bin_dir / "kubectl"
+	kubectl.write_text(f'''#!{sys.executable}
+import os
+import sys
+import urllib.error
+import urllib.request
+
+if sys.argv[1] == "api-resources":
+	print("NAME         SHORTNAMES   APIVERSION   NAMESPACED   KIND")
+	print("configmaps   cm           v1           true         ConfigMap")
+elif sys.argv[1:3] == ["get", "--raw"]:
+	try:
+		with urllib.request.urlopen(os.environ["FAKE_API_SERVER"] + sys.argv[3]) as response:
+			for line in response:
+				sys.stdout.buffer.write(line)
+				sys.stdout.flush()
+	except urllib.error.HTTPError as e:
+		print(f"Error from server ({{e.reason}}): {{e.read().decode()}}", file=sys.stderr)
+		sys.exit(1)
+''')
+	kubectl.chmod(0o700)
+
+	callback = bin_dir / "callback.bash"
+	callback.write_text('''#!/bin/bash
+start=$EPOCHREALTIME
+sleep "${CALLBACK_SLEEP:-0}"
+end=$EPOCHREALTIME
+echo "$start $end $(jq --raw-output .metadata.name <<< "$1")" >> "$CALLBACK_OUT.times"
+echo "$1" >> "$CALLBACK_OUT"
+echo "$CONTROLLER_EVENT_COUNT" >> "$CALLBACK_OUT.count"
+echo "$CONTROLLER_EVENT_TYPE" >> "$CALLBACK_OUT.type"
+
+if [[ "$1" == *'"fail":'* ]]; then
+	exit 1
+fi
+''')
+	callback.chmod(0o700)
+
+	# the persistent callback exits rather than acknowledging objects with a 'crash' key
+	persistent_callback = bin_dir / "persistent_callback.bash"
+	persistent_callback.write_text('''#!/bin/bash
+echo $$ >> "$CALLBACK_OUT.pids"
+while IFS= read -r event; do
+	if [ "$(jq '.object.data | has("crash")' <<< "$event")" == true ]; then
+		exit 1
+	fi
+
+	sleep "${CALLBACK_SLEEP:-0}"
+	jq --compact-output .object <<< "$event" >> "$CALLBACK_OUT"
+	jq .count <<< "$event" >> "$CALLBACK_OUT.count"
+	echo ok
+done
+''')
+	persistent_callback.chmod(0o700)
+
+	return bin_dir
+
+
+def config_map(name: str, **data: str) -> dict:
+	return {
+		"apiVersion": "v1",
+		"kind": "ConfigMap",
+		"metadata": {
+			"name": name,
+			"namespace": CONTROLLER_TEST_NAMESPACE,
+			"uid": f"uid-{name}",
+		},
+		"data": data,
+	}
+
+
+def start_fake_controller(bin_dir: pathlib.Path, server: FakeApiServer, *args: str, callback_sleep: float=0, callback: str="callback.bash") -> subprocess.Popen:
+	(bin_dir.parent / "callback_out").unlink(missing_ok=True)
+	(bin_dir.parent / "callback_out.count").unlink(missing_ok=True)
+	(bin_dir.parent / "callback_out.pids").unlink(missing_ok=True)
+	(bin_dir.parent / "callback_out.type").unlink(missing_ok=True)
+	(bin_dir.parent / "callback_out.times").unlink(missing_ok=True)
+
+	return subprocess.Popen(
+		args=[CONTROLLER_PATH, *args, str(bin_dir / callback), "configmap", "--namespace", CONTROLLER_TEST_NAMESPACE],
+		env={
+			"PATH": f"{bin_dir}:{os.environ['PATH']}",
+			"FAKE_API_SERVER": server.url,
+			"CALLBACK_OUT": str(bin_dir.parent / "callback_out"),
+			"CALLBACK_SLEEP": str(callback_sleep),
+		},
+		stdout=subprocess.PIPE,
+		stderr=subprocess.PIPE,
+	)
+
+
+def stop_fake_controller(proc: subprocess.Popen) -> tuple[int, bytes, bytes]:
+	'''stop_fake_controller asks the controller to stop, which waits for the queued events to be handled.'''
+	proc.terminate()
+	stdout, stderr = proc.communicate(timeout=30)
+
+	return proc.returncode, stdout, stderr
@@ -1,23 +1,26 @@
 import os
+import json
+import socket
+import urllib.request
 import pytest
 import pathlib
+import signal
 import subprocess
 from kubernetes import client, config
 import typing
 import time
 
+from fakes import CONTROLLER_PATH, CONTROLLER_TEST_NAMESPACE, FakeApiServer, config_map, start_fake_controller, stop_fake_controller, write_fake_kubectl
+
 _CONTROLLER_K3S_IMAGE: str = "rancher/k3s:v1.36.1-k3s1"
 _CONTROLLER_K3D_CLUSTER_CREATE_TIMEOUT: int = 60
 
-_CONTROLLER_PATH: str = os.path.abspath("kubernetes/controller.bash")
-
-_CONTROLLER_TEST_NAMESPACE="testing-namespace"
 _CONTROLLER_TEST_VISITED_ANNOTATION = "mytools/visited"
 
 
 def _is_config_map_visited(config_map: client.V1ConfigMap=None, v1: client.CoreV1Api=None, name: str="") -> bool:
 	if config_map == None and v1 != None and name != "":
-		config_map: client.V1ConfigMap = v1.read_namespaced_config_map(namespace=_CONTROLLER_TEST_NAMESPACE, name=name)
+		config_map: client.V1ConfigMap = v1.read_namespaced_config_map(namespace=CONTROLLER_TEST_NAMESPACE, name=name)
 	elif config_map != None and name != "":
 		raise Exception("name and config_map are mutually exclusive")
 	elif name != "" and v1 == None:
@@ -76,7 +79,7 @@ def _k8s_client(_kubeconfig: pathlib.Path) -> client.ApiClient:
 		"apiVersion": "v1",
 		"kind": "Namespace",
 		"metadata": {
-			"name": _CONTROLLER_TEST_NAMESPACE,
+			"name": CONTROLLER_TEST_NAMESPACE,
 		}
 	})
 	
@@ -106,6 +109,613 @@ def _handler(tmpdir_factory: pytest.TempPathFactory) -> pathlib.Path:
 	return script
 
 
+@pytest.fixture
+def _fake_api_server() -> typing.Iterator[FakeApiServer]:
+	server = FakeApiServer()
+
+	yield server
+
+	server.stop()
+
+
+@pytest.fixture
+def _fake_kubectl(tmp_path: pathlib.Path) -> pathlib.Path:
+	return write_fake_kubectl(tmp_path)
+
+
+def _find_fake_processes(server: FakeApiServer) -> list[int]:
+	'''_find_fake_processes finds every process started for the controller talking to the FakeApiServer, by the FAKE_API_SERVER they were started with.'''
+	pids = []
+
+	for entry in os.listdir("/proc"):
+		try:
+			with open(f"/proc/{entry}/environ", "rb") as f:
+				if f"FAKE_API_SERVER={server.url}".encode() in f.read().split(b"\0"):
+					pids.append(int(entry))
+		except (OSError, ValueError):
+			continue
+
+	return pids
+
+
+def _read_handled(bin_dir: pathlib.Path) -> list[dict]:
+	callback_out = bin_dir.parent / "callback_out"
+
+	if not callback_out.exists():
+		return []
+
+	handled = [json.loads(line) for line in callback_out.read_text().splitlines()]
+
+	# the resourceVersion is set by the server, so it is dropped to compare against the objects which were sent
+	for obj in handled:
+		obj["metadata"].pop("resourceVersion", None)
+
+	return handled
+
+
+def _run_fake_controller(bin_dir: pathlib.Path, server: FakeApiServer, events: list[dict], *args: str, callback_sleep: float=0, callback: str="callback.bash") -> tuple[subprocess.CompletedProcess, list[dict]]:
+	proc = start_fake_controller(bin_dir, server, *args, callback_sleep=callback_sleep, callback=callback)
+
+	if not server.wait_for_watch(0, timeout=10):
+		proc.kill()
+		stdout, stderr = proc.communicate()
+
+		return subprocess.CompletedProcess(proc.args, proc.returncode, stdout, stderr), []
+
+	for event in events:
+		server.apply(event)
+
+	# once the controller resumes from the last event it has read them all
+	server.close_watches()
+	assert server.wait_for_watch(server.resource_version)
+
+	returncode, stdout, stderr = stop_fake_controller(proc)
+
+	return subprocess.CompletedProcess(proc.args, returncode, stdout, stderr), _read_handled(bin_dir)
+
+
+def _read_counts(bin_dir: pathlib.Path) -> list[int]:
+	return [int(line) for line in (bin_dir.parent / "callback_out.count").read_text().splitlines()]
+
+
+def _read_types(bin_dir: pathlib.Path) -> list[str]:
+	return (bin_dir.parent / "callback_out.type").read_text().splitlines()
+
+
+def _read_pids(bin_dir: pathlib.Path) -> list[int]:
+	return [int(line) for line in (bin_dir.parent / "callback_out.pids").read_text().splitlines()]
+
+
+def _read_times(bin_dir: pathlib.Path) -> list[tuple[float, float, str]]:
+	return [(float(start), float(end), name) for start, end, name in (line.split() for line in (bin_dir.parent / "callback_out.times").read_text().splitlines())]
+
+
+def _max_overlap(times: list[tuple[float, float, str]]) -> int:
+	'''_max_overlap counts the most callbacks which were running at once.'''
+	# ends sort before starts at the same time, so callbacks which only touch are not counted as overlapping
+	changes = sorted([(start, 1) for start, _, _ in times] + [(end, -1) for _, end, _ in times])
+	running = peak = 0
+
+	for _, change in changes:
+		running += change
+		peak = max(peak, running)
+
+	return peak
+
+
+class TestControllerQueue:
+	def test_workers(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		events = [config_map(f"cm-{i}") for i in range(20)]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--workers", "5", callback_sleep=.2)
+
+		assert proc.returncode == 0
+		assert sorted(handled, key=json.dumps) == sorted(events, key=json.dumps)
+		assert 1 < _max_overlap(_read_times(_fake_kubectl)) <= 5
+
+	def test_queue_full_block(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		events = [config_map(f"cm-{i}") for i in range(10)]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--queue-size", "2", callback_sleep=.05)
+
+		assert proc.returncode == 0
+		assert handled == events
+
+	def test_queue_full_drop_oldest(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		events = [config_map(f"cm-{i}") for i in range(10)]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--queue-size", "2", "--queue-full", "drop-oldest", callback_sleep=.2)
+
+		assert proc.returncode == 0
+		assert b"queue is full, dropping event" in proc.stderr
+		assert len(handled) < len(events)
+		assert handled[-2:] == events[-2:]
+
+	def test_same_object_in_order(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		events = [config_map(f"cm-{i % 2}", version=str(i)) for i in range(8)]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--workers", "4", callback_sleep=.2)
+
+		assert proc.returncode == 0
+		assert sum(_read_counts(_fake_kubectl)) == len(events)
+
+		for name in ["cm-0", "cm-1"]:
+			versions = [int(event["data"]["version"]) for event in handled if event["metadata"]["name"] == name]
+			assert versions == sorted(versions)
+			assert versions[-1] in [6, 7]
+
+		# each object is handled serially, but both objects are handled at once
+		times = _read_times(_fake_kubectl)
+		assert _max_overlap(times) == 2
+
+		for name in ["cm-0", "cm-1"]:
+			assert _max_overlap([entry for entry in times if entry[2] == name]) == 1
+
+	def test_same_object_by_uid(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		# a deleted and recreated object keeps its name but not its uid
+		events = [config_map("cm", version=str(i)) for i in range(4)]
+		for i, event in enumerate(events):
+			event["metadata"]["uid"] = f"uid-{i % 2}"
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--workers", "2", "--key", "uid", callback_sleep=.1)
+
+		assert proc.returncode == 0
+		assert sum(_read_counts(_fake_kubectl)) == len(events)
+
+		for uid in ["uid-0", "uid-1"]:
+			versions = [int(event["data"]["version"]) for event in handled if event["metadata"]["uid"] == uid]
+			assert versions == sorted(versions)
+			assert versions[-1] in [2, 3]
+
+	def test_coalesce(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		events = [config_map("cm", version=str(i)) for i in range(10)]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, callback_sleep=.2)
+
+		assert proc.returncode == 0
+		assert len(handled) < len(events)
+		assert handled[-1] == events[-1]
+		assert sum(_read_counts(_fake_kubectl)) == len(events)
+
+	def test_debounce(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		events = [config_map(f"cm-{i % 2}", version=str(i)) for i in range(10)]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--debounce", "0.5")
+
+		assert proc.returncode == 0
+		assert sorted(handled, key=json.dumps) == sorted(events[-2:], key=json.dumps)
+		assert _read_counts(_fake_kubectl) == [5, 5]
+
+	def test_bad_debounce(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--debounce", "-1")
+		stdout, _ = proc.communicate(timeout=10)
+
+		assert proc.returncode != 0
+		assert stdout == b"'--debounce' expected a number of seconds but found '-1'\n"
+
+	def test_bad_workers(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--workers", "0")
+		stdout, _ = proc.communicate(timeout=10)
+
+		assert proc.returncode != 0
+		assert stdout == b"'--workers' expected a positive number but found '0'\n"
+		assert _fake_api_server.requests == []
+
+	def test_bad_queue_full(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--queue-full", "drop-newest")
+		stdout, _ = proc.communicate(timeout=10)
+
+		assert proc.returncode != 0
+		assert stdout == b"'--queue-full' expected 'block' or 'drop-oldest' but found 'drop-newest'\n"
+
+
+class TestControllerWatch:
+	def test_resume_without_relist(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		_fake_api_server.apply(config_map("cm-0"), event_type="ADDED")
+
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server)
+		assert _fake_api_server.wait_for_watch(1)
+
+		_fake_api_server.close_watches()
+		_fake_api_server.apply(config_map("cm-1"), event_type="ADDED")
+		assert _fake_api_server.wait_for_watch(2)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+		assert _fake_api_server.lists() == 1
+		assert _read_handled(_fake_kubectl) == [config_map("cm-0"), config_map("cm-1")]
+
+	def test_relist_when_gone(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server)
+		assert _fake_api_server.wait_for_watch(0)
+
+		# the event is compacted away before the watch is resumed, so it is only seen by listing again
+		_fake_api_server.apply_compacted((config_map("cm"), "ADDED"))
+		assert _fake_api_server.wait_for_watch(1)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+		assert _fake_api_server.lists() == 2
+		assert _read_handled(_fake_kubectl) == [config_map("cm")]
+
+	def test_backoff_on_watch_error(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		_fake_api_server.fail_watches(500, "internal error", count=2)
+
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server)
+		assert _fake_api_server.wait_for_watches(3)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		# kubectl succeeds even though the watch failed, which must still be retried after 1 and then 2 seconds
+		first, second, third = _fake_api_server.watch_times[:3]
+		assert returncode == 0, stderr
+		assert second - first >= 1
+		assert third - second >= 2
+		assert _fake_api_server.lists() == 1
+		assert stderr.decode().count("watch failed: internal error") == 2
+
+	def test_relist_when_too_large(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		_fake_api_server.fail_watches(504, "Too large resource version: 5, current: 0")
+
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server)
+		assert _fake_api_server.wait_for_watches(2)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+		assert _fake_api_server.lists() == 2
+
+	@pytest.mark.parametrize("sig", [signal.SIGINT, signal.SIGTERM])
+	def test_stop_stops_watch(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer, sig: signal.Signals):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server)
+		assert _fake_api_server.wait_for_watch(0)
+
+		# the watch is in its own process group, so it does not see a ctrl-c sent to the controller's
+		proc.send_signal(sig)
+		proc.communicate(timeout=30)
+
+		assert _wait_until(lambda: _find_fake_processes(_fake_api_server) == [], timeout=5, interval=.1)
+
+	def test_resume_from_bookmark(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer, tmp_path: pathlib.Path):
+		rv_file = tmp_path / "resource-version"
+
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--resource-version-file", str(rv_file))
+		assert _fake_api_server.wait_for_watch(0)
+
+		_fake_api_server.bookmark()
+		_fake_api_server.close_watches()
+		assert _fake_api_server.wait_for_watch(1)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+		assert rv_file.read_text() == "1\n"
+		assert _read_handled(_fake_kubectl) == []
+
+	def test_resource_version_file(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer, tmp_path: pathlib.Path):
+		rv_file = tmp_path / "resource-version"
+
+		_fake_api_server.apply(config_map("cm-0"), event_type="ADDED")
+		_fake_api_server.apply(config_map("cm-1"), event_type="ADDED")
+		rv_file.write_text("1\n")
+
+		# a restarted controller only sees the events after the resourceVersion it stopped at
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--resource-version-file", str(rv_file))
+		assert _fake_api_server.wait_for_watch(1)
+
+		_fake_api_server.close_watches()
+		assert _fake_api_server.wait_for_watch(2)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+		assert _fake_api_server.lists() == 0
+		assert rv_file.read_text() == "2\n"
+		assert _read_handled(_fake_kubectl) == [config_map("cm-1")]
+
+
+class TestControllerFilter:
+	def test_event_types(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--event-types", "ADDED,DELETED")
+		assert _fake_api_server.wait_for_watch(0)
+
+		for i, event_type in enumerate(["ADDED", "MODIFIED", "DELETED"]):
+			_fake_api_server.apply(config_map("cm", version=str(i)), event_type=event_type)
+			_fake_api_server.close_watches()
+			assert _fake_api_server.wait_for_watch(i + 1)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+		assert _read_handled(_fake_kubectl) == [config_map("cm", version="0"), config_map("cm", version="2")]
+
+	def test_filter(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		events = [config_map(f"cm-{i}", enabled=str(i % 2 == 0).lower()) for i in range(4)]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--filter", '.data.enabled == "true" and $type == "MODIFIED"')
+
+		assert proc.returncode == 0
+		assert handled == events[::2]
+
+	def test_changed(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		events = [config_map("cm", version=str(i)) for i in range(4)]
+		for i, event in enumerate(events):
+			event["metadata"]["generation"] = i // 2
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--changed", ".metadata.generation")
+
+		assert proc.returncode == 0
+		assert sum(_read_counts(_fake_kubectl)) == 2
+		assert handled[-1] == events[2]
+
+	def test_changed_after_relist(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		_fake_api_server.apply(config_map("cm-0"), event_type="ADDED")
+
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--changed", ".data")
+		assert _fake_api_server.wait_for_watch(1)
+
+		# only the object which changed while the watch was down is handled when they are listed again
+		_fake_api_server.apply_compacted((config_map("cm-1"), "ADDED"))
+		assert _fake_api_server.wait_for_watch(2)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+		assert _fake_api_server.lists() == 2
+		assert _read_handled(_fake_kubectl) == [config_map("cm-0"), config_map("cm-1")]
+
+	def test_bad_filter(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--filter", ".data[")
+		stdout, _ = proc.communicate(timeout=10)
+
+		assert proc.returncode != 0
+		assert stdout == b"'--filter' expected a jq expression but found '.data['\n"
+
+	def test_bad_event_types(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--event-types", "ADDED,BOOKMARK")
+		stdout, _ = proc.communicate(timeout=10)
+
+		assert proc.returncode != 0
+		assert stdout == b"'--event-types' expected a list of ADDED, MODIFIED or DELETED but found 'ADDED,BOOKMARK'\n"
+
+
+class TestControllerPersistent:
+	def test_persistent(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		events = [config_map(f"cm-{i}") for i in range(10)]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--persistent", "--workers", "2", callback="persistent_callback.bash")
+
+		assert proc.returncode == 0
+		assert sorted(handled, key=json.dumps) == sorted(events, key=json.dumps)
+		assert sum(_read_counts(_fake_kubectl)) == len(events)
+		assert len(_read_pids(_fake_kubectl)) == 2
+
+	def test_persistent_large_object(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		# larger than the most a single argument may be
+		events = [config_map("cm", large="x" * 256 * 1024)]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--persistent", callback="persistent_callback.bash")
+
+		assert proc.returncode == 0
+		assert handled == events
+
+	def test_persistent_restart(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		events = [config_map("cm-0", crash="true"), config_map("cm-1")]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--persistent", callback="persistent_callback.bash", callback_sleep=.1)
+
+		assert proc.returncode == 0
+		assert b"callback exited before acknowledging an event, restarting it" in proc.stderr
+		assert handled == events[1:]
+		assert len(_read_pids(_fake_kubectl)) == 2
+
+
+def _read_metrics(text: str) -> dict[str, float]:
+	return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if not line.startswith("#")}
+
+
+class TestControllerMetrics:
+	def test_metrics_file(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer, tmp_path: pathlib.Path):
+		metrics_file = tmp_path / "metrics.prom"
+		events = [config_map("cm-0", crash="true"), config_map("cm-1"), config_map("cm-2")]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--persistent", "--metrics-file", str(metrics_file), "--event-types", "MODIFIED", callback="persistent_callback.bash")
+
+		assert proc.returncode == 0
+		assert handled == events[1:]
+
+		metrics = _read_metrics(metrics_file.read_text())
+		assert metrics['controller_events_received_total{type="MODIFIED"}'] == 3
+		assert metrics['controller_events_received_total{type="ADDED"}'] == 0
+		assert metrics["controller_events_filtered_total"] == 0
+		assert metrics["controller_queue_depth"] == 0
+		assert metrics["controller_callback_duration_seconds_count"] == 3
+		assert metrics['controller_callback_duration_seconds_bucket{le="+Inf"}'] == 3
+		assert metrics["controller_event_latency_seconds_count"] == 3
+		assert metrics["controller_callback_failures_total"] == 1
+		assert metrics["controller_seconds_since_last_event"] < 10
+
+	def test_metrics_port(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		with socket.socket() as sock:
+			sock.bind(("127.0.0.1", 0))
+			port = sock.getsockname()[1]
+
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--metrics-port", str(port), "--metrics-interval", "0.1")
+		assert _fake_api_server.wait_for_watch(0)
+
+		_fake_api_server.apply(config_map("cm"), event_type="ADDED")
+
+		def handled() -> bool:
+			try:
+				with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+					return _read_metrics(response.read().decode()).get("controller_callback_duration_seconds_count") == 1
+			except OSError:
+				return False
+
+		assert _wait_until(handled, timeout=10, interval=.1)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+
+	def test_trace_log(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer, tmp_path: pathlib.Path):
+		trace_log = tmp_path / "trace.log"
+		events = [config_map(f"cm-{i}") for i in range(3)]
+
+		proc, handled = _run_fake_controller(_fake_kubectl, _fake_api_server, events, "--trace-log", str(trace_log))
+
+		assert proc.returncode == 0
+
+		traces = [dict(field.split("=", 1) for field in line.split(" ")) for line in trace_log.read_text().splitlines()]
+		assert [trace["key"] for trace in traces] == [f"{CONTROLLER_TEST_NAMESPACE}/cm-{i}" for i in range(3)]
+
+		for trace in traces:
+			assert trace["type"] == "MODIFIED"
+			assert trace["count"] == "1"
+			assert trace["status"] == "0"
+			assert float(trace["enqueued"]) <= float(trace["start"]) <= float(trace["end"])
+
+
+def _cache_callback(bin_dir: pathlib.Path) -> str:
+	'''_cache_callback creates a callback which appends the names of the cached objects in its object's namespace to $CALLBACK_OUT.'''
+	callback = bin_dir / "cache_callback.bash"
+	callback.write_text('''#!/bin/bash
+namespace="$(jq --raw-output .metadata.namespace <<< "$1")"
+jq --slurp --compact-output 'map(.metadata.name) | sort' "$CONTROLLER_CACHE_DIR/$namespace/"*.json >> "$CALLBACK_OUT"
+''')
+	callback.chmod(0o700)
+
+	return callback.name
+
+
+def _read_cached(bin_dir: pathlib.Path) -> list[list[str]]:
+	return [json.loads(line) for line in (bin_dir.parent / "callback_out").read_text().splitlines()]
+
+
+class TestControllerCache:
+	def test_cache(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		_fake_api_server.apply(config_map("cm-0"), event_type="ADDED")
+		_fake_api_server.apply(config_map("cm-1"), event_type="ADDED")
+
+		# objects which are filtered out are still cached
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--cache", "--filter", '.metadata.name == "cm-2"', callback=_cache_callback(_fake_kubectl))
+		assert _fake_api_server.wait_for_watch(2)
+
+		_fake_api_server.apply(config_map("cm-2"), event_type="ADDED")
+		_fake_api_server.apply(config_map("cm-0"), event_type="DELETED")
+		_fake_api_server.apply(config_map("cm-2", version="1"))
+		_fake_api_server.close_watches()
+		assert _fake_api_server.wait_for_watch(5)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+		assert _read_cached(_fake_kubectl)[-1] == ["cm-1", "cm-2"]
+
+	def test_cache_relist(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		_fake_api_server.apply(config_map("cm-0"), event_type="ADDED")
+		_fake_api_server.apply(config_map("cm-1"), event_type="ADDED")
+
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--cache", "--filter", '.metadata.name == "cm-2"', callback=_cache_callback(_fake_kubectl))
+		assert _fake_api_server.wait_for_watch(2)
+
+		# the deletion is compacted away, so it is only noticed once the objects are listed again
+		_fake_api_server.apply_compacted((config_map("cm-0"), "DELETED"), (config_map("cm-2"), "ADDED"))
+		assert _fake_api_server.wait_for_watch(4)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+		assert _fake_api_server.lists() == 2
+		assert _read_cached(_fake_kubectl) == [["cm-1", "cm-2"]]
+
+
+class TestControllerResync:
+	def test_resync(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		for i in range(5):
+			_fake_api_server.apply(config_map(f"cm-{i}"), event_type="ADDED")
+
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--resync", "0.5", "--resync-rate", "100")
+		assert _fake_api_server.wait_for_watch(5)
+
+		time.sleep(2)
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+
+		handled = _read_handled(_fake_kubectl)
+		types = _read_types(_fake_kubectl)
+		assert types[:5] == ["ADDED"] * 5
+		assert set(types[5:]) == {"RESYNC"}
+
+		for i in range(5):
+			assert len([obj for obj in handled if obj["metadata"]["name"] == f"cm-{i}"]) >= 2
+
+	def test_resync_rate(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		for i in range(20):
+			_fake_api_server.apply(config_map(f"cm-{i}"), event_type="ADDED")
+
+		start = time.time()
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--resync", "0.2", "--resync-rate", "5")
+		assert _fake_api_server.wait_for_watch(20)
+
+		time.sleep(2)
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+
+		# the bucket starts empty, and fills up with 5 tokens a second
+		resyncs = _read_types(_fake_kubectl).count("RESYNC")
+		assert 0 < resyncs <= 5 * (time.time() - start) + 1
+
+	def test_retries(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--retries", "2", "--retry-backoff", "0.2")
+		assert _fake_api_server.wait_for_watch(0)
+
+		start = time.time()
+		_fake_api_server.apply(config_map("cm-0", fail="true"))
+		_fake_api_server.apply(config_map("cm-1"))
+
+		assert _wait_until(lambda: len(_read_handled(_fake_kubectl)) == 4, timeout=10, interval=.1)
+		elapsed = time.time() - start
+
+		time.sleep(1)
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+
+		# the failing object does not hold up others, and is only retried --retries times with a growing backoff
+		handled = [obj["metadata"]["name"] for obj in _read_handled(_fake_kubectl)]
+		assert handled == ["cm-0", "cm-1", "cm-0", "cm-0"]
+		assert elapsed >= .2 + .4
+
+	def test_retry_newer_object(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--retries", "1", "--retry-backoff", "60")
+		assert _fake_api_server.wait_for_watch(0)
+
+		_fake_api_server.apply(config_map("cm", fail="true"))
+		assert _wait_until(lambda: len(_read_handled(_fake_kubectl)) == 1, timeout=10, interval=.1)
+
+		# the newer object replaces the one waiting to be retried, and is tried without waiting for the backoff
+		_fake_api_server.apply(config_map("cm", version="1"))
+		assert _wait_until(lambda: len(_read_handled(_fake_kubectl)) == 2, timeout=10, interval=.1)
+
+		returncode, _, stderr = stop_fake_controller(proc)
+
+		assert returncode == 0, stderr
+		assert _read_handled(_fake_kubectl)[-1] == config_map("cm", version="1")
+		assert _read_counts(_fake_kubectl) == [1, 2]
+
+	def test_bad_retries(self, _fake_kubectl: pathlib.Path, _fake_api_server: FakeApiServer):
+		proc = start_fake_controller(_fake_kubectl, _fake_api_server, "--retries", "-1")
+		stdout, _ = proc.communicate(timeout=10)
+
+		assert proc.returncode != 0
+		assert stdout == b"'--retries' expected a number but found '-1'\n"
+
+
 class TestController:
 	def test_visit_specific_configmap(self, _k8s_client: client.ApiClient, _kubeconfig: pathlib.Path, _handler: pathlib.Path, request: pytest.FixtureRequest):
 		cm_name = f"test-configmap-{request.node.name.replace("_", "-")}"
@@ -113,9 +723,9 @@ class TestController:
 		with _k8s_client:
 			proc = subprocess.Popen(
 				args=[
-					_CONTROLLER_PATH, str(_handler),
+					CONTROLLER_PATH, str(_handler),
 					"configmap", cm_name,
-					"--namespace", _CONTROLLER_TEST_NAMESPACE
+					"--namespace", CONTROLLER_TEST_NAMESPACE
 				],
 				env={
 					"KUBECONFIG": str(_kubeconfig),
@@ -125,7 +735,7 @@ class TestController:
 			v1 = client.CoreV1Api(api_client=_k8s_client)
 
 			v1.create_namespaced_config_map(
-				namespace=_CONTROLLER_TEST_NAMESPACE,
+				namespace=CONTROLLER_TEST_NAMESPACE,
 				body={
 					"apiVersion": "v1",
 					"kind": "ConfigMap",
@@ -138,7 +748,7 @@ class TestController:
 				}
 			)
 			def cleanup_configmap():
-				v1.delete_namespaced_config_map(namespace=_CONTROLLER_TEST_NAMESPACE, name=cm_name)
+				v1.delete_namespaced_config_map(namespace=CONTROLLER_TEST_NAMESPACE, name=cm_name)
 			request.addfinalizer(cleanup_configmap)
 
 			def callback() -> bool:
@@ -146,16 +756,15 @@ class TestController:
 
 			assert _wait_until(callback)
 
-			proc.kill()
-			proc.wait()
+			stop_fake_controller(proc)
 
 	def test_visit_all_configmaps_in_namespace(self, _k8s_client: client.ApiClient, _kubeconfig: pathlib.Path, _handler: pathlib.Path, request: pytest.FixtureRequest):
 		with _k8s_client:
 			proc = subprocess.Popen(
 				args=[
-					_CONTROLLER_PATH, str(_handler),
+					CONTROLLER_PATH, str(_handler),
 					"configmap",
-					"--namespace", _CONTROLLER_TEST_NAMESPACE
+					"--namespace", CONTROLLER_TEST_NAMESPACE
 				],
 				env={
 					"KUBECONFIG": str(_kubeconfig),
@@ -166,7 +775,7 @@ class TestController:
 
 			for i in range(5):
 				v1.create_namespaced_config_map(
-					namespace=_CONTROLLER_TEST_NAMESPACE,
+					namespace=CONTROLLER_TEST_NAMESPACE,
 					body={
 						"apiVersion": "v1",
 						"kind": "ConfigMap",
@@ -195,29 +804,28 @@ class TestController:
 			def cleanup_configmaps():
 				v1.delete_namespaced_config_map(namespace="default", name="ignore-me")
 				for i in range(5):
-					v1.delete_namespaced_config_map(namespace=_CONTROLLER_TEST_NAMESPACE, name=f"test-configmap-{request.node.name.replace("_", "-")}-{i}")
+					v1.delete_namespaced_config_map(namespace=CONTROLLER_TEST_NAMESPACE, name=f"test-configmap-{request.node.name.replace("_", "-")}-{i}")
 			request.addfinalizer(cleanup_configmaps)
 			
 			def callback() -> bool:
 				configmaps: client.V1ConfigMapList = v1.list_config_map_for_all_namespaces()
 				for cm in configmaps.items:
-					if cm.metadata.namespace == _CONTROLLER_TEST_NAMESPACE and not _is_config_map_visited(config_map=cm):
+					if cm.metadata.namespace == CONTROLLER_TEST_NAMESPACE and not _is_config_map_visited(config_map=cm):
 						return False
-					elif cm.metadata.namespace != _CONTROLLER_TEST_NAMESPACE and _is_config_map_visited(config_map=cm):
+					elif cm.metadata.namespace != CONTROLLER_TEST_NAMESPACE and _is_config_map_visited(config_map=cm):
 						return False
 				
 				return True
 			
 			assert _wait_until(callback)
 
-			proc.kill()
-			proc.wait()
+			stop_fake_controller(proc)
 
 	def test_visit_all_configmaps_in_cluster(self, _k8s_client: client.ApiClient, _kubeconfig: pathlib.Path, _handler: pathlib.Path, request: pytest.FixtureRequest):
 		with _k8s_client:
 			proc = subprocess.Popen(
 				args=[
-					_CONTROLLER_PATH, str(_handler),
+					CONTROLLER_PATH, str(_handler),
 					"configmap",
 					"--all-namespaces"
 				],
@@ -230,7 +838,7 @@ class TestController:
 
 			for i in range(5):
 				v1.create_namespaced_config_map(
-					namespace=_CONTROLLER_TEST_NAMESPACE,
+					namespace=CONTROLLER_TEST_NAMESPACE,
 					body={
 						"apiVersion": "v1",
 						"kind": "ConfigMap",
@@ -259,7 +867,7 @@ class TestController:
 			def cleanup_configmaps():
 				v1.delete_namespaced_config_map(namespace="default", name="ignore-me")
 				for i in range(5):
-					v1.delete_namespaced_config_map(namespace=_CONTROLLER_TEST_NAMESPACE, name=f"test-configmap-{request.node.name.replace("_", "-")}-{i}")
+					v1.delete_namespaced_config_map(namespace=CONTROLLER_TEST_NAMESPACE, name=f"test-configmap-{request.node.name.replace("_", "-")}-{i}")
 			request.addfinalizer(cleanup_configmaps)
 			
 			def callback() -> bool:
@@ -272,5 +880,4 @@ class TestController:
 			
 			assert _wait_until(callback, timeout=30)
 
-			proc.kill()
-			proc.wait()
+			stop_fake_controller(proc)